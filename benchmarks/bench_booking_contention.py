@@ -0,0 +1,124 @@
+"""Гонка за слоты: сотни пользователей одновременно подтверждают запись.
+
+Сравнивает прежний путь on_confirm (новое соединение, две проверки и INSERT
+с перехватом IntegrityError) с commit_booking() на общем пуле.
+
+    python benchmarks/bench_booking_contention.py --users 500 --slots 40
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiosqlite
+
+import database
+from bookings import commit_booking
+from migrations import create_base_schema, apply_migrations
+
+
+async def prepare_db(path: str, slots: int, days: int):
+    database.pool.path = path
+    await database.pool.open()
+    start = (datetime.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+    rows = []
+    for i in range(slots):
+        dt = start + timedelta(days=i % days, hours=i // days)
+        rows.append((dt.strftime("%Y-%m-%d %H:%M:%S"), database.to_epoch(dt), database.day_key(dt)))
+
+    async with database.pool.writer() as db:
+        await create_base_schema(db)
+        await apply_migrations(db)
+        await db.executemany("INSERT INTO slots (datetime, start_ts, day_key) VALUES (?, ?, ?)", rows)
+
+    cursor_rows = await database.fetchall("SELECT id FROM slots")
+    return [row[0] for row in cursor_rows]
+
+
+async def legacy_confirm(path: str, slot_id: int, user_id: int) -> str:
+    async with aiosqlite.connect(path) as db:
+        await db.execute("PRAGMA foreign_keys = ON")
+        cur = await db.execute("SELECT 1 FROM bookings WHERE slot_id = ? AND user_id = ?", (slot_id, user_id))
+        if await cur.fetchone():
+            return "same_slot"
+        cur = await db.execute("SELECT datetime FROM slots WHERE id = ?", (slot_id,))
+        iso_dt = (await cur.fetchone())[0]
+        cur = await db.execute(
+            "SELECT 1 FROM bookings b JOIN slots s ON b.slot_id = s.id "
+            "WHERE b.user_id = ? AND date(s.datetime) = date(?)",
+            (user_id, iso_dt))
+        if await cur.fetchone():
+            return "same_day"
+        try:
+            await db.execute(
+                "INSERT INTO bookings (slot_id, user_id, name, contact, shoot_type) VALUES (?, ?, ?, ?, ?)",
+                (slot_id, user_id, "Bench", "+70000000000", "bench"))
+            await db.commit()
+        except aiosqlite.IntegrityError:
+            return "slot_taken"
+        return "ok"
+
+
+async def pooled_confirm(path: str, slot_id: int, user_id: int) -> str:
+    result = await commit_booking(slot_id, user_id, "Bench", "+70000000000", "bench")
+    return result.conflict or "ok"
+
+
+async def run(name, confirm, users: int, slots: int, days: int, seed: int):
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    slot_ids = await prepare_db(path, slots, days)
+    rnd = random.Random(seed)
+    # Каждый пользователь пытается занять два случайных слота
+    attempts = [(rnd.choice(slot_ids), 1000 + i % users) for i in range(users * 2)]
+
+    latencies = []
+    outcomes = Counter()
+
+    async def one(slot_id, user_id):
+        started = time.perf_counter()
+        try:
+            outcome = await confirm(path, slot_id, user_id)
+        except Exception as e:
+            outcome = f"error:{type(e).__name__}"
+        latencies.append(time.perf_counter() - started)
+        outcomes[outcome] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(s, u) for s, u in attempts))
+    elapsed = time.perf_counter() - started
+
+    double_slot = await database.fetchone(
+        "SELECT COUNT(*) FROM (SELECT slot_id FROM bookings GROUP BY slot_id HAVING COUNT(*) > 1)")
+    double_day = await database.fetchone(
+        """SELECT COUNT(*) FROM (SELECT b.user_id FROM bookings b JOIN slots s ON s.id = b.slot_id
+        GROUP BY b.user_id, s.day_key HAVING COUNT(*) > 1)""")
+    await database.pool.close()
+
+    latencies.sort()
+    pct = lambda p: latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"{name:>15}: {len(attempts)} attempts in {elapsed:.3f}s "
+          f"({len(attempts) / elapsed:.0f}/s), p50={pct(0.5):.1f}ms p95={pct(0.95):.1f}ms p99={pct(0.99):.1f}ms")
+    print(f"{'':>15}  outcomes={dict(outcomes)} double_slot={double_slot[0]} double_day={double_day[0]}")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--slots", type=int, default=40)
+    parser.add_argument("--days", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    await run("legacy", legacy_confirm, args.users, args.slots, args.days, args.seed)
+    await run("commit_booking", pooled_confirm, args.users, args.slots, args.days, args.seed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
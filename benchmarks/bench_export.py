@@ -0,0 +1,153 @@
+"""Выгрузка записей в Excel на большой базе: время, память и задержка цикла событий.
+
+Сравнивает прежний export_bookings_command (fetchall, обычная книга openpyxl
+и wb.save на цикле событий, файл на диске) с BookingExporter (курсор пачками,
+книга write_only в потоке, результат в памяти). Каждый вариант запускается
+в отдельном процессе, чтобы пик RSS не смешивался.
+
+    python benchmarks/bench_export.py --bookings 100000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import subprocess
+import tempfile
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from openpyxl import Workbook
+
+import database
+from exporter import BookingExporter
+from loop_monitor import LoopMonitor
+from migrations import create_base_schema, apply_migrations
+
+PHOTOGRAPHERS = ("anna", "boris", "vera")
+
+
+def rss_mb() -> float:
+    # ru_maxrss в Linux — килобайты
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def prepare_db(path: str, bookings: int, batch: int = 10000):
+    database.pool.path = path
+    await database.pool.open()
+    start = datetime(2025, 1, 1, 9, 0)
+    created_ts = database.to_epoch(start - timedelta(days=30))
+    async with database.pool.writer() as db:
+        await create_base_schema(db)
+        await apply_migrations(db)
+        await db.executemany(
+            "INSERT INTO photographers (user_id, username) VALUES (?, ?)",
+            [(900 + i, name) for i, name in enumerate(PHOTOGRAPHERS)])
+    for offset in range(0, bookings, batch):
+        slots, rows = [], []
+        for i in range(offset, min(offset + batch, bookings)):
+            # Десять слотов в день, у каждого четвёртого фотограф не назначен
+            dt = start + timedelta(days=i // 10, hours=i % 10)
+            photographer = None if i % 4 == 0 else i % len(PHOTOGRAPHERS) + 1
+            slots.append((i + 1, dt.strftime("%Y-%m-%d %H:%M:%S"), photographer,
+                          database.to_epoch(dt), database.day_key(dt)))
+            rows.append((i + 1, 100000 + i, f"Клиент {i}", f"+7900{i:07d}", "Портрет",
+                         database.day_key(dt), created_ts + i))
+        async with database.pool.writer() as db:
+            await db.executemany(
+                "INSERT INTO slots (id, datetime, photographer_id, start_ts, day_key) VALUES (?, ?, ?, ?, ?)", slots)
+            await db.executemany(
+                """INSERT INTO bookings (slot_id, user_id, name, contact, shoot_type, day_key, created_ts)
+                VALUES (?, ?, ?, ?, ?, ?, ?)""", rows)
+    await database.pool.close()
+
+
+async def legacy_export(workdir: str) -> dict:
+    rows = await database.fetchall(
+        """SELECT s.datetime, b.name, b.contact, b.shoot_type, b.created_at, p.username
+           FROM bookings b
+           JOIN slots s ON b.slot_id = s.id
+           LEFT JOIN photographers p ON s.photographer_id = p.id
+           ORDER BY s.datetime""")
+    wb = Workbook()
+    ws = wb.active
+    ws.append(["Дата", "Время", "Имя", "Телефон", "Тип съёмки", "Дата записи", "Фотограф"])
+    for dt_text, name, contact, shoot_type, created_at, photographer in rows:
+        dt_obj = datetime.strptime(dt_text, "%Y-%m-%d %H:%M:%S")
+        created_obj = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
+        ws.append([dt_obj.strftime("%d.%m.%Y"), dt_obj.strftime("%H:%M"), name, contact, shoot_type,
+                   created_obj.strftime("%d.%m.%Y %H:%M"), photographer or "Не назначен"])
+    filename = os.path.join(workdir, "legacy_export.xlsx")
+    wb.save(filename)
+    size = os.path.getsize(filename)
+    os.remove(filename)
+    return {"rows": len(rows), "bytes": size}
+
+
+async def streaming_export(batch_size: int) -> dict:
+    exporter = BookingExporter(batch_size=batch_size)
+    try:
+        result = await exporter.export()
+    finally:
+        exporter.shutdown()
+    return {"rows": result.count, "bytes": len(result.data)}
+
+
+async def run_one(mode: str, path: str, batch_size: int):
+    database.pool.path = path
+    await database.pool.open()
+    monitor = LoopMonitor(interval_ms=10, threshold_ms=0)
+    monitor.start()
+    baseline = rss_mb()
+    started = time.perf_counter()
+    if mode == "legacy":
+        result = await legacy_export(os.path.dirname(path))
+    else:
+        result = await streaming_export(batch_size)
+    result["elapsed_s"] = round(time.perf_counter() - started, 2)
+    # Даём сторожу проснуться: иначе блокировка в самом конце выгрузки не попадёт в замер
+    await asyncio.sleep(monitor.interval * 2)
+    await monitor.stop()
+    await database.pool.close()
+    result.update(mode=mode, baseline_rss_mb=round(baseline, 1), peak_rss_mb=round(rss_mb(), 1),
+                  loop_lag_max_ms=monitor.stats()["lag_max_ms"])
+    print(json.dumps(result))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--bookings", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--modes", default="streaming,legacy")
+    parser.add_argument("--run", help=argparse.SUPPRESS)
+    parser.add_argument("--db", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        asyncio.run(run_one(args.run, args.db, args.batch_size))
+        return
+
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_export_"), "bench.db")
+    started = time.perf_counter()
+    asyncio.run(prepare_db(path, args.bookings))
+    print(f"prepared {args.bookings} bookings in {time.perf_counter() - started:.1f}s ({path})")
+
+    for mode in args.modes.split(","):
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--run", mode, "--db", path,
+             "--batch-size", str(args.batch_size)],
+            check=True, capture_output=True, text=True).stdout
+        row = json.loads(output.strip().splitlines()[-1])
+        print(f"{mode:>10}: {row['rows']} rows in {row['elapsed_s']}s "
+              f"({row['rows'] / row['elapsed_s']:.0f}/s), xlsx {row['bytes'] / 1e6:.1f} MB, "
+              f"RSS {row['baseline_rss_mb']} -> {row['peak_rss_mb']} MB "
+              f"(+{row['peak_rss_mb'] - row['baseline_rss_mb']:.1f}), "
+              f"max loop lag {row['loop_lag_max_ms']} ms")
+
+
+if __name__ == "__main__":
+    main()
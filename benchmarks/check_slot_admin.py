@@ -0,0 +1,101 @@
+"""Проверки массовых операций со слотами на временной базе со всеми миграциями и триггерами.
+
+Каждая проверка получает чистую базу; при расхождении скрипт печатает
+FAIL и завершается с кодом 1.
+
+    python benchmarks/check_slot_admin.py
+"""
+import os
+import sys
+import asyncio
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database
+from migrations import create_base_schema, apply_migrations
+from slot_admin import bulk_add_slots, count_past_targets, shift_free_slots
+
+DAY = (datetime.now() + timedelta(days=7)).replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+async def fresh_db():
+    await database.pool.close()
+    database.pool.path = os.path.join(tempfile.mkdtemp(prefix="check_slots_"), "check.db")
+    await database.pool.open()
+    async with database.pool.writer() as db:
+        await create_base_schema(db)
+        await apply_migrations(db)
+
+
+def expect(name: str, actual, expected):
+    if actual != expected:
+        raise AssertionError(f"{name}: expected {expected!r}, got {actual!r}")
+
+
+async def check_bulk_add_counts():
+    """Триггеры slot_changes не должны попадать в число созданных слотов"""
+    hours = [DAY.replace(hour=h) for h in (10, 11, 12)]
+    expect("first run", await bulk_add_slots(hours), (3, 0))
+    expect("repeat run", await bulk_add_slots(hours + [DAY.replace(hour=13)]), (1, 3))
+    row = await database.fetchone("SELECT COUNT(*) FROM slots")
+    expect("slots in db", row[0], 4)
+
+
+async def check_shift_chain_conflict():
+    """Слот, упёршийся в чужой, остаётся на месте и блокирует тех, кто сдвигается на его время"""
+    await bulk_add_slots([DAY.replace(hour=h) for h in (10, 11, 12)])
+    # В периоде только 10:00 и 11:00; 12:00 за его пределами и не двигается
+    result = await shift_free_slots(DAY.replace(hour=10), DAY.replace(hour=12), timedelta(hours=1))
+    expect("changed", result.changed, 0)
+    expect("conflicts", result.conflicts, 2)
+    rows = await database.fetchall("SELECT datetime FROM slots ORDER BY datetime")
+    expect("slot times", [row[0][11:16] for row in rows], ["10:00", "11:00", "12:00"])
+
+    # Без препятствия цепочка сдвигается целиком
+    result = await shift_free_slots(DAY.replace(hour=10), DAY.replace(hour=13), timedelta(hours=1))
+    expect("changed", result.changed, 3)
+    rows = await database.fetchall("SELECT datetime FROM slots ORDER BY datetime")
+    expect("slot times", [row[0][11:16] for row in rows], ["11:00", "12:00", "13:00"])
+
+
+async def check_shift_into_past():
+    """Сдвиг назад не уводит слоты в прошлое: они остаются на месте как конфликты"""
+    now = database.local_now().replace(second=0, microsecond=0)
+    soon, later = now + timedelta(hours=1), now + timedelta(days=2)
+    await bulk_add_slots([soon, later])
+    delta = -timedelta(hours=2)
+    expect("preview", await count_past_targets(now, later + timedelta(hours=1), delta), 1)
+    result = await shift_free_slots(now, later + timedelta(hours=1), delta)
+    expect("changed", result.changed, 1)
+    expect("conflicts", result.conflicts, 1)
+    rows = await database.fetchall("SELECT start_ts FROM slots ORDER BY start_ts")
+    expect("slot times", [row[0] for row in rows],
+           [database.to_epoch(soon), database.to_epoch(later + delta)])
+
+
+CHECKS = [check_bulk_add_counts, check_shift_chain_conflict, check_shift_into_past]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.parse_args()
+
+    failed = 0
+    for check in CHECKS:
+        await fresh_db()
+        try:
+            await check()
+        except Exception as e:
+            failed += 1
+            print(f"FAIL {check.__name__}: {type(e).__name__}: {e}")
+        else:
+            print(f"ok   {check.__name__}")
+    await database.pool.close()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,161 @@
+"""Локальная замена Bot API для нагрузочных тестов.
+
+Отвечает на getUpdates из очереди push() и принимает sendMessage,
+editMessageText, sendPhoto, sendDocument и прочие вызовы, запоминая их
+по чатам. Бот подключается к нему через TelegramAPIServer.from_base(url).
+"""
+import json
+import time
+import asyncio
+import itertools
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from aiohttp import web
+
+BOT_USER = {"id": 42, "is_bot": True, "first_name": "LoadTest", "username": "load_test_bot"}
+
+
+class ApiCall(NamedTuple):
+    method: str
+    chat_id: Optional[int]
+    params: Dict[str, Any]
+    result: Any
+    ts: float
+
+    @property
+    def buttons(self) -> List[str]:
+        """callback_data всех inline-кнопок вызова"""
+        markup = self.params.get("reply_markup") or {}
+        return [button.get("callback_data", "")
+                for row in markup.get("inline_keyboard", []) for button in row]
+
+    @property
+    def text(self) -> str:
+        return self.params.get("text") or self.params.get("caption") or ""
+
+
+class FakeBotAPI:
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+        self.chat_calls: Dict[int, Counter] = defaultdict(Counter)
+        self._updates: List[dict] = []
+        self._new_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1_000_000)
+        self._file_ids = itertools.count(1)
+        self._listeners: Dict[int, asyncio.Queue] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+        self.polling = False  # бот уже запросил getUpdates
+
+    # --- сторона пользователя ---
+
+    def listen(self, chat_id: int) -> asyncio.Queue:
+        """Очередь вызовов, адресованных чату"""
+        return self._listeners.setdefault(chat_id, asyncio.Queue())
+
+    def push(self, update: Dict[str, Any]) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **update})
+        self._new_updates.set()
+        return update_id
+
+    # --- сторона бота ---
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[dict]:
+        self.polling = True
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    def _message(self, chat_id: int, params: Dict[str, Any], message_id: Optional[int] = None) -> dict:
+        message = {
+            "message_id": message_id or next(self._message_ids),
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+        }
+        if "text" in params:
+            message["text"] = params["text"]
+        if "caption" in params:
+            message["caption"] = params["caption"]
+        return message
+
+    def _file(self) -> dict:
+        n = next(self._file_ids)
+        return {"file_id": f"file-{n}", "file_unique_id": f"unique-{n}"}
+
+    def _result(self, method: str, chat_id: Optional[int], params: Dict[str, Any]) -> Any:
+        if method == "getMe":
+            return BOT_USER
+        if method == "sendMessage":
+            return self._message(chat_id, params)
+        if method == "sendPhoto":
+            message = self._message(chat_id, params)
+            message["photo"] = [{**self._file(), "width": 800, "height": 600}]
+            return message
+        if method == "sendDocument":
+            message = self._message(chat_id, params)
+            message["document"] = {**self._file(), "file_name": "file"}
+            return message
+        if method in ("editMessageText", "editMessageReplyMarkup") and params.get("message_id"):
+            return self._message(chat_id, params, int(params["message_id"]))
+        return True
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        try:
+            form = await request.post()
+        except ConnectionResetError:
+            # Бот оборвал загрузку файла при остановке
+            return web.Response(status=400)
+        params: Dict[str, Any] = {}
+        for key, value in form.items():
+            if isinstance(value, web.FileField):
+                params[key] = f"<upload {value.filename}>"
+            elif key == "reply_markup":
+                params[key] = json.loads(value)
+            else:
+                params[key] = value
+
+        if method == "getUpdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        chat_id = int(params["chat_id"]) if "chat_id" in params else None
+        if chat_id is None and method == "answerCallbackQuery":
+            # Ответ на нажатие приходит без chat_id: id запроса вида "<чат>:<номер>"
+            chat_id = int(params["callback_query_id"].split(":", 1)[0])
+        result = self._result(method, chat_id, params)
+        self.calls[method] += 1
+        if chat_id is not None:
+            self.chat_calls[chat_id][method] += 1
+            queue = self._listeners.get(chat_id)
+            if queue is not None:
+                queue.put_nowait(ApiCall(method, chat_id, params, result, time.perf_counter()))
+        return web.json_response({"ok": True, "result": result})
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route("*", "/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+        return self.url
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
@@ -0,0 +1,401 @@
+"""Сквозная нагрузка: тысячи синтетических пользователей записываются через бота.
+
+main.py запускается отдельным процессом как в продакшене (long polling,
+FSM в SQLite, outbox, sender), но TELEGRAM_API_URL указывает на локальный
+fake_bot_api, поэтому тест не ходит в сеть. Каждый пользователь проходит
+/book → дата → время → тип → имя → телефон → подтверждение; параллельно
+администраторы выгружают Excel и смотрят статистику. Задержка шага —
+от отправки апдейта до последнего вызова API, которым отвечает обработчик.
+
+По умолчанию лимиты Telegram в sender сняты, чтобы мерить сам бот;
+--telegram-limits оставляет их как в продакшене.
+
+    python benchmarks/load_test.py --users 2000 --admins 2 [--workers 4]
+"""
+import os
+import sys
+import glob
+import json
+import time
+import signal
+import random
+import asyncio
+import argparse
+import tempfile
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import database
+from migrations import create_base_schema, apply_migrations
+from fake_bot_api import ApiCall, FakeBotAPI
+
+ADMIN_PASSWORD = "loadtest-password"
+ADMIN_BASE_ID = 900_000_000
+USER_BASE_ID = 100_000_000
+
+
+class StepTimeout(Exception):
+    pass
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))] * 1000
+
+
+class Client:
+    """Синтетический пользователь Telegram в личном чате с ботом"""
+
+    def __init__(self, api: FakeBotAPI, user_id: int, latencies: Dict[str, List[float]], timeout: float,
+                 think: float = 0.0):
+        self.api = api
+        self.think = think
+        self.user_id = user_id
+        self.calls = api.listen(user_id)
+        self.latencies = latencies
+        self.timeout = timeout
+        self._message_ids = iter(range(1, 10 ** 9))
+        self._callback_ids = iter(range(1, 10 ** 9))
+        self.user = {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "language_code": "ru"}
+        self.chat = {"id": user_id, "type": "private", "first_name": f"User{user_id}"}
+
+    def send_text(self, text: str):
+        message = {"message_id": next(self._message_ids), "date": int(time.time()),
+                   "chat": self.chat, "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"offset": 0, "length": len(text.split()[0]), "type": "bot_command"}]
+        self.api.push({"message": message})
+
+    def press(self, message_id: int, data: str) -> str:
+        callback_id = f"{self.user_id}:{next(self._callback_ids)}"
+        self.api.push({"callback_query": {
+            "id": callback_id, "from": self.user, "chat_instance": str(self.user_id), "data": data,
+            "message": {"message_id": message_id, "date": int(time.time()), "chat": self.chat,
+                        "from": {"id": 42, "is_bot": True, "first_name": "LoadTest"}, "text": "…"},
+        }})
+        return callback_id
+
+    async def step(self, name: str, send: Callable[[], Optional[str]],
+                   done: Callable[[ApiCall, Optional[str]], Optional[str]]):
+        """Отправляет апдейт и ждёт вызова API, которым обработчик заканчивается.
+
+        done(call, callback_id) возвращает исход шага или None, если вызов не последний.
+        """
+        if self.think:
+            # Живой пользователь читает ответ перед следующим нажатием
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.think)
+        while not self.calls.empty():
+            self.calls.get_nowait()
+        started = time.perf_counter()
+        callback_id = send()
+        deadline = started + self.timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise StepTimeout(name)
+            try:
+                call = await asyncio.wait_for(self.calls.get(), remaining)
+            except asyncio.TimeoutError:
+                raise StepTimeout(name)
+            outcome = done(call, callback_id)
+            if outcome is not None:
+                self.latencies[name].append(call.ts - started)
+                return outcome, call
+
+
+def has_button(call: ApiCall, prefix: str) -> bool:
+    return any(data.startswith(prefix) for data in call.buttons)
+
+
+def callback_answered(call: ApiCall, callback_id: Optional[str], alert: bool = False) -> bool:
+    return (call.method == "answerCallbackQuery" and call.params.get("callback_query_id") == callback_id
+            and (str(call.params.get("show_alert")).lower() == "true") == alert)
+
+
+async def book(client: Client, templates: dict, retries: int) -> str:
+    """Полный сценарий записи; возвращает исход"""
+
+    def dates_shown(call: ApiCall, _=None) -> Optional[str]:
+        if call.method == "sendMessage" and has_button(call, "date:"):
+            return "dates"
+        if call.method == "sendMessage" and "нет свободных слотов" in call.text:
+            return "no_slots"
+        return None
+
+    outcome, call = await client.step("cmd_book", lambda: client.send_text("/book"), dates_shown)
+    if outcome == "no_slots":
+        return "no_slots"
+
+    for _ in range(retries + 1):
+        dialog_id = call.result["message_id"]
+        date = random.choice([d for d in call.buttons if d.startswith("date:")])
+
+        def times_shown(call: ApiCall, callback_id: str):
+            if call.method == "editMessageText" and has_button(call, "time:"):
+                return "times"
+            # Дата успела закончиться, пока календарь был открыт или пока строилась клавиатура
+            if call.method == "editMessageText" and has_button(call, "cal:"):
+                return "stale"
+            return "stale" if callback_answered(call, callback_id, alert=True) else None
+
+        outcome, call = await client.step("on_date_chosen", lambda: client.press(dialog_id, date), times_shown)
+        if outcome == "stale":
+            outcome, call = await client.step("cmd_book", lambda: client.send_text("/book"), dates_shown)
+            if outcome == "no_slots":
+                return "no_slots"
+            continue
+        slot = random.choice([d for d in call.buttons if d.startswith("time:")])
+
+        def expect(marker: str, method: str = "editMessageText"):
+            def done(call: ApiCall, _):
+                if call.method == method and marker in call.text:
+                    return "ok"
+                return dates_shown(call)
+            return done
+
+        outcome, call = await client.step("on_time_chosen", lambda: client.press(dialog_id, slot),
+                                          expect(templates["ask_type"]))
+        if outcome != "ok":
+            continue
+        outcome, call = await client.step("on_type_received", lambda: client.send_text("Портрет"),
+                                          expect(templates["ask_name"]))
+        if outcome != "ok":
+            continue
+        outcome, call = await client.step("on_name_received", lambda: client.send_text("Анна"),
+                                          expect(templates["ask_contact"], "sendMessage"))
+        if outcome != "ok":
+            continue
+
+        def confirm_shown(call: ApiCall, _):
+            if call.method == "editMessageText" and has_button(call, "confirm:yes"):
+                return "ok"
+            return dates_shown(call)
+
+        phone = f"+79{client.user_id % 10 ** 9:09d}"
+        outcome, call = await client.step("on_contact_received", lambda: client.send_text(phone), confirm_shown)
+        if outcome != "ok":
+            continue
+
+        result = {}
+
+        def confirmed(call: ApiCall, callback_id: str):
+            if call.method == "editMessageText":
+                result["text"] = call.text
+                if "уже записаны на этот" in call.text:
+                    return "done"
+            if callback_answered(call, callback_id):
+                return "done"
+            return dates_shown(call)
+
+        outcome, call = await client.step("on_confirm", lambda: client.press(dialog_id, "confirm:yes"), confirmed)
+        if outcome == "done":
+            text = result.get("text", "")
+            if text.startswith(templates["booking_confirmed"].split("{", 1)[0]):
+                return "booked"
+            if text == templates["slot_taken_error"]:
+                # Слот перехватили между выбором и подтверждением — начинаем заново
+                outcome, call = await client.step("cmd_book", lambda: client.send_text("/book"), dates_shown)
+                if outcome == "no_slots":
+                    return "no_slots"
+                continue
+            return "rejected"
+    return "gave_up"
+
+
+async def run_user(client: Client, templates: dict, retries: int, ramp: float, outcomes: Counter):
+    await asyncio.sleep(random.uniform(0, ramp))
+    try:
+        outcomes[await book(client, templates, retries)] += 1
+    except StepTimeout as e:
+        outcomes[f"timeout:{e}"] += 1
+
+
+async def run_admin(client: Client, templates: dict, stop: asyncio.Event, interval: float, outcomes: Counter):
+    def admin_menu(call: ApiCall, _):
+        return "ok" if call.method == "sendMessage" and has_button(call, "admin:export") else None
+
+    try:
+        await client.step("admin_panel", lambda: client.send_text("/admin"),
+                          lambda call, _: "ok" if call.method == "sendMessage" else None)
+        _, menu = await client.step("admin_login_password", lambda: client.send_text(ADMIN_PASSWORD), admin_menu)
+        menu_id = menu.result["message_id"]
+        while not stop.is_set():
+            for action in ("export", "stats"):
+                await client.step(f"admin_actions:{action}", lambda: client.press(menu_id, f"admin:{action}"),
+                                  lambda call, callback_id: "ok" if callback_answered(call, callback_id) else None)
+                outcomes[f"admin_{action}"] += 1
+            try:
+                await asyncio.wait_for(stop.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+    except StepTimeout as e:
+        outcomes[f"timeout:{e}"] += 1
+
+
+async def prepare_db(path: str, count: int, days: int):
+    database.pool.path = path
+    await database.pool.open()
+    start = (datetime.now() + timedelta(days=1)).replace(hour=9, minute=0, second=0, microsecond=0)
+    per_day = max(1, -(-count // days))
+    rows = []
+    for i in range(count):
+        dt = start + timedelta(days=i // per_day, minutes=15 * (i % per_day))
+        rows.append((dt.strftime("%Y-%m-%d %H:%M:%S"), database.to_epoch(dt), database.day_key(dt)))
+    async with database.pool.writer() as db:
+        await create_base_schema(db)
+        await apply_migrations(db)
+        await db.executemany("INSERT INTO slots (datetime, start_ts, day_key) VALUES (?, ?, ?)", rows)
+    await database.pool.close()
+
+
+def bot_env(args, api_url: str, db_path: str, admin_ids: List[int]) -> Dict[str, str]:
+    import bcrypt
+
+    env = os.environ.copy()
+    env.update(
+        BOT_TOKEN="123456:LOAD-TEST",
+        TELEGRAM_API_URL=api_url,
+        ADMIN_IDS=",".join(map(str, admin_ids)),
+        ADMIN_PASSWORD=ADMIN_PASSWORD,
+        ADMIN_PASSWORD_HASH=bcrypt.hashpw(ADMIN_PASSWORD.encode(), bcrypt.gensalt()).decode(),
+        DB_PATH=db_path,
+        SLOTS_DAYS_AHEAD=str(args.days),
+        BOT_MODE="polling",
+        BOT_WORKERS=str(args.workers),
+    )
+    if not args.telegram_limits:
+        env.update(SENDER_RATE="1000000", SENDER_CHAT_RATE="1000000")
+    return env
+
+
+async def wait_for_bot(api: FakeBotAPI, proc, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while not api.polling:
+        if proc.returncode is not None:
+            raise RuntimeError(f"bot exited with code {proc.returncode}")
+        if time.monotonic() > deadline:
+            raise RuntimeError("bot did not start polling")
+        await asyncio.sleep(0.1)
+
+
+def log_lines(path: str, marker: str) -> List[str]:
+    lines = []
+    try:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    line = json.loads(line)["msg"]  # LOG_FORMAT=json
+                except ValueError:
+                    pass
+                if marker in line:
+                    lines.append(line.rstrip())
+    except FileNotFoundError:
+        pass
+    return lines
+
+
+async def run(args):
+    # bot.db, bot.log, templates.json и выгрузки Excel — во временном каталоге
+    workdir = tempfile.mkdtemp(prefix="loadtest-")
+    db_path = os.path.join(workdir, "bot.db")
+    slots = args.slots or int(args.users * 1.2)
+    await prepare_db(db_path, slots, args.days)
+
+    api = FakeBotAPI(latency=args.api_latency / 1000)
+    await api.start()
+    admin_ids = [ADMIN_BASE_ID + i for i in range(max(args.admins, 1))]
+    with open(os.path.join(workdir, "console.log"), "w") as console:
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "main.py"), cwd=workdir,
+            env=bot_env(args, api.url, db_path, admin_ids), stdout=console, stderr=console)
+    try:
+        await wait_for_bot(api, proc)
+        with open(os.path.join(workdir, "templates.json"), encoding="utf-8") as f:
+            templates = json.load(f)
+
+        latencies: Dict[str, List[float]] = defaultdict(list)
+        outcomes = Counter()
+        users = [Client(api, USER_BASE_ID + i, latencies, args.timeout, args.think / 1000) for i in range(args.users)]
+        admins = [Client(api, admin_id, latencies, args.timeout) for admin_id in admin_ids[:args.admins]]
+        stop_admins = asyncio.Event()
+
+        started = time.perf_counter()
+        admin_tasks = [asyncio.create_task(run_admin(a, templates, stop_admins, args.admin_interval, outcomes))
+                       for a in admins]
+        await asyncio.gather(*(run_user(u, templates, args.retries, args.ramp, outcomes) for u in users))
+        elapsed = time.perf_counter() - started
+        stop_admins.set()
+        await asyncio.gather(*admin_tasks)
+    finally:
+        if proc.returncode is None:
+            proc.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(proc.wait(), 60)
+            except asyncio.TimeoutError:
+                proc.kill()
+        await api.stop()
+
+    database.pool.path = db_path
+    row = await database.fetchone("SELECT COUNT(*), COUNT(DISTINCT slot_id) FROM bookings")
+    await database.pool.close()
+
+    user_ids = {u.user_id for u in users}
+    user_calls = Counter()
+    for chat_id, counter in api.chat_calls.items():
+        if chat_id in user_ids:
+            user_calls.update(counter)
+    booked = outcomes["booked"]
+
+    print(f"users: {args.users}, admins: {args.admins}, slots: {slots}, workers: {args.workers}, "
+          f"api latency: {args.api_latency} ms, think: {args.think} ms, telegram limits: {args.telegram_limits}")
+    print(f"elapsed: {elapsed:.1f} s, bookings: {booked}, throughput: {booked / elapsed:.1f} bookings/s")
+    print(f"outcomes: {dict(outcomes)}")
+    print(f"bookings in DB: {row[0]} (distinct slots: {row[1]})")
+    print(f"\n{'handler':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for name, samples in sorted(latencies.items()):
+        print(f"{name:<28}{len(samples):>7}{percentile(samples, 0.5):>10.1f}"
+              f"{percentile(samples, 0.95):>10.1f}{percentile(samples, 0.99):>10.1f}")
+    if booked:
+        total = sum(user_calls.values())
+        per_method = ", ".join(f"{m}={n / booked:.2f}" for m, n in user_calls.most_common())
+        print(f"\nAPI calls per booking (user chats): {total / booked:.2f} ({per_method})")
+    print(f"all API calls: {dict(api.calls)}")
+    # Статистику пула и sender бот пишет в лог при остановке; рабочие процессы — в bot.workerN.log
+    for path in sorted(glob.glob(os.path.join(workdir, "bot*.log"))):
+        for line in log_lines(path, "stats:"):
+            print(f"{os.path.basename(path)}: {line}")
+    print(f"bot files: {workdir}")
+
+    assert row[0] == row[1], "slot booked twice"
+    assert row[0] >= booked, "confirmed booking missing in DB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--admins", type=int, default=1, help="администраторы с выгрузкой и статистикой")
+    parser.add_argument("--slots", type=int, default=0, help="по умолчанию на 20%% больше пользователей")
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--ramp", type=float, default=5, help="пользователи приходят равномерно за N секунд")
+    parser.add_argument("--retries", type=int, default=10, help="попыток, если слот заняли")
+    parser.add_argument("--think", type=float, default=300, help="пауза пользователя между шагами, мс")
+    parser.add_argument("--admin-interval", type=float, default=2)
+    parser.add_argument("--workers", type=int, default=1, help="BOT_WORKERS: процессов бота")
+    parser.add_argument("--api-latency", type=float, default=20, help="задержка ответа Bot API, мс")
+    parser.add_argument("--timeout", type=float, default=60, help="максимум на один шаг, с")
+    parser.add_argument("--telegram-limits", action="store_true", help="оставить лимиты отправки Telegram")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""Прогон записанных апдейтов через вебхук-сервер на локальном aiohttp.
+
+Каждый записанный диалог размножается на --chats пользователей и
+отправляется параллельно. Обработчики только имитируют работу (--work мс),
+к Bot API запросов нет. Проверяются секрет, health/readiness, лимит
+одновременной обработки и порядок апдейтов внутри чата.
+
+    python benchmarks/replay_webhook.py --chats 200 --concurrency 50
+"""
+import os
+import sys
+import copy
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import ClientSession
+from aiohttp.test_utils import TestServer
+from aiogram import Bot, Dispatcher, Router
+from aiogram.types import CallbackQuery, Message
+
+import database
+from webhook import SECRET_HEADER, WebhookServer, update_chat_id
+
+SECRET = "replay-secret"
+DEFAULT_UPDATES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "recorded_updates.jsonl")
+
+
+def load_updates(path: str):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def retarget(update: dict, chat_id: int, update_id: int) -> dict:
+    """Копия апдейта от имени другого пользователя"""
+    update = copy.deepcopy(update)
+    update["update_id"] = update_id
+    for key, event in update.items():
+        if not isinstance(event, dict):
+            continue
+        for obj in (event, event.get("message") or {}):
+            if "chat" in obj:
+                obj["chat"]["id"] = chat_id
+            if "from" in obj and not obj["from"].get("is_bot"):
+                obj["from"]["id"] = chat_id
+    return update
+
+
+def build_dispatcher(work: float):
+    state = {"active": 0, "peak": 0, "seen": defaultdict(list)}
+    router = Router()
+
+    async def simulate(update_id: int, chat_id: int):
+        state["active"] += 1
+        state["peak"] = max(state["peak"], state["active"])
+        try:
+            await asyncio.sleep(work)
+            state["seen"][chat_id].append(update_id)
+        finally:
+            state["active"] -= 1
+
+    @router.message()
+    async def on_message(message: Message, event_update):
+        await simulate(event_update.update_id, message.chat.id)
+
+    @router.callback_query()
+    async def on_callback(callback: CallbackQuery, event_update):
+        await simulate(event_update.update_id, callback.from_user.id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp, state
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(int(len(values) * q), len(values) - 1)] * 1000 if values else 0.0
+
+
+async def run(args):
+    recorded = load_updates(args.updates)
+    dp, state = build_dispatcher(args.work / 1000)
+    bot = Bot("42:REPLAY")
+    server = WebhookServer(dp, bot, SECRET, max_concurrency=args.concurrency)
+    test_server = TestServer(server.build_app("/webhook"))
+    await test_server.start_server()
+    base = str(test_server.make_url(""))
+
+    # Диалоги: для каждого чата своя последовательность апдейтов
+    dialogs, update_id = [], 1
+    for chat in range(args.chats):
+        chat_id = 100000 + chat
+        dialog = []
+        for update in recorded:
+            dialog.append(retarget(update, chat_id, update_id))
+            update_id += 1
+        dialogs.append(dialog)
+    total = update_id - 1
+
+    tmp = tempfile.mkdtemp()
+    try:
+        async with ClientSession() as http:
+            async with http.get(base + "/healthz") as resp:
+                assert resp.status == 200, f"healthz: {resp.status}"
+            async with http.get(base + "/readyz") as resp:
+                assert resp.status == 503, f"readyz before startup: {resp.status}"
+
+            database.pool.path = os.path.join(tmp, "replay.db")
+            await database.pool.open()
+            server.ready = True
+            async with http.get(base + "/readyz") as resp:
+                assert resp.status == 200, f"readyz after startup: {resp.status}"
+
+            async with http.post(base + "/webhook", json=recorded[0],
+                                 headers={SECRET_HEADER: "wrong"}) as resp:
+                assert resp.status == 401, f"wrong secret: {resp.status}"
+
+            latencies = []
+
+            async def post(update):
+                started = time.perf_counter()
+                async with http.post(base + "/webhook", json=update, headers={SECRET_HEADER: SECRET}) as resp:
+                    assert resp.status == 200, f"update {update['update_id']}: {resp.status}"
+                latencies.append(time.perf_counter() - started)
+
+            async def replay_dialog(dialog):
+                # Telegram шлёт апдейты одного чата по очереди
+                for update in dialog:
+                    await post(update)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(replay_dialog(d) for d in dialogs))
+            await server.drain()
+            elapsed = time.perf_counter() - started
+    finally:
+        await test_server.close()
+        await bot.session.close()
+        if database.pool.is_open:
+            await database.pool.close()
+
+    stats = server.stats()
+    ordered = all(state["seen"][update_chat_id(d[0])] == [u["update_id"] for u in d] for d in dialogs)
+    print(f"updates: {total}, chats: {args.chats}, concurrency limit: {args.concurrency}, work: {args.work} ms")
+    print(f"elapsed: {elapsed:.2f} s, throughput: {total / elapsed:.0f} updates/s")
+    print(f"response latency: p50 {percentile(latencies, 0.5):.1f} ms, p95 {percentile(latencies, 0.95):.1f} ms")
+    print(f"peak in handlers: {state['peak']}, per-chat order kept: {ordered}")
+    print(f"server stats: {stats}")
+
+    assert stats["handled"] == total and stats["failed"] == 0, stats
+    assert stats["rejected"] == 1, stats
+    assert state["peak"] <= args.concurrency, state["peak"]
+    assert ordered, "updates of one chat were reordered"
+    print("OK")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", default=DEFAULT_UPDATES, help="JSONL с записанными апдейтами")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--work", type=float, default=20, help="время обработки апдейта, мс")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+import calendar
+from datetime import date, datetime
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+from slot_index import SlotIndex, slot_index
+
+MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь",
+          "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь", "Декабрь"]
+WEEKDAYS = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+TIME_PAGE_SIZE = 12
+NOOP = "none"  # неактивные кнопки: пустые дни, заголовки
+
+
+def _noop(text: str = " ") -> InlineKeyboardButton:
+    return InlineKeyboardButton(text=text, callback_data=NOOP)
+
+
+def _month_offset(day: date, today: date) -> int:
+    return (day.year - today.year) * 12 + day.month - today.month
+
+
+class CalendarKeyboards:
+    """Клавиатуры выбора даты (сетка месяца) и времени (страницы) с кэшем.
+
+    Разметка зависит только от страницы, текущей даты и версии индекса
+    слотов, поэтому одна и та же клавиатура строится один раз и отдаётся
+    всем пользователям. При смене версии кэш сбрасывается целиком.
+    """
+
+    def __init__(self, index: SlotIndex = slot_index):
+        self.index = index
+        self._cache: Dict[tuple, InlineKeyboardMarkup] = {}
+        self._cache_version: Optional[Tuple[int, date]] = None
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key: tuple, now: datetime, build) -> InlineKeyboardMarkup:
+        # Прошедшие слоты убираются из индекса с ростом версии — тогда и кэш устаревает
+        self.index.prune(now)
+        version = (self.index.version, now.date())
+        if version != self._cache_version:
+            self._cache.clear()
+            self._cache_version = version
+
+        markup = self._cache.get(key)
+        if markup is None:
+            self.misses += 1
+            markup = self._cache[key] = build()
+        else:
+            self.hits += 1
+        return markup
+
+    def page_count(self, now: datetime, days_ahead: int) -> int:
+        dates = self.index.available_dates(now, days_ahead)
+        return _month_offset(dates[-1], now.date()) + 1 if dates else 0
+
+    def page_of(self, day: date, now: datetime) -> int:
+        return max(_month_offset(day, now.date()), 0)
+
+    def dates(self, page: int, now: datetime, days_ahead: int) -> InlineKeyboardMarkup:
+        return self._cached(("dates", page, days_ahead), now,
+                            lambda: self._build_dates(page, now, days_ahead))
+
+    def times(self, day: date, page: int, now: datetime, days_ahead: int) -> InlineKeyboardMarkup:
+        return self._cached(("times", day, page, days_ahead), now,
+                            lambda: self._build_times(day, page, now, days_ahead))
+
+    def _build_dates(self, page: int, now: datetime, days_ahead: int) -> InlineKeyboardMarkup:
+        today = now.date()
+        pages = self.page_count(now, days_ahead)
+        page = min(max(page, 0), max(pages - 1, 0))
+        month = today.month - 1 + page
+        year, month = today.year + month // 12, month % 12 + 1
+
+        available = {d for d in self.index.available_dates(now, days_ahead)
+                     if d.year == year and d.month == month}
+
+        rows: List[List[InlineKeyboardButton]] = [
+            [_noop(f"{MONTHS[month - 1]} {year}")],
+            [_noop(name) for name in WEEKDAYS],
+        ]
+        for week in calendar.Calendar().monthdatescalendar(year, month):
+            row = []
+            for day in week:
+                if day.month != month:
+                    row.append(_noop())
+                elif day in available:
+                    row.append(InlineKeyboardButton(
+                        text=str(day.day), callback_data=f"date:{day:%d.%m.%Y}"))
+                else:
+                    row.append(_noop("·"))
+            rows.append(row)
+
+        rows.append([
+            InlineKeyboardButton(text="◀️", callback_data=f"cal:{page - 1}") if page > 0 else _noop(),
+            InlineKeyboardButton(text="▶️", callback_data=f"cal:{page + 1}") if page < pages - 1 else _noop(),
+        ])
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    def _build_times(self, day: date, page: int, now: datetime, days_ahead: int) -> InlineKeyboardMarkup:
+        slots = self.index.slots_for_day(day, now, days_ahead)
+        pages = max((len(slots) + TIME_PAGE_SIZE - 1) // TIME_PAGE_SIZE, 1)
+        page = min(max(page, 0), pages - 1)
+        chunk = slots[page * TIME_PAGE_SIZE:(page + 1) * TIME_PAGE_SIZE]
+
+        # С именем фотографа кнопки длиннее — в строке их помещается меньше
+        columns = 2 if any(slot.photographer for slot in chunk) else 4
+        buttons = [
+            InlineKeyboardButton(text=f"{slot.time_str}{slot.photographer_info}", callback_data=f"time:{slot.id}")
+            for slot in chunk
+        ]
+        rows = [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
+        if not rows:
+            rows = [[_noop("⏳ Недоступно")]]
+
+        day_key = f"{day:%d.%m.%Y}"
+        if pages > 1:
+            rows.append([
+                InlineKeyboardButton(text="◀️", callback_data=f"tpage:{day_key}:{page - 1}") if page > 0 else _noop(),
+                _noop(f"{page + 1}/{pages}"),
+                InlineKeyboardButton(text="▶️", callback_data=f"tpage:{day_key}:{page + 1}") if page < pages - 1 else _noop(),
+            ])
+        rows.append([InlineKeyboardButton(
+            text="📆 Другая дата", callback_data=f"cal:{self.page_of(day, now)}")])
+        return InlineKeyboardMarkup(inline_keyboard=rows)
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+
+calendar_keyboards = CalendarKeyboards()
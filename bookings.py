@@ -0,0 +1,70 @@
+from typing import Callable, Iterable, NamedTuple, Optional
+
+from database import pool
+from outbox import Notification, enqueue, outbox
+
+# Слот, его фотограф и причина конфликта — одним запросом
+SLOT_STATE_QUERY = """SELECT s.start_ts, s.day_key, p.user_id, p.username,
+        (SELECT b.user_id FROM bookings b WHERE b.slot_id = s.id) AS taken_by,
+        EXISTS(SELECT 1 FROM bookings b WHERE b.user_id = ? AND b.day_key = s.day_key) AS same_day
+    FROM slots s
+    LEFT JOIN photographers p ON p.id = s.photographer_id
+    WHERE s.id = ?"""
+
+INSERT_BOOKING = """INSERT INTO bookings (slot_id, user_id, name, contact, shoot_type, day_key, created_ts)
+    VALUES (?, ?, ?, ?, ?, ?, CAST(strftime('%s', 'now') AS INTEGER))"""
+
+
+class BookingResult(NamedTuple):
+    """Итог commit_booking; conflict = None при успешной записи.
+
+    Возможные конфликты: not_found, same_slot, slot_taken, same_day.
+    """
+    conflict: Optional[str]
+    booking_id: Optional[int] = None
+    start_ts: Optional[int] = None
+    photographer_user_id: Optional[int] = None
+    photographer_username: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.conflict is None
+
+
+async def commit_booking(slot_id: int, user_id: int, name: str, contact: str, shoot_type: str,
+                         notify: Optional[Callable[[BookingResult], Iterable[Notification]]] = None) -> BookingResult:
+    """Атомарно бронирует слот в одной транзакции BEGIN IMMEDIATE.
+
+    notify строит уведомления об успешной записи; они попадают в outbox
+    в той же транзакции, что и сама запись.
+    """
+    result = await _commit_booking(slot_id, user_id, name, contact, shoot_type, notify)
+    if result.ok and notify:
+        outbox.wake()
+    return result
+
+
+async def _commit_booking(slot_id, user_id, name, contact, shoot_type, notify) -> BookingResult:
+    async with pool.writer(immediate=True) as db:
+        cursor = await db.execute(SLOT_STATE_QUERY, (user_id, slot_id))
+        row = await cursor.fetchone()
+        if not row:
+            return BookingResult("not_found")
+
+        start_ts, day_key, photographer_user_id, photographer_username, taken_by, same_day = row
+        details = dict(
+            start_ts=start_ts,
+            photographer_user_id=photographer_user_id,
+            photographer_username=photographer_username,
+        )
+
+        if taken_by is not None:
+            return BookingResult("same_slot" if taken_by == user_id else "slot_taken", **details)
+        if same_day:
+            return BookingResult("same_day", **details)
+
+        cursor = await db.execute(INSERT_BOOKING, (slot_id, user_id, name, contact, shoot_type, day_key))
+        result = BookingResult(None, booking_id=cursor.lastrowid, **details)
+        if notify:
+            await enqueue(db, notify(result))
+        return result
@@ -0,0 +1,254 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import database
+from sender import Priority, TokenBucket, send_priority
+
+logger = logging.getLogger("bot")
+
+BROADCAST_CHUNK = 100
+# Ниже общего лимита sender, чтобы ответам пользователям оставался запас
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "20"))
+BROADCAST_MAX_ATTEMPTS = 3
+PROGRESS_INTERVAL = 5  # секунд между обновлениями сообщения о прогрессе
+TRANSIENT_PAUSE = 30  # пауза, если вся пачка упала на временных ошибках
+BROADCAST_WATCH_INTERVAL = 5  # как часто лидер ищет рассылки, созданные другими процессами
+
+# Все, кто когда-либо писал боту или записывался, кроме заблокировавших его
+AUDIENCE_QUERY = """SELECT user_id FROM (
+        SELECT user_id FROM user_settings
+        UNION
+        SELECT user_id FROM bookings
+    )
+    WHERE user_id IS NOT NULL
+      AND user_id NOT IN (SELECT user_id FROM user_settings WHERE bot_blocked = 1)"""
+
+STATUS_NAMES = {
+    "running": "⏳ идёт",
+    "done": "✅ завершена",
+    "cancelled": "⏹ остановлена",
+}
+
+
+class BroadcastProgress(NamedTuple):
+    id: int
+    status: str
+    total: int
+    sent: int
+    failed: int
+    blocked: int
+    progress_chat_id: Optional[int]
+    progress_message_id: Optional[int]
+    rate: float = 0.0  # сообщений в секунду в текущем запуске
+
+    @property
+    def processed(self) -> int:
+        return self.sent + self.failed + self.blocked
+
+    @property
+    def status_name(self) -> str:
+        return STATUS_NAMES.get(self.status, self.status)
+
+
+PROGRESS_QUERY = """SELECT id, status, total, sent, failed, blocked, progress_chat_id, progress_message_id
+    FROM broadcasts WHERE id = ?"""
+
+ProgressCallback = Callable[[BroadcastProgress], Awaitable[None]]
+
+
+async def count_audience() -> int:
+    row = await database.fetchone(f"SELECT COUNT(*) FROM ({AUDIENCE_QUERY})")
+    return row[0]
+
+
+async def create_broadcast(text: str, created_by: int) -> BroadcastProgress:
+    """Создаёт рассылку и фиксирует список получателей одной транзакцией"""
+    async with database.pool.writer(immediate=True) as db:
+        cursor = await db.execute(
+            "INSERT INTO broadcasts (text, created_by, created_ts) VALUES (?, ?, ?)",
+            (text, created_by, int(time.time())))
+        broadcast_id = cursor.lastrowid
+        cursor = await db.execute(
+            f"INSERT INTO broadcast_recipients (broadcast_id, user_id) SELECT ?, user_id FROM ({AUDIENCE_QUERY})",
+            (broadcast_id,))
+        await db.execute("UPDATE broadcasts SET total = ? WHERE id = ?", (cursor.rowcount, broadcast_id))
+        cursor = await db.execute(PROGRESS_QUERY, (broadcast_id,))
+        return BroadcastProgress(*await cursor.fetchone())
+
+
+async def get_progress(broadcast_id: int) -> Optional[BroadcastProgress]:
+    row = await database.fetchone(PROGRESS_QUERY, (broadcast_id,))
+    return BroadcastProgress(*row) if row else None
+
+
+async def attach_progress_message(broadcast_id: int, chat_id: int, message_id: int):
+    await database.execute(
+        "UPDATE broadcasts SET progress_chat_id = ?, progress_message_id = ? WHERE id = ?",
+        (chat_id, message_id, broadcast_id))
+
+
+async def cancel_broadcast(broadcast_id: int) -> bool:
+    return await database.execute(
+        "UPDATE broadcasts SET status = 'cancelled', finished_ts = ? WHERE id = ? AND status = 'running'",
+        (int(time.time()), broadcast_id)) > 0
+
+
+class BroadcastRunner:
+    """Фоновая доставка рассылок пачками с общим темпом BROADCAST_RATE.
+
+    Статус каждого получателя сохраняется после каждой пачки, поэтому после
+    перезапуска resume_all() продолжает с того же места.
+    """
+
+    def __init__(self, rate: float = BROADCAST_RATE):
+        self._bucket = TokenBucket(rate, rate)
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+    def start(self, bot, broadcast_id: int, on_progress: ProgressCallback):
+        if broadcast_id in self._tasks:
+            return
+        task = asyncio.create_task(self._run(bot, broadcast_id, on_progress))
+        self._tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(broadcast_id, None))
+
+    async def resume_all(self, bot, on_progress: ProgressCallback) -> List[int]:
+        rows = await database.fetchall("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        resumed = [row[0] for row in rows if row[0] not in self._tasks]
+        for broadcast_id in resumed:
+            logger.info(f"Resuming broadcast {broadcast_id}")
+            self.start(bot, broadcast_id, on_progress)
+        return resumed
+
+    async def watch(self, bot, on_progress: ProgressCallback, interval: float):
+        """Запускает рассылки, созданные другими процессами"""
+        while True:
+            try:
+                await self.resume_all(bot, on_progress)
+            except Exception as e:
+                logger.error(f"Broadcast watch failed: {e}")
+            await asyncio.sleep(interval)
+
+    async def stop_all(self):
+        # Статус в базе остаётся running — рассылку продолжит следующий запуск
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _pace(self):
+        while True:
+            wait = self._bucket.delay(time.monotonic())
+            if wait <= 0:
+                self._bucket.consume()
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, bot, user_id: int, text: str) -> str:
+        await self._pace()
+        try:
+            with send_priority(Priority.BULK):
+                await bot.send_message(user_id, text)
+            return "sent"
+        except TelegramForbiddenError:
+            return "blocked"
+        except TelegramBadRequest as e:
+            logger.warning(f"Broadcast to {user_id} rejected: {e}")
+            return "failed"
+        except Exception as e:
+            logger.warning(f"Broadcast to {user_id} failed, will retry: {e}")
+            return "retry"
+
+    async def _save_chunk(self, broadcast_id: int, results: Dict[int, str]):
+        by_status: Dict[str, List[int]] = {}
+        for user_id, status in results.items():
+            by_status.setdefault(status, []).append(user_id)
+
+        async with database.pool.writer(immediate=True) as db:
+            for status in ("sent", "failed", "blocked"):
+                await db.executemany(
+                    "UPDATE broadcast_recipients SET status = ?, attempts = attempts + 1 "
+                    "WHERE broadcast_id = ? AND user_id = ?",
+                    [(status, broadcast_id, user_id) for user_id in by_status.get(status, [])])
+            # Временные ошибки: повтор, пока не исчерпаны попытки
+            await db.executemany(
+                """UPDATE broadcast_recipients SET attempts = attempts + 1,
+                    status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END
+                WHERE broadcast_id = ? AND user_id = ?""",
+                [(BROADCAST_MAX_ATTEMPTS, broadcast_id, user_id) for user_id in by_status.get("retry", [])])
+            await db.executemany(
+                """INSERT INTO user_settings (user_id, bot_blocked) VALUES (?, 1)
+                ON CONFLICT(user_id) DO UPDATE SET bot_blocked = 1""",
+                [(user_id,) for user_id in by_status.get("blocked", [])])
+            # Счётчики пересчитываются по снимку — повтор пачки после сбоя их не задвоит
+            await db.execute(
+                """UPDATE broadcasts SET
+                    sent = (SELECT COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ?1 AND status = 'sent'),
+                    failed = (SELECT COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ?1 AND status = 'failed'),
+                    blocked = (SELECT COUNT(*) FROM broadcast_recipients WHERE broadcast_id = ?1 AND status = 'blocked')
+                WHERE id = ?1""",
+                (broadcast_id,))
+
+    async def _run(self, bot, broadcast_id: int, on_progress: ProgressCallback):
+        started = time.monotonic()
+        processed = 0
+        last_report = 0.0
+
+        async def report(progress: BroadcastProgress):
+            elapsed = time.monotonic() - started
+            rate = round(processed / elapsed, 1) if elapsed > 0 else 0.0
+            try:
+                await on_progress(progress._replace(rate=rate))
+            except Exception as e:
+                logger.warning(f"Broadcast {broadcast_id} progress update failed: {e}")
+
+        try:
+            row = await database.fetchone("SELECT text FROM broadcasts WHERE id = ?", (broadcast_id,))
+            text = row[0]
+            while True:
+                progress = await get_progress(broadcast_id)
+                if progress.status != "running":
+                    break
+
+                rows = await database.fetchall(
+                    """SELECT user_id FROM broadcast_recipients
+                    WHERE broadcast_id = ? AND status = 'pending'
+                    ORDER BY user_id LIMIT ?""",
+                    (broadcast_id, BROADCAST_CHUNK))
+                if not rows:
+                    await database.execute(
+                        "UPDATE broadcasts SET status = 'done', finished_ts = ? WHERE id = ? AND status = 'running'",
+                        (int(time.time()), broadcast_id))
+                    break
+
+                user_ids = [r[0] for r in rows]
+                statuses = await asyncio.gather(*(self._send(bot, user_id, text) for user_id in user_ids))
+                results = dict(zip(user_ids, statuses))
+                await self._save_chunk(broadcast_id, results)
+                processed += len(user_ids)
+
+                if all(status == "retry" for status in statuses):
+                    await asyncio.sleep(TRANSIENT_PAUSE)
+
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    await report(await get_progress(broadcast_id))
+
+            progress = await get_progress(broadcast_id)
+            await report(progress)
+            logger.info(f"Broadcast {broadcast_id} {progress.status}: sent={progress.sent}, "
+                        f"failed={progress.failed}, blocked={progress.blocked} of {progress.total}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} stopped with error: {e}")
+
+    def running(self) -> List[int]:
+        return list(self._tasks)
+
+
+broadcast_runner = BroadcastRunner()
@@ -0,0 +1,130 @@
+import io
+import os
+import asyncio
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+logger = logging.getLogger("bot")
+
+CARD_SIZE = (800, 600)
+CARD_BACKGROUND = (73, 109, 137)
+CARD_FONTS = ("arial.ttf", "DejaVuSans.ttf")
+CARD_RENDER_WORKERS = int(os.getenv("CARD_RENDER_WORKERS", "2"))
+CARD_CACHE_SIZE = int(os.getenv("CARD_CACHE_SIZE", "256"))
+
+CARD_FIELDS = ("date", "time", "name", "phone", "shoot_type")
+
+
+class CardRenderer:
+    """Рисует карточки записи в пуле потоков и кэширует готовые PNG.
+
+    Шрифт и фон создаются один раз; одинаковые карточки (по содержимому)
+    повторно не рисуются, а параллельные запросы одной карточки ждут
+    общий результат.
+    """
+
+    def __init__(self, workers: int = CARD_RENDER_WORKERS, cache_size: int = CARD_CACHE_SIZE):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="card")
+        self._cache: "OrderedDict[Tuple[str, ...], bytes]" = OrderedDict()
+        self._pending: Dict[Tuple[str, ...], asyncio.Future] = {}
+        self._cache_size = cache_size
+        self._local = threading.local()
+        self._background = Image.new("RGB", CARD_SIZE, color=CARD_BACKGROUND)
+        self.hits = 0
+        self.misses = 0
+
+    def _font(self):
+        # Шрифт загружается один раз на поток пула
+        font = getattr(self._local, "font", None)
+        if font is None:
+            for name in CARD_FONTS:
+                try:
+                    font = ImageFont.truetype(name, 30)
+                    break
+                except IOError:
+                    continue
+            else:
+                font = ImageFont.load_default()
+            self._local.font = font
+        return font
+
+    def _render(self, key: Tuple[str, ...]) -> bytes:
+        font = self._font()
+        data = dict(zip(CARD_FIELDS, key))
+
+        image = self._background.copy()
+        draw = ImageDraw.Draw(image)
+        text_lines = [
+            "📷 Подтверждение записи",
+            "",
+            f"📅 Дата: {data['date']}",
+            f"⏰ Время: {data['time']}",
+            f"👤 Имя: {data['name']}",
+            f"📞 Телефон: {data['phone']}",
+            f"📸 Тип съемки: {data['shoot_type']}",
+            "",
+            "Сохраните эту карточку!"
+        ]
+
+        y_position = 50
+        for line in text_lines:
+            draw.text((50, y_position), line, fill=(255, 255, 255), font=font)
+            y_position += 40
+
+        buf = io.BytesIO()
+        image.save(buf, format="PNG")
+        return buf.getvalue()
+
+    def _remember(self, key: Tuple[str, ...], png: bytes):
+        self._cache[key] = png
+        self._cache.move_to_end(key)
+        while len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+
+    async def render(self, data: dict) -> bytes:
+        key = tuple(str(data.get(field, "")) for field in CARD_FIELDS)
+
+        png = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return png
+
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, self._render, key)
+        self._pending[key] = future
+        try:
+            png = await future
+        finally:
+            self._pending.pop(key, None)
+
+        self._remember(key, png)
+        return png
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "hits": self.hits, "misses": self.misses}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+card_renderer = CardRenderer()
+
+
+async def render_card(data: dict) -> Optional[bytes]:
+    try:
+        return await card_renderer.render(data)
+    except Exception as e:
+        logger.error(f"Error generating booking card: {e}")
+        return None
@@ -0,0 +1,340 @@
+import os
+import hmac
+import json
+import time
+import signal
+import socket
+import asyncio
+import logging
+import secrets
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+import database
+from log_pipeline import LOG_FILE
+from webhook import SECRET_HEADER, update_chat_id
+
+logger = logging.getLogger("bot")
+
+# Задаются супервизором для каждого рабочего процесса
+WORKER_ID = os.getenv("BOT_WORKER_ID")
+IS_WORKER = WORKER_ID is not None
+WORKER_PORT = int(os.getenv("BOT_WORKER_PORT", "0"))
+WORKER_SECRET = os.getenv("BOT_WORKER_SECRET", "")
+
+WORKER_BASE_PORT = int(os.getenv("BOT_WORKER_BASE_PORT", "8100"))
+WORKER_QUEUE_SIZE = 1000  # апдейтов в очереди к одному рабочему
+FORWARD_TIMEOUT = 60  # столько ждём рабочего (например, при перезапуске), потом апдейт теряется
+RESTART_DELAY_MAX = 30
+# Как часто рабочие подтягивают чужие изменения (слоты, записи, outbox)
+CLUSTER_SYNC_INTERVAL = float(os.getenv("CLUSTER_SYNC_INTERVAL", "1"))
+LEASE_TTL = 15
+
+Job = Callable[[], Awaitable[Any]]
+
+
+def shard_for(chat_id: int, workers: int) -> int:
+    return chat_id % workers
+
+
+async def wait_for_signal():
+    """Ждёт SIGINT/SIGTERM вместо завершения процесса без остановки бота"""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+
+
+class LeaderElection:
+    """Лидер среди процессов бота через аренду в таблице leader_lease.
+
+    Фоновые задачи, которые должны идти в одном экземпляре (напоминания,
+    outbox, рассылки), регистрируются через job() и запускаются только у
+    лидера. Аренда продлевается каждые ttl/3 секунд; если лидер пропал,
+    через ttl её забирает другой процесс.
+    """
+
+    def __init__(self, name: str = "background", ttl: float = LEASE_TTL):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}"
+        self.is_leader = False
+        self._jobs: List[Job] = []
+        self._on_stop: List[Job] = []
+        self._tasks: List[asyncio.Task] = []
+        self._runner: Optional[asyncio.Task] = None
+        self._renewed = 0.0
+        self.elected = 0
+
+    def job(self, func: Job) -> Job:
+        self._jobs.append(func)
+        return func
+
+    def on_stop(self, func: Job) -> Job:
+        self._on_stop.append(func)
+        return func
+
+    async def try_acquire(self) -> bool:
+        now = time.time()
+        async with database.pool.writer(immediate=True) as db:
+            await db.execute(
+                """INSERT INTO leader_lease (name, holder, expires_ts) VALUES (?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_ts = excluded.expires_ts
+                WHERE leader_lease.holder = excluded.holder OR leader_lease.expires_ts < ?""",
+                (self.name, self.holder, now + self.ttl, now))
+            cursor = await db.execute("SELECT holder FROM leader_lease WHERE name = ?", (self.name,))
+            row = await cursor.fetchone()
+        return row[0] == self.holder
+
+    def _start_jobs(self):
+        self.is_leader = True
+        self.elected += 1
+        logger.info(f"Leader election: {self.holder} is now the leader")
+        self._tasks = [asyncio.create_task(job()) for job in self._jobs]
+
+    async def _stop_jobs(self):
+        self.is_leader = False
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for func in self._on_stop:
+            try:
+                await func()
+            except Exception as e:
+                logger.error(f"Leader stop hook failed: {e}")
+
+    async def _run(self):
+        while True:
+            try:
+                leader = await self.try_acquire()
+                self._renewed = time.monotonic()
+            except Exception as e:
+                logger.error(f"Leader election failed: {e}")
+                # Без продления уходим заранее, пока аренду не забрал другой процесс
+                leader = self.is_leader and time.monotonic() - self._renewed < self.ttl * 2 / 3
+
+            if leader and not self.is_leader:
+                self._start_jobs()
+            elif not leader and self.is_leader:
+                logger.warning(f"Leader election: {self.holder} lost the lease")
+                await self._stop_jobs()
+            await asyncio.sleep(self.ttl / 3)
+
+    def start(self):
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self.is_leader:
+            await self._stop_jobs()
+            # Освобождаем аренду, чтобы новый процесс не ждал её истечения
+            await database.execute(
+                "DELETE FROM leader_lease WHERE name = ? AND holder = ?", (self.name, self.holder))
+
+    def stats(self) -> dict:
+        return {"holder": self.holder, "leader": self.is_leader, "elected": self.elected}
+
+
+class Supervisor:
+    """Запускает рабочие процессы и раздаёт им апдейты по chat_id.
+
+    Все апдейты одного чата попадают в один процесс, поэтому его FSM-кэш,
+    сессия администратора и порядок шагов диалога остаются согласованными.
+    Рабочие принимают апдейты на локальном вебхуке (см. webhook.WebhookServer);
+    упавший рабочий перезапускается, а его апдейты ждут в очереди.
+    """
+
+    def __init__(self, workers: int, argv: List[str], base_port: int = WORKER_BASE_PORT):
+        if workers < 1:
+            raise ValueError("Number of workers must be positive")
+        self.workers = workers
+        self.argv = argv
+        self.base_port = base_port
+        self.secret = secrets.token_urlsafe(32)
+        self._queues = [asyncio.Queue(WORKER_QUEUE_SIZE) for _ in range(workers)]
+        self._procs: List[Optional[asyncio.subprocess.Process]] = [None] * workers
+        self._tasks: List[asyncio.Task] = []
+        self._http: Optional[ClientSession] = None
+        self._stopping = False
+        self.forwarded = [0] * workers
+        self.restarts = 0
+        self.dropped = 0
+
+    def worker_url(self, worker: int, path: str = "/webhook") -> str:
+        return f"http://127.0.0.1:{self.base_port + worker}{path}"
+
+    def _worker_env(self, worker: int) -> Dict[str, str]:
+        env = os.environ.copy()
+        env.update(
+            BOT_WORKER_ID=str(worker),
+            BOT_WORKER_PORT=str(self.base_port + worker),
+            BOT_WORKER_SECRET=self.secret,
+        )
+        # У каждого процесса свой файл: ротация RotatingFileHandler не согласована между процессами
+        base, ext = os.path.splitext(LOG_FILE)
+        env["LOG_FILE"] = f"{base}.worker{worker}{ext}"
+        # Общий лимит Telegram делится между процессами
+        rate = float(os.getenv("SENDER_RATE", "30"))
+        env["SENDER_RATE"] = str(rate / self.workers)
+        return env
+
+    async def start(self):
+        self._http = ClientSession(timeout=ClientTimeout(total=10))
+        for worker in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._keep_alive(worker)))
+            self._tasks.append(asyncio.create_task(self._forward(worker)))
+        logger.info(f"Supervisor started {self.workers} workers on ports "
+                    f"{self.base_port}-{self.base_port + self.workers - 1}")
+
+    async def _keep_alive(self, worker: int):
+        delay = 1
+        while not self._stopping:
+            started = time.monotonic()
+            # Своя группа процессов: Ctrl+C получает только супервизор и гасит рабочих сам
+            proc = await asyncio.create_subprocess_exec(
+                *self.argv, env=self._worker_env(worker), start_new_session=True)
+            self._procs[worker] = proc
+            code = await proc.wait()
+            if self._stopping:
+                return
+
+            self.restarts += 1
+            # Рабочий, падающий сразу после старта, перезапускаем всё реже
+            delay = 1 if time.monotonic() - started > RESTART_DELAY_MAX else min(delay * 2, RESTART_DELAY_MAX)
+            logger.error(f"Worker {worker} exited with code {code}, restarting in {delay} s")
+            await asyncio.sleep(delay)
+
+    async def dispatch(self, update: Dict[str, Any]):
+        chat_id = update_chat_id(update) or 0
+        # Полная очередь придерживает приём — Telegram подождёт
+        await self._queues[shard_for(chat_id, self.workers)].put(update)
+
+    async def _post(self, worker: int, update: Dict[str, Any]) -> bool:
+        try:
+            async with self._http.post(self.worker_url(worker), json=update,
+                                       headers={SECRET_HEADER: self.secret}) as resp:
+                return resp.status == 200
+        except (ClientError, asyncio.TimeoutError):
+            return False
+
+    async def _forward(self, worker: int):
+        # Один отправитель на рабочего сохраняет порядок апдейтов внутри чата
+        queue = self._queues[worker]
+        while True:
+            update = await queue.get()
+            try:
+                deadline = time.monotonic() + FORWARD_TIMEOUT
+                while not await self._post(worker, update):
+                    if time.monotonic() > deadline:
+                        self.dropped += 1
+                        logger.error(f"Update {update.get('update_id')} dropped: worker {worker} unavailable")
+                        break
+                    await asyncio.sleep(0.5)
+                else:
+                    self.forwarded[worker] += 1
+            finally:
+                queue.task_done()
+
+    async def poll(self, bot, allowed_updates: Optional[List[str]] = None, timeout: int = 30):
+        """Long polling в супервизоре; апдейты уходят рабочим"""
+        offset = None
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                    request_timeout=int(bot.session.timeout + timeout))
+            except Exception as e:
+                logger.error(f"Supervisor polling failed: {e}")
+                await asyncio.sleep(5)
+                continue
+            for update in updates:
+                await self.dispatch(json.loads(update.json(by_alias=True, exclude_none=True)))
+                offset = update.update_id + 1
+
+    async def ready(self) -> bool:
+        for worker in range(self.workers):
+            try:
+                async with self._http.get(self.worker_url(worker, "/readyz")) as resp:
+                    if resp.status != 200:
+                        return False
+            except (ClientError, asyncio.TimeoutError):
+                return False
+        return True
+
+    def build_app(self, path: str, secret: str) -> web.Application:
+        """Внешний вебхук: проверка секрета Telegram и раздача по рабочим"""
+        async def handle(request: web.Request) -> web.Response:
+            token = request.headers.get(SECRET_HEADER, "")
+            if not hmac.compare_digest(token.encode(), secret.encode()):
+                logger.warning(f"Webhook request with invalid secret from {request.remote}")
+                return web.Response(status=401)
+            try:
+                update = await request.json()
+            except ValueError:
+                return web.Response(status=400)
+            if not isinstance(update, dict):
+                return web.Response(status=400)
+            await self.dispatch(update)
+            return web.Response()
+
+        async def health(request: web.Request) -> web.Response:
+            return web.json_response({"status": "ok"})
+
+        async def readiness(request: web.Request) -> web.Response:
+            ready = await self.ready()
+            return web.json_response({"ready": ready, **self.stats()}, status=200 if ready else 503)
+
+        app = web.Application()
+        app.router.add_post(path, handle)
+        app.router.add_get("/healthz", health)
+        app.router.add_get("/readyz", readiness)
+        return app
+
+    async def stop(self, timeout: float = 30):
+        # Сначала доставляем накопленное, потом гасим рабочих: они дорабатывают сами
+        try:
+            await asyncio.wait_for(asyncio.gather(*(q.join() for q in self._queues)), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Supervisor: {sum(q.qsize() for q in self._queues)} updates not forwarded")
+
+        self._stopping = True
+        procs = [proc for proc in self._procs if proc and proc.returncode is None]
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(asyncio.gather(*(proc.wait() for proc in procs)), timeout)
+        except asyncio.TimeoutError:
+            for proc in procs:
+                if proc.returncode is None:
+                    proc.kill()
+
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._http:
+            await self._http.close()
+        logger.info(f"Supervisor stopped: {self.stats()}")
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "alive": sum(1 for proc in self._procs if proc and proc.returncode is None),
+            "forwarded": sum(self.forwarded),
+            "queued": sum(q.qsize() for q in self._queues),
+            "restarts": self.restarts,
+            "dropped": self.dropped,
+        }
+
+
+leader_election = LeaderElection()
@@ -0,0 +1,315 @@
+import os
+import time
+import sqlite3
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from functools import partial
+from typing import Any, Iterable, List, Optional
+
+import aiosqlite
+from aiosqlite.context import contextmanager
+import pytz
+
+from metrics import metrics
+from query_log import query_log
+
+logger = logging.getLogger("bot")
+
+DB_PATH = os.getenv("DB_PATH", "bot.db")
+DB_READERS = int(os.getenv("DB_READERS", "4"))
+DB_BUSY_TIMEOUT_MS = int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000"))
+
+# Часовой пояс, в котором администраторы задают слоты (Config.TIMEZONE)
+LOCAL_TZ = pytz.timezone(os.getenv("TIMEZONE", "Europe/Moscow"))
+
+# Прагмы, которые применяются к каждому соединению пула при открытии
+CONNECTION_PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -8000",
+    "PRAGMA mmap_size = 67108864",
+    f"PRAGMA busy_timeout = {DB_BUSY_TIMEOUT_MS}",
+)
+
+
+def configure_timezone(name: str):
+    global LOCAL_TZ
+    LOCAL_TZ = pytz.timezone(name)
+
+
+def local_now() -> datetime:
+    """Текущее время в часовом поясе бота, без tzinfo (как хранятся слоты)"""
+    return datetime.now(LOCAL_TZ).replace(tzinfo=None)
+
+
+def to_epoch(dt: datetime) -> int:
+    """Локальное время слота -> UTC epoch (секунды)"""
+    if dt.tzinfo is None:
+        dt = LOCAL_TZ.localize(dt)
+    return int(dt.timestamp())
+
+
+def from_epoch(ts: int) -> datetime:
+    return datetime.fromtimestamp(ts, LOCAL_TZ).replace(tzinfo=None)
+
+
+def day_key(dt: datetime) -> int:
+    """Ключ локального дня вида ГГГГММДД"""
+    return dt.year * 10000 + dt.month * 100 + dt.day
+
+
+class PoolStats:
+    """Счётчики ожидания соединений для одной роли (reader/writer)"""
+
+    def __init__(self):
+        self.acquired = 0
+        self.waiting = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def record(self, waited: float):
+        self.acquired += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def as_dict(self) -> dict:
+        avg = self.wait_total / self.acquired if self.acquired else 0.0
+        return {
+            "acquired": self.acquired,
+            "waiting": self.waiting,
+            "wait_avg_ms": round(avg * 1000, 3),
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+        }
+
+
+class TimedCursor(aiosqlite.Cursor):
+    """Курсор, который досчитывает время и строки запроса при чтении результата"""
+
+    def __init__(self, conn: aiosqlite.Connection, cursor: sqlite3.Cursor, sql: str,
+                 params: Optional[Iterable[Any]], elapsed: float):
+        super().__init__(conn, cursor)
+        self.sql = sql
+        self.params = params
+        self.elapsed = elapsed
+        self.rows = 0
+        # Медленный SELECT логируем после чтения, когда известно число строк
+        self.slow_pending = query_log.is_slow(elapsed)
+
+    async def _timed(self, fetch, *args):
+        started = time.perf_counter()
+        result = await fetch(*args)
+        seconds = time.perf_counter() - started
+        rows = len(result) if isinstance(result, list) else int(result is not None)
+        self.rows += rows
+        query_log.fetched(self.sql, seconds, rows)
+        was_slow = query_log.is_slow(self.elapsed)
+        self.elapsed += seconds
+        if self.slow_pending or (not was_slow and query_log.is_slow(self.elapsed)):
+            self.slow_pending = False
+            query_log.report_slow(self.sql, self.params, self.elapsed, self.rows)
+        return result
+
+    async def fetchone(self):
+        return await self._timed(super().fetchone)
+
+    async def fetchmany(self, size: Optional[int] = None):
+        return await self._timed(super().fetchmany, size)
+
+    async def fetchall(self):
+        return await self._timed(super().fetchall)
+
+
+class TimedConnection(aiosqlite.Connection):
+    """Соединение aiosqlite, которое передаёт время и строки каждого запроса в metrics и query_log"""
+
+    async def _timed(self, fn, sql: str, parameters, params_for_plan) -> TimedCursor:
+        started = time.perf_counter()
+        try:
+            raw = await self._execute(fn, sql, parameters)
+        except BaseException:
+            metrics.observe_db(sql, time.perf_counter() - started, failed=True)
+            raise
+        seconds = time.perf_counter() - started
+        metrics.observe_db(sql, seconds)
+        # Для SELECT rowcount равен -1: строки досчитает курсор при чтении
+        affected = max(raw.rowcount, 0)
+        query_log.executed(sql, params_for_plan, seconds, affected)
+        cursor = TimedCursor(self, raw, sql, params_for_plan, seconds)
+        if cursor.slow_pending and raw.description is None:
+            cursor.slow_pending = False
+            query_log.report_slow(sql, params_for_plan, seconds, affected)
+        return cursor
+
+    @contextmanager
+    async def execute(self, sql: str, parameters: Optional[Iterable[Any]] = None) -> TimedCursor:
+        parameters = [] if parameters is None else parameters
+        return await self._timed(self._conn.execute, sql, parameters, parameters)
+
+    @contextmanager
+    async def executemany(self, sql: str, parameters: Iterable[Iterable[Any]]) -> TimedCursor:
+        return await self._timed(self._conn.executemany, sql, parameters, None)
+
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: один писатель и несколько читателей.
+
+    База открывается в режиме WAL, поэтому читатели не блокируются писателем.
+    Все записи сериализуются через единственное соединение-писатель.
+    """
+
+    def __init__(self, path: str = DB_PATH, readers: int = DB_READERS):
+        self.path = path
+        self.size = max(1, readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._writer_lock = asyncio.Lock()
+        self._open_lock = asyncio.Lock()
+        self._readers: Optional[asyncio.Queue] = None
+        self._all_readers: List[aiosqlite.Connection] = []
+        self.reader_stats = PoolStats()
+        self.writer_stats = PoolStats()
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, read_only: bool = False) -> aiosqlite.Connection:
+        conn = await TimedConnection(partial(sqlite3.connect, self.path), 64)
+        for pragma in CONNECTION_PRAGMAS:
+            await conn.execute(pragma)
+        if read_only:
+            await conn.execute("PRAGMA query_only = ON")
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self.is_open:
+                return
+
+            writer = await self._connect()
+            cursor = await writer.execute("PRAGMA journal_mode = WAL")
+            mode = (await cursor.fetchone())[0]
+            if mode.lower() != "wal":
+                logger.warning(f"SQLite journal_mode is {mode}, WAL not available")
+
+            self._readers = asyncio.Queue()
+            for _ in range(self.size):
+                conn = await self._connect(read_only=True)
+                self._all_readers.append(conn)
+                self._readers.put_nowait(conn)
+            self._writer = writer
+
+        logger.info(f"DB pool opened: {self.path}, 1 writer + {self.size} readers")
+
+    async def close(self):
+        if not self.is_open:
+            return
+
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = None
+
+        await self._writer.close()
+        self._writer = None
+        logger.info("DB pool closed")
+
+    @asynccontextmanager
+    async def reader(self):
+        if not self.is_open:
+            await self.open()
+
+        started = time.perf_counter()
+        self.reader_stats.waiting += 1
+        try:
+            conn = await self._readers.get()
+        finally:
+            self.reader_stats.waiting -= 1
+        self.reader_stats.record(time.perf_counter() - started)
+
+        try:
+            yield conn
+        finally:
+            # Читатель не должен держать открытую транзакцию между вызовами
+            if conn.in_transaction:
+                await conn.rollback()
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def writer(self, immediate: bool = False):
+        """Эксклюзивное соединение на запись; коммит при выходе без ошибок.
+
+        immediate=True открывает транзакцию BEGIN IMMEDIATE, чтобы блокировка
+        записи бралась сразу, а не при первом изменении.
+        """
+        if not self.is_open:
+            await self.open()
+
+        started = time.perf_counter()
+        self.writer_stats.waiting += 1
+        try:
+            await self._writer_lock.acquire()
+        finally:
+            self.writer_stats.waiting -= 1
+        self.writer_stats.record(time.perf_counter() - started)
+
+        try:
+            if immediate and not self._writer.in_transaction:
+                await self._writer.execute("BEGIN IMMEDIATE")
+            yield self._writer
+            if self._writer.in_transaction:
+                await self._writer.commit()
+        except BaseException:
+            if self._writer.in_transaction:
+                await self._writer.rollback()
+            raise
+        finally:
+            self._writer_lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "readers": self.size,
+            "readers_idle": self._readers.qsize() if self._readers else 0,
+            "reader": self.reader_stats.as_dict(),
+            "writer": self.writer_stats.as_dict(),
+        }
+
+
+pool = ConnectionPool()
+
+
+async def explain_plan(sql: str, params: Iterable[Any] = ()) -> List[str]:
+    """EXPLAIN QUERY PLAN на читающем соединении: строки плана с отступами по вложенности"""
+    async with pool.reader() as db:
+        cursor = await db.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+        rows = await cursor.fetchall()
+    depth: dict = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return lines
+
+
+query_log.explainer = explain_plan
+
+
+async def fetchone(sql: str, params: Iterable[Any] = ()) -> Optional[tuple]:
+    async with pool.reader() as db:
+        cursor = await db.execute(sql, params)
+        return await cursor.fetchone()
+
+
+async def fetchall(sql: str, params: Iterable[Any] = ()) -> List[tuple]:
+    async with pool.reader() as db:
+        cursor = await db.execute(sql, params)
+        return await cursor.fetchall()
+
+
+async def execute(sql: str, params: Iterable[Any] = ()) -> int:
+    """Выполняет запись и возвращает количество изменённых строк"""
+    async with pool.writer() as db:
+        cursor = await db.execute(sql, params)
+        return cursor.rowcount
@@ -0,0 +1,156 @@
+import io
+import os
+import time
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import List, NamedTuple, Optional, Tuple
+
+from openpyxl import Workbook
+
+import database
+from slot_admin import parse_slot_range
+
+logger = logging.getLogger("bot")
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", "1"))
+
+EXPORT_HEADERS = ["Дата", "Время", "Имя", "Телефон", "Тип съёмки", "Дата записи", "Фотограф"]
+NO_PHOTOGRAPHER = "Не назначен"
+
+EXPORT_QUERY = """SELECT s.start_ts, b.name, b.contact, b.shoot_type, b.created_ts, p.username
+    FROM bookings b
+    JOIN slots s ON b.slot_id = s.id
+    LEFT JOIN photographers p ON s.photographer_id = p.id"""
+
+
+class ExportFilter(NamedTuple):
+    """Период по времени съёмки [start, end) и фотограф (username без @)"""
+    start: Optional[datetime] = None
+    end: Optional[datetime] = None
+    photographer: Optional[str] = None
+
+
+class ExportResult(NamedTuple):
+    filename: str
+    data: bytes
+    count: int
+
+
+def parse_export_filter(text: str) -> ExportFilter:
+    """Аргументы /export: «[период] [@фотограф]», период — как в /slotsrange.
+
+    Бросает ValueError с понятным текстом.
+    """
+    photographer = None
+    period = []
+    for part in text.split():
+        if part.startswith("@"):
+            if photographer is not None or len(part) < 2:
+                raise ValueError("Укажите одного фотографа, например @anna")
+            photographer = part[1:]
+        else:
+            period.append(part)
+
+    start = end = None
+    if period:
+        start, end = parse_slot_range(" ".join(period))
+    return ExportFilter(start, end, photographer)
+
+
+def _build_query(flt: ExportFilter) -> Tuple[str, list]:
+    conditions, params = [], []
+    if flt.start is not None:
+        conditions.append("s.start_ts >= ?")
+        params.append(database.to_epoch(flt.start))
+    if flt.end is not None:
+        conditions.append("s.start_ts < ?")
+        params.append(database.to_epoch(flt.end))
+    if flt.photographer is not None:
+        conditions.append("p.username = ? COLLATE NOCASE")
+        params.append(flt.photographer)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{EXPORT_QUERY}{where} ORDER BY s.start_ts", params
+
+
+class BookingExporter:
+    """Выгрузка записей в Excel без нагрузки на цикл событий.
+
+    Строки читаются курсором пачками по batch_size, а книга write_only
+    заполняется в отдельном потоке, пока читается следующая пачка: в
+    памяти не больше двух пачек и сжатый результат. Файл на диск не
+    пишется — готовая книга отдаётся байтами.
+    """
+
+    def __init__(self, batch_size: int = EXPORT_BATCH_SIZE, workers: int = EXPORT_WORKERS):
+        self.batch_size = batch_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="export")
+        self.exports = 0
+        self.rows = 0
+        self.last_ms = 0.0
+        self.last_bytes = 0
+
+    @staticmethod
+    def _new_book():
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Записи")
+        ws.append(EXPORT_HEADERS)
+        return wb, ws
+
+    @staticmethod
+    def _append(ws, rows: List[tuple]):
+        for start_ts, name, contact, shoot_type, created_ts, photographer in rows:
+            start = database.from_epoch(start_ts)
+            created = database.from_epoch(created_ts).strftime("%d.%m.%Y %H:%M") if created_ts else ""
+            ws.append([
+                start.strftime("%d.%m.%Y"),
+                start.strftime("%H:%M"),
+                name,
+                contact,
+                shoot_type,
+                created,
+                photographer or NO_PHOTOGRAPHER,
+            ])
+
+    @staticmethod
+    def _save(wb) -> bytes:
+        buffer = io.BytesIO()
+        wb.save(buffer)
+        return buffer.getvalue()
+
+    async def export(self, flt: ExportFilter = ExportFilter()) -> Optional[ExportResult]:
+        """Книга с записями по фильтру; None, если записей нет"""
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        sql, params = _build_query(flt)
+        count = 0
+        async with database.pool.reader() as db:
+            cursor = await db.execute(sql, params)
+            rows = await cursor.fetchmany(self.batch_size)
+            if not rows:
+                return None
+            wb, ws = await loop.run_in_executor(self._executor, self._new_book)
+            while rows:
+                writing = loop.run_in_executor(self._executor, self._append, ws, rows)
+                count += len(rows)
+                rows = await cursor.fetchmany(self.batch_size)
+                await writing
+        data = await loop.run_in_executor(self._executor, self._save, wb)
+
+        self.exports += 1
+        self.rows += count
+        self.last_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.last_bytes = len(data)
+        filename = f"bookings_export_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+        return ExportResult(filename, data, count)
+
+    def stats(self) -> dict:
+        return {"exports": self.exports, "rows": self.rows, "last_ms": self.last_ms, "last_bytes": self.last_bytes}
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+booking_exporter = BookingExporter()
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta, timezone
+from typing import List, NamedTuple, Optional, Tuple
+
+import database
+
+PAGE_SIZE = 5
+
+PHOTO_FILTERS = {
+    "a": "",
+    "y": " AND photo_id IS NOT NULL",
+    "n": " AND photo_id IS NULL",
+}
+
+
+class FeedbackRow(NamedTuple):
+    id: int
+    user_name: str
+    text: str
+    photo_id: Optional[str]
+    rating: Optional[int]
+    created_at: str
+
+
+class FeedbackFilter(NamedTuple):
+    rating: int = 0  # 0 — любой
+    photo: str = "a"  # a — все, y — с фото, n — без фото
+
+    def encode(self) -> str:
+        return f"{self.rating}{self.photo}"
+
+    @classmethod
+    def decode(cls, text: str) -> "FeedbackFilter":
+        rating, photo = int(text[:-1]), text[-1]
+        if not 0 <= rating <= 5 or photo not in PHOTO_FILTERS:
+            raise ValueError("bad feedback filter")
+        return cls(rating, photo)
+
+    def sql(self) -> Tuple[str, tuple]:
+        clause = PHOTO_FILTERS[self.photo]
+        params = ()
+        if self.rating:
+            clause += " AND rating = ?"
+            params = (self.rating,)
+        return clause, params
+
+
+class Page(NamedTuple):
+    rows: List[FeedbackRow]
+    has_prev: bool
+    has_next: bool
+
+
+def encode_key(created_at: str) -> str:
+    """'2025-06-28 14:09:04' -> '20250628140904' для callback_data"""
+    return created_at.replace("-", "").replace(" ", "").replace(":", "")
+
+
+def decode_key(key: str) -> str:
+    return datetime.strptime(key, "%Y%m%d%H%M%S").strftime("%Y-%m-%d %H:%M:%S")
+
+
+def day_end_key(day: datetime) -> str:
+    """Конец локального дня в формате created_at (CURRENT_TIMESTAMP пишет UTC)"""
+    next_day = day.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+    return datetime.fromtimestamp(database.to_epoch(next_day), timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+
+async def fetch_page(flt: FeedbackFilter, direction: str = "first",
+                     cursor: Optional[Tuple[str, int]] = None, size: int = PAGE_SIZE) -> Page:
+    """Страница отзывов от новых к старым по ключу (created_at, id).
+
+    direction: first — самые новые; next — старше cursor; prev — новее cursor.
+    """
+    clause, params = flt.sql()
+    columns = "id, user_name, text, photo_id, rating, created_at"
+
+    if direction == "prev":
+        rows = await database.fetchall(
+            f"""SELECT {columns} FROM feedback
+            WHERE (created_at, id) > (?, ?){clause}
+            ORDER BY created_at, id LIMIT ?""",
+            (*cursor, *params, size + 1))
+        has_prev = len(rows) > size
+        rows = list(reversed(rows[:size]))
+        return Page([FeedbackRow(*r) for r in rows], has_prev, True)
+
+    if direction == "next":
+        where, where_params = f"WHERE (created_at, id) < (?, ?){clause}", (*cursor, *params)
+    else:
+        where, where_params = f"WHERE 1 = 1{clause}", params
+
+    rows = await database.fetchall(
+        f"""SELECT {columns} FROM feedback
+        {where}
+        ORDER BY created_at DESC, id DESC LIMIT ?""",
+        (*where_params, size + 1))
+    has_next = len(rows) > size
+    rows = rows[:size]
+
+    has_prev = False
+    if direction == "next" and rows:
+        newer = await database.fetchone(
+            f"SELECT 1 FROM feedback WHERE (created_at, id) > (?, ?){clause} LIMIT 1",
+            (rows[0][5], rows[0][0], *params))
+        has_prev = newer is not None
+
+    return Page([FeedbackRow(*r) for r in rows], has_prev, has_next)
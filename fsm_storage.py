@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from aiogram import Bot
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+import database
+
+logger = logging.getLogger("bot")
+
+FSM_TTL = int(os.getenv("FSM_TTL_HOURS", "24")) * 3600
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "5000"))
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "1"))
+FSM_PURGE_INTERVAL = 600
+
+
+class _Record:
+    __slots__ = ("state", "data", "updated")
+
+    def __init__(self, state: Optional[str] = None, data: Optional[Dict[str, Any]] = None, updated: float = 0.0):
+        self.state = state
+        self.data = data or {}
+        self.updated = updated
+
+    @property
+    def empty(self) -> bool:
+        return self.state is None and not self.data
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.destiny}"
+
+
+def _dumps(data: Dict[str, Any]) -> str:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в таблице fsm_state с кэшем в памяти.
+
+    Изменения копятся в памяти и пишутся пачкой раз в FSM_FLUSH_INTERVAL
+    секунд; при остановке бота сбрасываются все. Диалоги, не менявшиеся
+    дольше FSM_TTL, считаются брошенными и удаляются.
+    """
+
+    def __init__(self, ttl: int = FSM_TTL, cache_size: int = FSM_CACHE_SIZE,
+                 flush_interval: float = FSM_FLUSH_INTERVAL):
+        self.ttl = ttl
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache: "OrderedDict[str, _Record]" = OrderedDict()
+        self._dirty: Dict[str, _Record] = {}
+        self._flushing: Dict[str, _Record] = {}  # пачка, которую flush() пишет прямо сейчас
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_purge = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.flushes = 0
+
+    async def _record(self, key: StorageKey) -> _Record:
+        skey = _key(key)
+        record = self._cache.get(skey)
+        if record is None:
+            self.misses += 1
+            # Вытесненная из кэша, но ещё не записанная в базу запись свежее строки в fsm_state
+            record = self._pending(skey)
+            if record is None:
+                row = await database.fetchone(
+                    "SELECT state, data, updated_ts FROM fsm_state WHERE key = ?", (skey,))
+                # Пока шло чтение, запись могла появиться в кэше или очереди — она свежее
+                record = self._cache.get(skey) or self._pending(skey)
+                if record is None:
+                    record = _Record(row[0], json.loads(row[1]), row[2]) if row else _Record()
+            self._cache[skey] = record
+            self._cache.move_to_end(skey)
+            self._evict()
+        else:
+            self.hits += 1
+            self._cache.move_to_end(skey)
+
+        if not record.empty and time.time() - record.updated > self.ttl:
+            record.state, record.data = None, {}
+            self._touch(skey, record)
+        return record
+
+    def _pending(self, skey: str) -> Optional[_Record]:
+        record = self._dirty.get(skey)
+        return record if record is not None else self._flushing.get(skey)
+
+    def _evict(self):
+        # Несохранённые записи остаются в _dirty или _flushing; _record() берёт их оттуда
+        # раньше, чем из базы, поэтому вытесненный диалог не откатывается к старой строке
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def _touch(self, skey: str, record: _Record):
+        record.updated = time.time()
+        self._dirty[skey] = record
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def set_state(self, bot: Bot, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._touch(_key(key), record)
+
+    async def get_state(self, bot: Bot, key: StorageKey) -> Optional[str]:
+        return (await self._record(key)).state
+
+    async def set_data(self, bot: Bot, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record.data = data.copy()
+        self._touch(_key(key), record)
+
+    async def get_data(self, bot: Bot, key: StorageKey) -> Dict[str, Any]:
+        return (await self._record(key)).data.copy()
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        batch, self._dirty = self._dirty, {}
+        self._flushing = batch
+        upserts, deletes = [], []
+        for skey, record in batch.items():
+            if record.empty:
+                deletes.append((skey,))
+            else:
+                upserts.append((skey, record.state, _dumps(record.data), int(record.updated)))
+
+        try:
+            async with database.pool.writer() as db:
+                await db.executemany(
+                    """INSERT INTO fsm_state (key, state, data, updated_ts) VALUES (?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        state = excluded.state, data = excluded.data, updated_ts = excluded.updated_ts""",
+                    upserts)
+                await db.executemany("DELETE FROM fsm_state WHERE key = ?", deletes)
+        except BaseException:
+            # Не теряем изменения: вернём их в очередь, не затирая более свежие
+            for skey, record in batch.items():
+                self._dirty.setdefault(skey, record)
+            raise
+        finally:
+            self._flushing = {}
+        self.flushes += 1
+
+    async def purge_expired(self) -> int:
+        cutoff = time.time() - self.ttl
+        for skey in [k for k, r in self._cache.items()
+                     if r.updated < cutoff and k not in self._dirty and k not in self._flushing]:
+            del self._cache[skey]
+        deleted = await database.execute("DELETE FROM fsm_state WHERE updated_ts < ?", (int(cutoff),))
+        if deleted:
+            logger.info(f"FSM storage: purged {deleted} expired dialogs")
+        return deleted
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge > FSM_PURGE_INTERVAL:
+                    self._last_purge = time.time()
+                    await self.purge_expired()
+            except Exception as e:
+                logger.error(f"FSM storage flush failed: {e}")
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            # Прерванная на середине пачка вернётся в _dirty и уйдёт ниже
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"FSM storage final flush failed: {e}")
+
+    def stats(self) -> dict:
+        return {"cached": len(self._cache), "dirty": len(self._dirty),
+                "hits": self.hits, "misses": self.misses, "flushes": self.flushes}
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import queue
+import random
+import logging
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Dict, List, Optional
+
+from aiogram import BaseMiddleware
+
+from metrics import current_activity
+
+LOG_FILE = os.getenv("LOG_FILE", "bot.log")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+# Доля частых INFO-событий (extra=SAMPLED), которые попадают в лог
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+TEXT_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+
+# Пометка для частых событий вроде «пользователь открыл /help»
+SAMPLED = {"sampled": True}
+
+_update_context: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar(
+    "log_update_context", default=None)
+CONTEXT_FIELDS = ("update_id", "user_id", "handler", "duration_ms")
+
+
+class SamplingFilter(logging.Filter):
+    """Отбрасывает часть помеченных SAMPLED записей ещё до очереди"""
+
+    def __init__(self, rate: float = LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+        self.dropped = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.rate >= 1 or not getattr(record, "sampled", False) or record.levelno > logging.INFO:
+            return True
+        if random.random() < self.rate:
+            return True
+        self.dropped += 1
+        return False
+
+
+class ContextFilter(logging.Filter):
+    """Добавляет к записи апдейт, пользователя, обработчик и время от начала обработки"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        context = _update_context.get()
+        if context:
+            record.update_id = context.get("update_id")
+            record.user_id = context.get("user_id")
+        activity = current_activity()
+        if activity is not None:
+            record.handler = activity.name
+            record.duration_ms = round((time.perf_counter() - activity.started) * 1000, 1)
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """QueueHandler без форматирования в вызывающем коде и без блокировки при полной очереди.
+
+    Стандартный prepare() форматирует сообщение до постановки в очередь;
+    здесь очередь и слушатель в одном процессе, поэтому запись уходит как
+    есть, а подстановка %-аргументов и json.dumps выполняются в потоке
+    QueueListener.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            # Диск не успевает: теряем запись, но не останавливаем цикл событий
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "msg": record.getMessage(),
+        }
+        if record.name != "bot":
+            entry["logger"] = record.name
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class LogContextMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: id апдейта и пользователя для всех записей лога при его обработке"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        token = _update_context.set({"update_id": event.update_id, "user_id": user.id if user else None})
+        try:
+            return await handler(event, data)
+        finally:
+            _update_context.reset(token)
+
+
+class LogPipeline:
+    """Логгер бота пишет только в очередь; файл и консоль обслуживает отдельный поток"""
+
+    def __init__(self):
+        self.queue: queue.Queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.handler = LazyQueueHandler(self.queue)
+        self.sampling = SamplingFilter()
+        self.handler.addFilter(self.sampling)
+        self.handler.addFilter(ContextFilter())
+        self.listener: Optional[QueueListener] = None
+
+    def start(self, logger: logging.Logger, log_file: str = LOG_FILE, fmt: str = LOG_FORMAT):
+        if self.listener is not None:
+            return
+        formatter = JsonFormatter() if fmt == "json" else logging.Formatter(TEXT_FORMAT)
+        handlers: List[logging.Handler] = [
+            RotatingFileHandler(log_file, maxBytes=1_000_000, backupCount=5, encoding="utf-8"),
+            logging.StreamHandler(),
+        ]
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        logger.addHandler(self.handler)
+        self.listener = QueueListener(self.queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает поток записи"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self) -> dict:
+        return {"queued": self.queue.qsize(), "dropped": self.handler.dropped, "sampled_out": self.sampling.dropped}
+
+
+log_pipeline = LogPipeline()
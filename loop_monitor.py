@@ -0,0 +1,125 @@
+import os
+import sys
+import time
+import asyncio
+import logging
+import threading
+import traceback
+from collections import Counter
+from typing import List, Optional
+
+from metrics import Histogram, task_activity
+
+logger = logging.getLogger("bot")
+
+LOOP_LAG_INTERVAL_MS = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))  # период замера задержки
+LOOP_BLOCK_MS = float(os.getenv("LOOP_BLOCK_MS", "200"))  # 0 — стеки не снимаются
+LOOP_STACK_DEPTH = int(os.getenv("LOOP_STACK_DEPTH", "12"))
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class LoopMonitor:
+    """Сторож цикла событий: задержка планирования и стек кода, который его держит.
+
+    Корутина засыпает на interval и меряет, насколько позже она проснулась.
+    Отдельный поток следит за тем же сроком: если цикл не разбудил
+    корутину за threshold после срока, значит сейчас выполняется
+    синхронный код — поток снимает стек главного потока через
+    sys._current_frames() и пишет его в лог вместе с обработчиком, чья
+    задача сейчас выполняется. Один стек на каждую блокировку.
+    """
+
+    def __init__(self, interval_ms: float = LOOP_LAG_INTERVAL_MS, threshold_ms: float = LOOP_BLOCK_MS):
+        self.interval = interval_ms / 1000
+        self.threshold = threshold_ms / 1000
+        self.lag = Histogram(LAG_BUCKETS)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.blocks = 0
+        self.blocks_by_handler = Counter()
+        self._deadline = 0.0  # time.monotonic(), к которому корутина должна проснуться
+        self._reported: Optional[float] = None  # срок, по которому стек уже снят
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._runner: Optional[asyncio.Task] = None
+        self._sampler: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+    def start(self):
+        """Запускается из работающего цикла событий"""
+        if self._runner is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._deadline = time.monotonic() + self.interval
+        self._stopping.clear()
+        self._runner = asyncio.create_task(self._run())
+        if self.threshold:
+            self._sampler = threading.Thread(target=self._watch, name="loop-monitor", daemon=True)
+            self._sampler.start()
+
+    async def stop(self):
+        self._stopping.set()
+        if self._runner is not None:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+
+    async def _run(self):
+        while True:
+            self._deadline = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(time.monotonic() - self._deadline, 0.0)
+            self.lag.observe(lag)
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        # Проверяем чаще порога, чтобы стек был снят, пока блокировка ещё идёт
+        while not self._stopping.wait(min(self.threshold, self.interval) / 4):
+            deadline = self._deadline
+            if deadline == self._reported or time.monotonic() - deadline < self.threshold:
+                continue
+            self._reported = deadline
+            try:
+                self._report(time.monotonic() - deadline)
+            except Exception as e:
+                logger.warning(f"Loop monitor failed to capture stack: {e}")
+
+    def _report(self, overdue: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        stack = traceback.extract_stack(frame)
+        # Кадры самого asyncio (run_forever, _run_once, Handle._run) ничего не говорят о причине
+        for index in range(len(stack) - 1, -1, -1):
+            if stack[index].filename.startswith(ASYNCIO_DIR):
+                stack = stack[index + 1:] or stack
+                break
+        stack = stack[-LOOP_STACK_DEPTH:]
+        # current_task() и словарь активностей только читаются — это безопасно под GIL
+        activity = task_activity(asyncio.current_task(self._loop))
+        handler = activity.name if activity is not None else "no handler"
+        self.blocks += 1
+        self.blocks_by_handler[handler] += 1
+        logger.warning("Event loop blocked for %.0f ms so far in %s:\n%s",
+                       overdue * 1000, handler, "".join(traceback.format_list(stack)).rstrip())
+
+    def top_blockers(self, limit: int = 5) -> List[tuple]:
+        return self.blocks_by_handler.most_common(limit)
+
+    def stats(self) -> dict:
+        return {
+            "lag_ms": round(self.last_lag * 1000, 1),
+            "lag_p50_ms": round(self.lag.percentile(0.5) * 1000, 1),
+            "lag_p99_ms": round(self.lag.percentile(0.99) * 1000, 1),
+            "lag_max_ms": round(self.max_lag * 1000, 1),
+            "blocks": self.blocks,
+        }
+
+
+loop_monitor = LoopMonitor()
@@ -1,32 +1,64 @@
 import os
 import re
+import sys
 import json
 import logging
+import time
 import asyncio
+import functools
 import bcrypt
-import io
+import html
 import pytz
 from datetime import datetime, timedelta
-from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 from typing import List, Optional, Dict, Union
 
 from aiogram import Bot, Dispatcher, types, Router, F
 from aiogram.types import (
     Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton,
-    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputFile,
-    InputMediaPhoto, InputMediaDocument, ContentType
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove,
+    InputMediaDocument, ContentType
 )
-from aiogram.filters import Command
+from aiogram.filters import Command, StateFilter
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.exceptions import TelegramBadRequest
-from openpyxl import Workbook
-from aiogram.types import FSInputFile
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.types import BufferedInputFile
 
 import aiosqlite
-from PIL import Image, ImageDraw, ImageFont
+from aiohttp import web
+import database
+from database import pool as db_pool
+from slot_index import SlotEntry, slot_index, rebuild_index, check_consistency, sync_changes, prune_changes
+from migrations import create_base_schema, apply_migrations
+from bookings import commit_booking
+from stats import get_stats, breakdown, rebuild_stats, whole_hour_offset
+from feedback_browser import FeedbackFilter, fetch_page, encode_key, decode_key, day_end_key
+from cards import render_card, card_renderer
+from fsm_storage import SQLiteStorage
+from booking_calendar import calendar_keyboards
+from media_cache import media_cache, send_cached_photo, send_cached_album
+from sender import sender, SenderMiddleware, Priority
+from metrics import metrics, ApiMetricsMiddleware, METRICS_PORT, setup as setup_metrics
+from query_log import query_log
+from log_pipeline import log_pipeline, LogContextMiddleware, SAMPLED
+from loop_monitor import loop_monitor
+from exporter import booking_exporter, parse_export_filter, ExportFilter
+from reminders import reminder_scheduler
+from outbox import Notification, enqueue, outbox
+from webhook import WebhookServer
+import cluster
+from cluster import Supervisor, leader_election
+from broadcasts import (
+    broadcast_runner, count_audience, create_broadcast, attach_progress_message, cancel_broadcast,
+    BROADCAST_WATCH_INTERVAL
+)
+from slot_admin import (
+    parse_recurrence, expand_rule, bulk_add_slots,
+    parse_range_command, count_range, count_past_targets, delete_free_slots, shift_free_slots
+)
 print("✅ main.py запускается...")
 
 # Загрузка переменных окружения
@@ -45,6 +77,16 @@ class Config:
     DISCOUNT_PERCENT = int(os.getenv("DISCOUNT_PERCENT", "0"))
     MIN_REVIEWS_FOR_DISCOUNT = int(os.getenv("MIN_REVIEWS_FOR_DISCOUNT", "3"))
     PORTFOLIO_PHOTOS = os.getenv("PORTFOLIO_PHOTOS", "").split(",")
+    # Больше одного — супервизор и рабочие процессы с разбиением чатов по chat_id
+    BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+    # polling или webhook; для webhook нужен публичный HTTPS-адрес и секрет
+    BOT_MODE = os.getenv("BOT_MODE", "polling")
+    WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+    WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+    WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
 
     @classmethod
     def validate_config(cls):
@@ -54,6 +96,16 @@ class Config:
             raise ValueError("No admin IDs configured in .env file!")
         if not cls.ADMIN_PASSWORD or len(cls.ADMIN_PASSWORD) < 8:
             raise ValueError("Admin password must be at least 8 characters long!")
+        if cls.BOT_MODE not in ("polling", "webhook"):
+            raise ValueError("BOT_MODE must be 'polling' or 'webhook'!")
+        if cls.BOT_MODE == "webhook":
+            if not cls.WEBHOOK_URL.startswith("https://"):
+                raise ValueError("WEBHOOK_URL must be an https:// address in webhook mode!")
+            # Telegram принимает 1-256 символов A-Z, a-z, 0-9, _ и -
+            if not re.fullmatch(r"[A-Za-z0-9_-]{1,256}", cls.WEBHOOK_SECRET):
+                raise ValueError("WEBHOOK_SECRET must be 1-256 characters of A-Z, a-z, 0-9, _ or -!")
+
+database.configure_timezone(Config.TIMEZONE)
 
 # Глобальный хэш пароля
 ADMIN_PASSWORD_HASH = os.getenv("ADMIN_PASSWORD_HASH")
@@ -65,18 +117,11 @@ if not ADMIN_PASSWORD_HASH:
 else:
     ADMIN_PASSWORD_HASH = ADMIN_PASSWORD_HASH.encode()
 
-# Настройка логирования
-logger = logging.getLogger(__name__)
+# Настройка логирования: обработчики только ставят запись в очередь,
+# файл и консоль пишет отдельный поток (JSON, см. LOG_FORMAT)
+logger = logging.getLogger("bot")
 logger.setLevel(logging.INFO)
-
-# Handlers
-file_handler = RotatingFileHandler("bot.log", maxBytes=1_000_000, backupCount=5, encoding="utf-8")
-file_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-logger.addHandler(file_handler)
-
-console_handler = logging.StreamHandler()
-console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
-logger.addHandler(console_handler)
+log_pipeline.start(logger)
 
 # FSM состояния
 class BookingState(StatesGroup):
@@ -101,6 +146,13 @@ class AdminState(StatesGroup):
     waiting_feedback_reply = State()
     waiting_discount = State()
     adding_photographer = State()
+    adding_recurring = State()
+    feedback_jump = State()
+    confirming_recurring = State()
+    editing_range = State()
+    confirming_range = State()
+    writing_broadcast = State()
+    confirming_broadcast = State()
 
 # Сессии администраторов
 logged_in_admins = {}
@@ -120,19 +172,32 @@ def load_templates():
         "booking_cancelled": "❌ Запись отменена. Если хотите начать заново, отправьте /book.",
         "slot_taken_error": "❗ Этот слот уже занят, выберите другое время.",
         "double_booking_error": "❗ Вы уже записаны на эту дату.",
+        "slot_unavailable": "😔 Выбранное время уже недоступно — выберите другое.",
         "admin_enter_password": "🔐 Введите пароль администратора:",
         "admin_login_success": "✅ Режим администратора активирован.",
         "admin_login_fail": "❌ Неверный пароль.",
-        "admin_menu": "⚙️ Админ-команды:\n/addslot - добавить слот\n/delslot - удалить слот\n/export - экспорт записей\n/templates - изменить шаблоны\n/logout - выйти",
+        "admin_menu": "⚙️ Админ-команды:\n/addslot - добавить слот\n/addslots - серия слотов\n/slotsrange - удалить или сдвинуть слоты за период\n/broadcast - рассылка клиентам\n/delslot - удалить слот\n/export - экспорт записей\n/templates - изменить шаблоны\n/logout - выйти",
         "admin_add_slot_prompt": "📅 Отправьте дату и время нового слота (ДД.ММ.ГГГГ ЧЧ:ММ):",
         "admin_add_slot_success": "✅ Слот {date} {time} добавлен.",
         "admin_add_slot_exists": "⚠️ Такой слот уже существует.",
+        "admin_recurring_prompt": "🗓 Отправьте правило серии слотов:\nДНИ ЧЧ:ММ-ЧЧ:ММ ШАГ_МИН ДД.ММ.ГГГГ-ДД.ММ.ГГГГ [ф=ID_фотографа] [кроме=ДД.ММ.ГГГГ,...]\n\nНапример: пн-пт 10:00-18:00 60 01.11.2025-30.11.2025 кроме=04.11.2025",
+        "admin_recurring_preview": "🗓 По правилу получится слотов: {count}\nПервый: {first}\nПоследний: {last}\n\nСоздать?",
+        "admin_recurring_done": "✅ Создано слотов: {created}\n⏭ Пропущено (уже существуют): {skipped}",
+        "admin_range_prompt": "🧹 Отправьте действие и период:\nудалить ДД.ММ.ГГГГ[-ДД.ММ.ГГГГ]\nсдвиг ±МИН ДД.ММ.ГГГГ ЧЧ:ММ-ЧЧ:ММ\n\nНапример: удалить 03.11.2025-09.11.2025 или сдвиг +60 03.11.2025",
+        "admin_range_preview": "🧹 {action} за период {start} — {end}\nСвободных слотов: {free}\nЗанятых (не будут затронуты): {booked}\n\nВыполнить?",
+        "admin_range_done": "✅ Обработано слотов: {changed}\n⚠️ Конфликтов времени: {conflicts}",
+        "admin_range_booked": "📋 Занятые слоты, клиентов нужно перенести вручную:\n{list}",
+        "admin_broadcast_prompt": "📣 Отправьте текст рассылки для всех клиентов (форматирование сохранится):",
+        "admin_broadcast_preview": "📣 Получателей: {count}\n\n{text}\n\nОтправить?",
+        "admin_broadcast_empty": "⚠️ Некому отправлять: список клиентов пуст.",
+        "admin_broadcast_progress": "📣 Рассылка #{id}: {status}\nОбработано: {processed} из {total}\n✅ Доставлено: {sent}\n⚠️ Не доставлено: {failed}\n🚫 Заблокировали бота: {blocked}\n⚡ Скорость: {rate} сообщ./с",
         "admin_del_slot_prompt": "❌ Отправьте дату и время слота для удаления (ДД.ММ.ГГГГ ЧЧ:ММ):",
         "admin_del_slot_success": "✅ Слот {date} {time} удалён.",
         "admin_del_slot_not_found": "⚠️ Слот с такой датой и временем не найден.",
         "admin_del_slot_booked": "⚠️ Нельзя удалить слот: на него есть запись.",
         "admin_export_success": "✅ Экспортировано записей: {count}.",
         "admin_export_no_data": "⚠️ Записей для экспорта нет.",
+        "admin_export_usage": "📤 /export [период] [@фотограф]\nПериод: ДД.ММ.ГГГГ[-ДД.ММ.ГГГГ]\n\nНапример: /export 01.11.2025-30.11.2025 @anna",
         "admin_template_list": "📋 Список шаблонов: {keys}\nОтправьте ключ шаблона для редактирования.",
         "admin_template_prompt": "✏️ Отправьте новый текст для шаблона \"{key}\":",
         "admin_template_updated": "✅ Шаблон \"{key}\" обновлён.",
@@ -185,12 +250,42 @@ def load_templates():
 templates = load_templates()
 
 # Инициализация бота
-storage = MemoryStorage()
-bot = Bot(token=Config.BOT_TOKEN, parse_mode="HTML")
+# Диалоги хранятся в bot.db и переживают перезапуск
+storage = SQLiteStorage()
+bot = Bot(
+    token=Config.BOT_TOKEN,
+    parse_mode="HTML",
+    # Свой сервер Bot API (или его заглушка в benchmarks/load_test.py)
+    session=AiohttpSession(api=TelegramAPIServer.from_base(Config.TELEGRAM_API_URL)) if Config.TELEGRAM_API_URL else None,
+)
+# Время вызова Bot API считается вместе с ожиданием в очереди sender
+bot.session.middleware(ApiMetricsMiddleware())
+# Все исходящие запросы в чаты идут через общую очередь с лимитами Telegram
+bot.session.middleware(SenderMiddleware(sender))
 dp = Dispatcher(storage=storage)
+dp.update.outer_middleware(LogContextMiddleware())
+setup_metrics(dp)
 router = Router()
 dp.include_router(router)
 
+# Состояние подсистем в /metrics (gauge) рядом с задержками обработчиков
+for _name, _stats in {
+    "sender": sender.stats,
+    "db_pool": db_pool.stats,
+    "fsm_storage": storage.stats,
+    "card_renderer": card_renderer.stats,
+    "media_cache": media_cache.stats,
+    "calendar": calendar_keyboards.stats,
+    "reminders": reminder_scheduler.stats,
+    "outbox": outbox.stats,
+    "leader": leader_election.stats,
+    "queries": query_log.stats,
+    "logging": log_pipeline.stats,
+    "loop": loop_monitor.stats,
+    "export": booking_exporter.stats,
+}.items():
+    metrics.source(_name, _stats)
+
 # Валидация данных
 def validate_phone(phone: str) -> bool:
     return re.match(r'^\+?\d{10,15}$', phone) is not None
@@ -251,12 +346,15 @@ def get_confirm_keyboard():
 def get_admin_keyboard():
     return InlineKeyboardMarkup(inline_keyboard=[
         [InlineKeyboardButton(text="➕ Добавить слот", callback_data="admin:addslot")],
+        [InlineKeyboardButton(text="🗓 Серия слотов", callback_data="admin:recurring")],
         [InlineKeyboardButton(text="🗑️ Удалить слот", callback_data="admin:delslot")],
+        [InlineKeyboardButton(text="🧹 Слоты за период", callback_data="admin:range")],
         [InlineKeyboardButton(text="📤 Экспорт записей", callback_data="admin:export")],
         [InlineKeyboardButton(text="📝 Редактировать шаблоны", callback_data="admin:templates")],
         [InlineKeyboardButton(text="📊 Статистика", callback_data="admin:stats")],
         [InlineKeyboardButton(text="📸 Управление фотографами", callback_data="admin:photographers")],
         [InlineKeyboardButton(text="🎁 Управление скидками", callback_data="admin:discount")],
+        [InlineKeyboardButton(text="📣 Рассылка", callback_data="admin:broadcast")],
         [InlineKeyboardButton(text="📬 Отзывы", callback_data="admin:feedbacks")],
         [InlineKeyboardButton(text="🔐 Сменить пароль", callback_data="admin:changepw")],
         [InlineKeyboardButton(text="🚪 Выйти", callback_data="admin:logout")]
@@ -299,131 +397,93 @@ def get_logout_confirmation_keyboard():
     ])
 
 # Database Operations
-async def init_db():
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute("PRAGMA foreign_keys = ON")
-        
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS slots (
-            id INTEGER PRIMARY KEY,
-            datetime TEXT UNIQUE,
-            photographer_id INTEGER
-        )
-        """)
-        
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS bookings (
-            id INTEGER PRIMARY KEY,
-            slot_id INTEGER UNIQUE,
-            user_id INTEGER,
-            name TEXT,
-            contact TEXT,
-            shoot_type TEXT,
-            reminder_sent INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(slot_id) REFERENCES slots(id) ON DELETE CASCADE
-        )
-        """)
-        
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS feedback (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER,
-            user_name TEXT,
-            text TEXT,
-            photo_id TEXT,
-            rating INTEGER,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """)
-        
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS user_settings (
-            user_id INTEGER PRIMARY KEY,
-            language TEXT DEFAULT 'ru',
-            discount_eligible INTEGER DEFAULT 0
-        )
-        """)
-        
-        await db.execute("""
-        CREATE TABLE IF NOT EXISTS photographers (
-            id INTEGER PRIMARY KEY,
-            user_id INTEGER UNIQUE,
-            username TEXT,
-            specialties TEXT
-        )
-        """)
-        
-        # Индексы
-        await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_slot_unique ON bookings(slot_id)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_datetime ON slots(datetime)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings(created_at)")
-        await db.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating ON feedback(rating)")
-        
-        await db.commit()
+async def init_db(load_caches: bool = True):
+    # Пул открывается один раз: WAL и прагмы применяются к каждому соединению
+    await db_pool.open()
+
+    async with db_pool.writer() as db:
+        await create_base_schema(db)
+        await apply_migrations(db)
+
+    if not load_caches:
+        return
+
+    await rebuild_index()
+    await media_cache.load()
+    await media_cache.prune_urls(portfolio_urls())
 
 async def get_user_language(user_id: int) -> str:
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            "SELECT language FROM user_settings WHERE user_id = ?",
-            (user_id,)
-        )
-        result = await cursor.fetchone()
-        return result[0] if result else Config.DEFAULT_LANGUAGE
+    result = await database.fetchone(
+        "SELECT language FROM user_settings WHERE user_id = ?",
+        (user_id,)
+    )
+    return result[0] if result else Config.DEFAULT_LANGUAGE
 
 async def set_user_language(user_id: int, language: str):
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute(
-            "INSERT OR REPLACE INTO user_settings (user_id, language) VALUES (?, ?)",
-            (user_id, language)
-        )
-        await db.commit()
+    await database.execute(
+        """INSERT INTO user_settings (user_id, language) VALUES (?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET language = excluded.language""",
+        (user_id, language)
+    )
+
+async def register_user(user_id: int):
+    # Пользователь снова пишет боту — значит, больше не заблокировал его
+    await database.execute(
+        """INSERT INTO user_settings (user_id) VALUES (?)
+        ON CONFLICT(user_id) DO UPDATE SET bot_blocked = 0 WHERE bot_blocked = 1""",
+        (user_id,)
+    )
 
 async def get_available_slots():
-    now = datetime.now()
+    now = database.local_now()
     next_month = now + timedelta(days=Config.SLOTS_DAYS_AHEAD)
     
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            """SELECT s.id, s.datetime, s.photographer_id, p.username
-            FROM slots s
-            LEFT JOIN bookings b ON s.id = b.slot_id
-            LEFT JOIN photographers p ON s.photographer_id = p.id
-            WHERE b.slot_id IS NULL AND datetime >= ? AND datetime <= ?
-            ORDER BY datetime""",
-            (now.strftime("%Y-%m-%d %H:%M:%S"), next_month.strftime("%Y-%m-%d %H:%M:%S"))
-        )
-        return await cursor.fetchall()
+    return await database.fetchall(
+        """SELECT s.id, s.datetime, s.photographer_id, p.username
+        FROM slots s
+        LEFT JOIN bookings b ON s.id = b.slot_id
+        LEFT JOIN photographers p ON s.photographer_id = p.id
+        WHERE b.slot_id IS NULL AND s.start_ts BETWEEN ? AND ?
+        ORDER BY s.start_ts""",
+        (database.to_epoch(now), database.to_epoch(next_month))
+    )
 
 async def add_booking(slot_id: int, user_id: int, name: str, contact: str, shoot_type: str):
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute(
-            """INSERT INTO bookings (slot_id, user_id, name, contact, shoot_type)
-            VALUES (?, ?, ?, ?, ?)""",
-            (slot_id, user_id, name, contact, shoot_type))
-        await db.commit()
+    result = await commit_booking(slot_id, user_id, name, contact, shoot_type)
+    if result.conflict in (None, "slot_taken"):
+        slot_index.remove(slot_id)
+    if result.ok and leader_election.is_leader:
+        # Иначе запись подхватит лидер (reminder_scheduler.watch_new)
+        reminder_scheduler.schedule_booking(result.booking_id, result.start_ts)
+    return result
 
 async def add_slot(dt: datetime, photographer_id: int = None):
     iso_dt = dt.strftime("%Y-%m-%d %H:%M:%S")
     
-    async with aiosqlite.connect("bot.db") as db:
+    async with db_pool.writer() as db:
         cursor = await db.execute(
             "SELECT 1 FROM slots WHERE datetime = ?",
             (iso_dt,))
         if await cursor.fetchone():
             return False
         
-        await db.execute(
-            "INSERT INTO slots(datetime, photographer_id) VALUES (?, ?)",
-            (iso_dt, photographer_id))
-        await db.commit()
-        return True
+        cursor = await db.execute(
+            "INSERT INTO slots(datetime, photographer_id, start_ts, day_key) VALUES (?, ?, ?, ?)",
+            (iso_dt, photographer_id, database.to_epoch(dt), database.day_key(dt)))
+        slot_id = cursor.lastrowid
+
+        cursor = await db.execute(
+            "SELECT username FROM photographers WHERE id = ?",
+            (photographer_id,))
+        photographer = await cursor.fetchone()
+
+    slot_index.add(slot_id, dt, photographer[0] if photographer else None)
+    return True
 
 async def delete_slot(dt: datetime):
     iso_dt = dt.strftime("%Y-%m-%d %H:%M:%S")
     
-    async with aiosqlite.connect("bot.db") as db:
+    async with db_pool.writer() as db:
         cursor = await db.execute(
             "SELECT id FROM slots WHERE datetime = ?",
             (iso_dt,))
@@ -443,11 +503,12 @@ async def delete_slot(dt: datetime):
         await db.execute(
             "DELETE FROM slots WHERE id = ?",
             (slot_id,))
-        await db.commit()
-        return "success"
+
+    slot_index.remove(slot_id)
+    return "success"
 
 async def export_bookings():
-    async with aiosqlite.connect("bot.db") as db:
+    async with db_pool.reader() as db:
         cursor = await db.execute(
             """SELECT s.datetime, b.name, b.contact, b.shoot_type, b.created_at, p.username
             FROM bookings b
@@ -480,39 +541,25 @@ async def export_bookings():
         
         return "\n".join(csv_lines)
 
-async def get_stats():
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM bookings")
-        total = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute(
-            "SELECT COUNT(*) FROM bookings WHERE datetime(created_at) >= datetime('now', '-7 days')")
-        last_week = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute(
-            """SELECT COUNT(*)
-            FROM slots s
-            LEFT JOIN bookings b ON s.id = b.slot_id
-            WHERE b.slot_id IS NULL AND datetime >= datetime('now')""")
-        free_slots = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT AVG(rating) FROM feedback WHERE rating IS NOT NULL")
-        avg_rating = round((await cursor.fetchone())[0] or 0, 1)
-        
-        return {
-            "total": total,
-            "last_week": last_week,
-            "free_slots": free_slots,
-            "avg_rating": avg_rating
-        }
-
 async def add_feedback(user_id: int, user_name: str, text: str, photo_id: str = None, rating: int = None):
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute(
+    async with db_pool.writer() as db:
+        cursor = await db.execute(
             """INSERT INTO feedback (user_id, user_name, text, photo_id, rating)
             VALUES (?, ?, ?, ?, ?)""",
             (user_id, user_name, text, photo_id, rating))
-        await db.commit()
+        feedback_id = cursor.lastrowid
+
+        # Notify admins — в той же транзакции, доставка в фоне
+        admin_text = templates["feedback_received"].format(
+            name=user_name,
+            user_id=user_id,
+            feedback=text,
+            rating=rating
+        )
+        await enqueue(db, [
+            Notification(f"feedback:{feedback_id}:admin:{admin_id}", admin_id, admin_text)
+            for admin_id in Config.ADMIN_IDS
+        ])
         
         # Проверяем, достаточно ли отзывов для скидки
         cursor = await db.execute(
@@ -520,42 +567,34 @@ async def add_feedback(user_id: int, user_name: str, text: str, photo_id: str =
             (user_id,))
         feedback_count = (await cursor.fetchone())[0]
         
-        if feedback_count >= Config.MIN_REVIEWS_FOR_DISCOUNT:
+        eligible = feedback_count >= Config.MIN_REVIEWS_FOR_DISCOUNT
+        if eligible:
             await db.execute(
                 "UPDATE user_settings SET discount_eligible = 1 WHERE user_id = ?",
                 (user_id,))
-            await db.commit()
-            return True
-        
-        return False
+
+    outbox.wake()
+    return eligible
 
 async def check_discount_eligible(user_id: int):
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            "SELECT discount_eligible FROM user_settings WHERE user_id = ?",
-            (user_id,))
-        result = await cursor.fetchone()
-        return result[0] if result else False
+    result = await database.fetchone(
+        "SELECT discount_eligible FROM user_settings WHERE user_id = ?",
+        (user_id,))
+    return result[0] if result else False
 
 async def get_photographers():
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute("SELECT id, user_id, username, specialties FROM photographers")
-        return await cursor.fetchall()
+    return await database.fetchall("SELECT id, user_id, username, specialties FROM photographers")
 
 async def add_photographer(user_id: int, username: str, specialties: str = ""):
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute(
-            """INSERT INTO photographers (user_id, username, specialties)
-            VALUES (?, ?, ?)""",
-            (user_id, username, specialties))
-        await db.commit()
+    await database.execute(
+        """INSERT INTO photographers (user_id, username, specialties)
+        VALUES (?, ?, ?)""",
+        (user_id, username, specialties))
 
 async def assign_photographer_to_slot(slot_id: int, photographer_id: int):
-    async with aiosqlite.connect("bot.db") as db:
-        await db.execute(
-            "UPDATE slots SET photographer_id = ? WHERE id = ?",
-            (photographer_id, slot_id))
-        await db.commit()
+    await database.execute(
+        "UPDATE slots SET photographer_id = ? WHERE id = ?",
+        (photographer_id, slot_id))
 
 # Helper functions
 from typing import Optional
@@ -570,49 +609,18 @@ def parse_datetime_ru(dt_str: str) -> Optional[datetime]:
 def format_datetime_ru(dt: datetime) -> str:
     return dt.strftime("%d.%m.%Y %H:%M")
 
-async def generate_booking_card(data: dict) -> io.BytesIO:
-    try:
-        try:
-            font = ImageFont.truetype("arial.ttf", 30)
-        except IOError:
-            font = ImageFont.load_default()
-        
-        image = Image.new('RGB', (800, 600), color=(73, 109, 137))
-        draw = ImageDraw.Draw(image)
-        
-        text_lines = [
-            "📷 Подтверждение записи",
-            "",
-            f"📅 Дата: {data['date']}",
-            f"⏰ Время: {data['time']}",
-            f"👤 Имя: {data['name']}",
-            f"📞 Телефон: {data['phone']}",
-            f"📸 Тип съемки: {data['shoot_type']}",
-            "",
-            "Сохраните эту карточку!"
-        ]
-        
-        y_position = 50
-        for line in text_lines:
-            draw.text((50, y_position), line, fill=(255, 255, 255), font=font)
-            y_position += 40
-        
-        buf = io.BytesIO()
-        image.save(buf, format='PNG')
-        buf.seek(0)
-        return buf
-    except Exception as e:
-        logger.error(f"Error generating booking card: {e}")
-        return None
+async def generate_booking_card(data: dict) -> Optional[bytes]:
+    # Рисование и кодирование PNG выполняются в пуле потоков, результат кэшируется
+    return await render_card(data)
 
 async def send_confirmation_card(user_id: int, booking_data: dict):
     card_image = await generate_booking_card(booking_data)
     
     if card_image:
         try:
-            await bot.send_photo(
-                user_id,
-                photo=InputFile(card_image, filename="booking.png"),
+            await send_cached_photo(
+                functools.partial(bot.send_photo, user_id),
+                card_image, "booking.png",
                 caption=templates["confirmation_card"].format(**booking_data))
             return
         except Exception as e:
@@ -627,18 +635,18 @@ async def send_confirmation_card(user_id: int, booking_data: dict):
     
     await bot.send_message(user_id, card_text)
 
+def portfolio_urls() -> List[str]:
+    return [url.strip() for url in Config.PORTFOLIO_PHOTOS if url.strip()]
+
 async def send_portfolio(user_id: int):
     try:
         if not Config.PORTFOLIO_PHOTOS:
             raise ValueError("No portfolio photos configured")
             
-        media = []
-        for photo_url in Config.PORTFOLIO_PHOTOS:
-            if photo_url.strip():
-                media.append(InputMediaPhoto(media=photo_url.strip()))
-        
-        if media:
-            await bot.send_media_group(user_id, media)
+        # После первой отправки фото уходят по file_id, без повторного скачивания Telegram
+        urls = portfolio_urls()
+        if urls:
+            await send_cached_album(bot, user_id, urls)
         else:
             await bot.send_message(user_id, templates["portfolio_error"])
     except Exception as e:
@@ -648,84 +656,84 @@ async def send_portfolio(user_id: int):
 # User Handlers
 @router.message(Command("start"))
 async def cmd_start(message: Message):
+    await register_user(message.from_user.id)
     await message.answer(templates["start"])
-    logger.info(f"User {message.from_user.id} started bot")
+    logger.info("User %s started bot", message.from_user.id, extra=SAMPLED)
 
 @router.message(Command("help"))
 async def cmd_help(message: Message):
     await message.answer(templates["help_text"])
-    logger.info(f"User {message.from_user.id} requested help")
+    logger.info("User %s requested help", message.from_user.id, extra=SAMPLED)
 
 @router.message(Command("faq"))
 async def cmd_faq(message: Message):
     await message.answer(templates["faq_text"])
-    logger.info(f"User {message.from_user.id} requested FAQ")
+    logger.info("User %s requested FAQ", message.from_user.id, extra=SAMPLED)
 
 @router.message(Command("portfolio"))
 async def cmd_portfolio(message: Message):
     await send_portfolio(message.chat.id)
-    logger.info(f"User {message.from_user.id} requested portfolio")
+    logger.info("User %s requested portfolio", message.from_user.id, extra=SAMPLED)
 
 @router.message(Command("mybooking"))
 async def cmd_mybooking(message: Message):
     user_id = message.from_user.id
     
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            """SELECT s.datetime, b.name, b.contact, b.shoot_type, p.username
-            FROM bookings b
-            JOIN slots s ON b.slot_id = s.id
-            LEFT JOIN photographers p ON s.photographer_id = p.id
-            WHERE b.user_id = ? AND s.datetime >= ?
-            ORDER BY s.datetime LIMIT 1""",
-            (user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-        booking = await cursor.fetchone()
+    booking = await database.fetchone(
+        """SELECT s.datetime, b.name, b.contact, b.shoot_type, p.username
+        FROM bookings b
+        JOIN slots s ON b.slot_id = s.id
+        LEFT JOIN photographers p ON s.photographer_id = p.id
+        WHERE b.user_id = ? AND s.start_ts >= ?
+        ORDER BY s.start_ts LIMIT 1""",
+        (user_id, database.to_epoch(database.local_now())))
+    
+    if booking:
+        dt_obj = datetime.strptime(booking[0], "%Y-%m-%d %H:%M:%S")
+        data = {
+            "date": dt_obj.strftime("%d.%m.%Y"),
+            "time": dt_obj.strftime("%H:%M"),
+            "name": booking[1],
+            "phone": booking[2],
+            "shoot_type": booking[3],
+            "photographer": booking[4] or "Не назначен"
+        }
         
-        if booking:
-            dt_obj = datetime.strptime(booking[0], "%Y-%m-%d %H:%M:%S")
-            data = {
-                "date": dt_obj.strftime("%d.%m.%Y"),
-                "time": dt_obj.strftime("%H:%M"),
-                "name": booking[1],
-                "phone": booking[2],
-                "shoot_type": booking[3],
-                "photographer": booking[4] or "Не назначен"
-            }
-            
-            # Generate and send card
-            card_image = await generate_booking_card(data)
-            if card_image:
-                try:
-                    await message.answer_photo(
-                        photo=InputFile(card_image, filename="booking.png"),
-                        caption="✅ Ваша текущая запись:"
-                    )
-                    logger.info(f"User {user_id} viewed their booking (image)")
-                    return
-                except Exception as e:
-                    logger.error(f"Failed to send booking card: {e}")
-            
-            # Fallback to text
-            booking_text = (
-                "✅ Ваша текущая запись:\n\n"
-                f"📅 Дата: {data['date']}\n"
-                f"⏰ Время: {data['time']}\n"
-                f"👤 Имя: {data['name']}\n"
-                f"📞 Телефон: {data['phone']}\n"
-                f"�� Тип съемки: {data['shoot_type']}\n"
-                f"👨‍🎨 Фотограф: {data['photographer']}"
-            )
-            await message.answer(booking_text)
-            logger.info(f"User {user_id} viewed their booking (text)")
-        else:
-            await message.answer(templates["no_active_bookings"])
-            logger.info(f"User {user_id} has no active bookings")
+        # Generate and send card
+        card_image = await generate_booking_card(data)
+        if card_image:
+            try:
+                await send_cached_photo(
+                    message.answer_photo,
+                    card_image, "booking.png",
+                    caption="✅ Ваша текущая запись:"
+                )
+                logger.info("User %s viewed their booking (image)", user_id, extra=SAMPLED)
+                return
+            except Exception as e:
+                logger.error(f"Failed to send booking card: {e}")
+        
+        # Fallback to text
+        booking_text = (
+            "✅ Ваша текущая запись:\n\n"
+            f"📅 Дата: {data['date']}\n"
+            f"⏰ Время: {data['time']}\n"
+            f"👤 Имя: {data['name']}\n"
+            f"📞 Телефон: {data['phone']}\n"
+            f"�� Тип съемки: {data['shoot_type']}\n"
+            f"👨‍🎨 Фотограф: {data['photographer']}"
+        )
+        await message.answer(booking_text)
+        logger.info("User %s viewed their booking (text)", user_id, extra=SAMPLED)
+    else:
+        await message.answer(templates["no_active_bookings"])
+        logger.info("User %s has no active bookings", user_id, extra=SAMPLED)
 
 @router.message(Command("feedback"))
 async def cmd_feedback(message: Message, state: FSMContext):
     await message.answer(templates["feedback_prompt"])
     await state.set_state(BookingState.feedback_text)
-    logger.info(f"User {message.from_user.id} started feedback")
+    logger.info("User %s started feedback", message.from_user.id, extra=SAMPLED)
 
 @router.message(BookingState.feedback_text)
 async def process_feedback_text(message: Message, state: FSMContext):
@@ -767,23 +775,8 @@ async def process_feedback_rating(callback: CallbackQuery, state: FSMContext):
     await add_feedback(user_id, user_name, feedback_text, photo_id, rating)
     await callback.message.answer(templates["feedback_thanks"])
     
-    # Notify admins
-    for admin_id in Config.ADMIN_IDS:
-        try:
-            await bot.send_message(
-                admin_id,
-                templates["feedback_received"].format(
-                    name=user_name,
-                    user_id=user_id,
-                    feedback=feedback_text,
-                    rating=rating
-                )
-            )
-        except Exception as e:
-            logger.error(f"Failed to send feedback to admin {admin_id}: {e}")
-    
     await state.clear()
-    logger.info(f"User {user_id} submitted feedback with rating {rating}")
+    logger.info("User %s submitted feedback with rating %s", user_id, rating)
 
 @router.message(Command("language"))
 async def cmd_language(message: Message):
@@ -800,70 +793,115 @@ async def set_language(callback: CallbackQuery):
     await callback.answer(templates["language_set"].format(language=language))
     await callback.message.delete()
 
-@router.message(Command("book"))
-async def cmd_book(message: Message, state: FSMContext):
-    free_slots = await get_available_slots()
+async def show_booking_dates(message: Message, state: FSMContext, notice: str = "") -> bool:
+    # Свободные даты берутся из индекса в памяти, без запроса к базе
+    now = database.local_now()
+    dates = slot_index.available_dates(now, Config.SLOTS_DAYS_AHEAD)
 
-    if not free_slots:
-        await message.answer("😔 На данный момент нет свободных слотов для записи.")
-        return
+    if not dates:
+        await message.answer(notice + "😔 На данный момент нет свободных слотов для записи.")
+        await state.clear()
+        return False
 
-    date_to_slots = {}
-    for slot in free_slots:
-        dt_obj = datetime.strptime(slot[1], "%Y-%m-%d %H:%M:%S")
-        date_str = dt_obj.strftime("%d.%m.%Y")
-        time_str = dt_obj.strftime("%H:%M")
-        photographer_info = f" (@{slot[3]})" if slot[3] else ""
-        date_to_slots.setdefault(date_str, []).append((slot[0], time_str, photographer_info))
+    # Календарь открывается на месяце ближайшей свободной даты
+    page = calendar_keyboards.page_of(dates[0], now)
+    await message.answer(
+        notice + templates["ask_date"],
+        reply_markup=calendar_keyboards.dates(page, now, Config.SLOTS_DAYS_AHEAD)
+    )
 
-    buttons = []
-    for date_str in sorted(date_to_slots.keys()):
-        buttons.append([InlineKeyboardButton(text=date_str, callback_data=f"date:{date_str}")])
+    # В сессии только выбор пользователя, детали слота — из slot_index
+    await state.set_data({})
+    await state.set_state(BookingState.picking_date)
+    return True
 
-    if not buttons:
-        await message.answer("😔 Нет доступных дат для записи.")
-        return
+def resolve_session_slot(data: dict) -> Optional[SlotEntry]:
+    """Выбранный слот из общего индекса; None — слот больше недоступен.
 
-    await message.answer(
-    templates["ask_date"],
-    reply_markup=create_inline_keyboard(buttons)
-)
+    Поиск в индексе — словарь в памяти, поэтому слот проверяется на каждом
+    шаге: его могли занять, удалить или время могло пройти.
+    """
+    slot_id = data.get("chosen_slot")
+    if slot_id is None:
+        return None
+    return slot_index.get(slot_id, database.local_now())
 
-    
-    await state.update_data(date_to_slots=date_to_slots)
-    await state.set_state(BookingState.picking_date)
+async def slot_unavailable(message: Message, state: FSMContext):
+    await show_booking_dates(message, state, templates["slot_unavailable"] + "\n\n")
 
-    logger.info(f"User {message.from_user.id} started booking")
+def slot_text(entry: SlotEntry) -> str:
+    return f"{entry.time_str}{entry.photographer_info}"
+
+@router.message(Command("book"))
+async def cmd_book(message: Message, state: FSMContext):
+    if await show_booking_dates(message, state):
+        logger.info("User %s started booking", message.from_user.id, extra=SAMPLED)
 
 @router.callback_query(F.data.startswith("date:"), BookingState.picking_date)
 async def on_date_chosen(callback: CallbackQuery, state: FSMContext):
     date_str = callback.data.split(":", 1)[1]
-    data = await state.get_data()
-    date_to_slots = data.get("date_to_slots", {})
 
-    if date_str not in date_to_slots:
+    try:
+        day = datetime.strptime(date_str, "%d.%m.%Y").date()
+    except ValueError:
+        day = None
+
+    now = database.local_now()
+    times = slot_index.slots_for_day(day, now, Config.SLOTS_DAYS_AHEAD) if day else []
+    if not times:
         await callback.answer("❌ Неверная дата, попробуйте снова.", show_alert=True)
         return
 
-    times = date_to_slots[date_str]
-    time_buttons = [
-        [InlineKeyboardButton(
-            text=f"{time_str}{photographer_info}",
-            callback_data=f"time:{slot_id}"
-        )] for slot_id, time_str, photographer_info in times
-    ]
-
-    time_keyboard = create_inline_keyboard(time_buttons)
-
     await callback.answer()
     await callback.message.edit_text(
         f"📆 Дата: {date_str}\n{templates['ask_time']}",
-        reply_markup=time_keyboard
+        reply_markup=calendar_keyboards.times(day, 0, now, Config.SLOTS_DAYS_AHEAD)
     )
     await state.update_data(chosen_date=date_str)
     await state.set_state(BookingState.picking_time)
 
 
+@router.callback_query(F.data.startswith("cal:"), StateFilter(BookingState.picking_date, BookingState.picking_time))
+async def on_calendar_page(callback: CallbackQuery, state: FSMContext):
+    page_str = callback.data.split(":", 1)[1]
+    if not page_str.lstrip("-").isdigit():
+        await callback.answer()
+        return
+
+    await callback.answer()
+    keyboard = calendar_keyboards.dates(int(page_str), database.local_now(), Config.SLOTS_DAYS_AHEAD)
+    if await state.get_state() == BookingState.picking_time.state:
+        # Возврат от выбора времени к календарю
+        await callback.message.edit_text(templates["ask_date"], reply_markup=keyboard)
+        await state.set_state(BookingState.picking_date)
+    else:
+        try:
+            await callback.message.edit_reply_markup(reply_markup=keyboard)
+        except TelegramBadRequest as e:
+            logger.warning(f"Calendar page not updated: {e}")
+
+@router.callback_query(F.data.startswith("tpage:"), BookingState.picking_time)
+async def on_time_page(callback: CallbackQuery, state: FSMContext):
+    try:
+        _, date_str, page_str = callback.data.split(":")
+        day = datetime.strptime(date_str, "%d.%m.%Y").date()
+        page = int(page_str)
+    except ValueError:
+        await callback.answer()
+        return
+
+    await callback.answer()
+    try:
+        await callback.message.edit_reply_markup(
+            reply_markup=calendar_keyboards.times(day, page, database.local_now(), Config.SLOTS_DAYS_AHEAD))
+    except TelegramBadRequest as e:
+        logger.warning(f"Time page not updated: {e}")
+
+@router.callback_query(F.data == "none")
+async def on_noop_button(callback: CallbackQuery):
+    # Заголовки и пустые дни календаря
+    await callback.answer()
+
 @router.callback_query(F.data.startswith("time:"), BookingState.picking_time)
 async def on_time_chosen(callback: CallbackQuery, state: FSMContext):
     slot_id_str = callback.data.split(":", 1)[1]
@@ -874,31 +912,21 @@ async def on_time_chosen(callback: CallbackQuery, state: FSMContext):
 
     slot_id = int(slot_id_str)
     data = await state.get_data()
-    date_str = data.get("chosen_date")
-    date_to_slots = data.get("date_to_slots", {})
-    time_str = None
-    photographer_info = ""
+    entry = slot_index.get(slot_id, database.local_now())
 
-    if date_str and date_str in date_to_slots:
-        for sid, t, p in date_to_slots[date_str]:
-            if sid == slot_id:
-                time_str = t
-                photographer_info = p
-                break
-
-    if not time_str:
-        await callback.answer("❌ Время не найдено, выберите другой слот.", show_alert=True)
+    if not entry or entry.date_str != data.get("chosen_date"):
+        await callback.answer(templates["slot_unavailable"], show_alert=True)
+        await slot_unavailable(callback.message, state)
         return
 
     await state.update_data(
         chosen_slot=slot_id,
-        chosen_time=time_str,
-        photographer_info=photographer_info
+        dialog_msg_id=callback.message.message_id
     )
     
     await callback.answer()
     await callback.message.edit_text(
-        f"📆 Дата: {date_str}\n⏰ Время: {time_str}{photographer_info}\n{templates['ask_type']}",
+        f"📆 Дата: {entry.date_str}\n⏰ Время: {slot_text(entry)}\n{templates['ask_type']}",
         reply_markup=None
     )
     await state.set_state(BookingState.waiting_type)
@@ -920,13 +948,14 @@ async def on_type_received(message: Message, state: FSMContext):
 
     await state.update_data(shoot_type=shoot_type)
     data = await state.get_data()
+    entry = resolve_session_slot(data)
+    if not entry:
+        await slot_unavailable(message, state)
+        return
     dialog_msg_id = data.get("dialog_msg_id")
-    date_str = data.get("chosen_date")
-    time_str = data.get("chosen_time")
-    photographer_info = data.get("photographer_info", "")
 
-    new_text = (f"📆 Дата: {date_str}\n"
-                f"⏰ Время: {time_str}{photographer_info}\n"
+    new_text = (f"📆 Дата: {entry.date_str}\n"
+                f"⏰ Время: {slot_text(entry)}\n"
                 f"📷 Тип: {shoot_type}\n"
                 f"{templates['ask_name']}")
 
@@ -962,14 +991,15 @@ async def on_name_received(message: Message, state: FSMContext):
 
     await state.update_data(client_name=name)
     data = await state.get_data()
+    entry = resolve_session_slot(data)
+    if not entry:
+        await slot_unavailable(message, state)
+        return
     dialog_msg_id = data.get("dialog_msg_id")
-    date_str = data.get("chosen_date")
-    time_str = data.get("chosen_time")
     shoot_type = data.get("shoot_type")
-    photographer_info = data.get("photographer_info", "")
 
-    new_text = (f"📆 Дата: {date_str}\n"
-                f"⏰ Время: {time_str}{photographer_info}\n"
+    new_text = (f"📆 Дата: {entry.date_str}\n"
+                f"⏰ Время: {slot_text(entry)}\n"
                 f"📷 Тип: {shoot_type}\n"
                 f"👤 Имя: {name}")
 
@@ -1016,15 +1046,16 @@ async def on_contact_received(message: Message, state: FSMContext):
 
     await state.update_data(contact=phone)
     data = await state.get_data()
+    entry = resolve_session_slot(data)
+    if not entry:
+        await slot_unavailable(message, state)
+        return
     dialog_msg_id = data.get("dialog_msg_id")
-    date_str = data.get("chosen_date")
-    time_str = data.get("chosen_time")
     shoot_type = data.get("shoot_type")
     name = data.get("client_name")
-    photographer_info = data.get("photographer_info", "")
 
     confirm_text = templates["confirm_details"].format(
-        date=date_str, time=f"{time_str}{photographer_info}",
+        date=entry.date_str, time=slot_text(entry),
         shoot_type=shoot_type, name=name, phone=phone
     )
 
@@ -1062,13 +1093,9 @@ async def on_confirm(callback: CallbackQuery, state: FSMContext):
     action = callback.data.split(":", 1)[1]
     data = await state.get_data()
     user_id = callback.from_user.id
-    dialog_msg_id = data.get("dialog_msg_id")
-    date_str = data.get("chosen_date")
-    time_str = data.get("chosen_time")
     shoot_type = data.get("shoot_type")
     name = data.get("client_name")
     phone = data.get("contact")
-    photographer_info = data.get("photographer_info", "")
 
     if action == "yes":
         slot_id = data.get("chosen_slot")
@@ -1076,51 +1103,67 @@ async def on_confirm(callback: CallbackQuery, state: FSMContext):
             await callback.answer("Ошибка: слот не найден.", show_alert=True)
             return
 
-        appt_dt = datetime.strptime(f"{date_str} {time_str}", "%d.%m.%Y %H:%M")
-        iso_dt = appt_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-        async with aiosqlite.connect("bot.db") as db:
-            await db.execute("PRAGMA foreign_keys = ON")
-            
-            # Check if user already booked this slot
-            cur = await db.execute(
-                "SELECT 1 FROM bookings WHERE slot_id = ? AND user_id = ?",
-                (slot_id, user_id)
+        # Детали слота — из индекса до бронирования: после него слот из индекса уходит
+        entry = resolve_session_slot(data)
+        if not entry:
+            await callback.answer(templates["slot_unavailable"], show_alert=True)
+            await slot_unavailable(callback.message, state)
+            return
+        date_str, time_str, photographer_info = entry.date_str, entry.time_str, entry.photographer_info
+
+        def booking_notifications(booking):
+            # Уведомления администраторам и фотографу пишутся в outbox вместе с записью
+            admin_text = (f"✅ Новая запись!\nДата: {date_str} {time_str}{photographer_info}\n"
+                          f"Клиент: {name}\nТел: {phone}\nТип: {shoot_type}")
+            notifications = [
+                Notification(f"booking:{booking.booking_id}:admin:{admin_id}", admin_id, admin_text)
+                for admin_id in Config.ADMIN_IDS
+            ]
+            if booking.photographer_user_id:
+                notifications.append(Notification(
+                    f"booking:{booking.booking_id}:photographer",
+                    booking.photographer_user_id,
+                    templates["photographer_notify"].format(
+                        date=date_str,
+                        time=time_str,
+                        name=name,
+                        phone=phone
+                    )))
+            return notifications
+
+        # Проверки, вставка и поиск фотографа — одна транзакция BEGIN IMMEDIATE
+        result = await commit_booking(slot_id, user_id, name, phone, shoot_type, notify=booking_notifications)
+        conflict = "slot_taken" if result.conflict == "not_found" else result.conflict
+
+        if conflict in (None, "slot_taken"):
+            # Слот больше не свободен — убираем его из индекса
+            slot_index.remove(slot_id)
+        if result.ok and leader_election.is_leader:
+            # Иначе запись подхватит лидер (reminder_scheduler.watch_new)
+            reminder_scheduler.schedule_booking(result.booking_id, result.start_ts)
+
+        if conflict == "same_slot":
+            await callback.message.edit_text(
+                "❗ Вы уже записаны на этот временной слот",
+                reply_markup=None
             )
-            if await cur.fetchone():
-                await callback.message.edit_text(
-                    "❗ Вы уже записаны на этот временной слот",
-                    reply_markup=None
-                )
-                await state.clear()
-                return
+            await state.clear()
+            await callback.answer()
+            return
 
-            # Check for double booking
-            cur = await db.execute(
-                "SELECT 1 FROM bookings b JOIN slots s ON b.slot_id = s.id "
-                "WHERE b.user_id = ? AND date(s.datetime) = date(?)",
-                (user_id, iso_dt)
-            )
-            if await cur.fetchone():
-                await callback.message.edit_text(templates["double_booking_error"], reply_markup=None)
-                await state.clear()
-                logger.info(f"Booking failed: user {user_id} already has a booking on {date_str}.")
-                await callback.answer()
-                return
+        if conflict == "same_day":
+            await callback.message.edit_text(templates["double_booking_error"], reply_markup=None)
+            await state.clear()
+            logger.info("Booking failed: user %s already has a booking on %s.", user_id, date_str)
+            await callback.answer()
+            return
 
-            # Insert booking with unique constraint protection
-            try:
-                await db.execute(
-                    "INSERT INTO bookings (slot_id, user_id, name, contact, shoot_type) VALUES (?, ?, ?, ?, ?)",
-                    (slot_id, user_id, name, phone, shoot_type)
-                )
-                await db.commit()
-            except aiosqlite.IntegrityError:
-                await callback.message.edit_text(templates["slot_taken_error"], reply_markup=None)
-                await state.clear()
-                logger.warning(f"Booking failed: slot already taken (race condition). User: {user_id}")
-                await callback.answer()
-                return
+        if conflict == "slot_taken":
+            await callback.message.edit_text(templates["slot_taken_error"], reply_markup=None)
+            await state.clear()
+            logger.warning("Booking failed: slot already taken (race condition). User: %s", user_id)
+            await callback.answer()
+            return
 
         # Send confirmation
         confirmed_text = templates["booking_confirmed"].format(date=date_str, time=f"{time_str}{photographer_info}")
@@ -1136,41 +1179,10 @@ async def on_confirm(callback: CallbackQuery, state: FSMContext):
         }
         await send_confirmation_card(user_id, booking_data)
 
-        # Send notification to all admins and assigned photographer
-        admin_text = (f"✅ Новая запись!\nДата: {date_str} {time_str}{photographer_info}\n"
-                     f"Клиент: {name}\nТел: {phone}\nТип: {shoot_type}")
-
-        # Notify admins
-        for admin_id in Config.ADMIN_IDS:
-            try:
-                await bot.send_message(admin_id, admin_text)
-            except Exception as e:
-                logger.error(f"Failed to send notification to admin {admin_id}: {e}")
-
-        # Notify assigned photographer if exists
-        cursor = await db.execute(
-            "SELECT photographer_id FROM slots WHERE id = ?",
-            (slot_id,)
-        )
-        photographer_id = (await cursor.fetchone())[0]
-        if photographer_id:
-            try:
-                await bot.send_message(
-                    photographer_id,
-                    templates["photographer_notify"].format(
-                        date=date_str,
-                        time=time_str,
-                        name=name,
-                        phone=phone
-                    )
-                )
-            except Exception as e:
-                logger.error(f"Failed to notify photographer {photographer_id}: {e}")
-
-        logger.info(f"Booking confirmed for user {user_id}: {date_str} {time_str}, type={shoot_type}")
+        logger.info("Booking confirmed for user %s: %s %s, type=%s", user_id, date_str, time_str, shoot_type)
     else:
         await callback.message.edit_text(templates["booking_cancelled"], reply_markup=None)
-        logger.info(f"User {user_id} canceled the booking")
+        logger.info("User %s canceled the booking", user_id)
 
     await state.clear()
     await callback.answer()
@@ -1205,7 +1217,7 @@ async def cancel_process(message: Message, state: FSMContext):
         pass
 
     await state.clear()
-    logger.info(f"User {message.from_user.id} canceled the current operation.")
+    logger.info("User %s canceled the current operation.", message.from_user.id, extra=SAMPLED)
 
 # Admin Handlers
 @router.message(Command("admin"))
@@ -1254,6 +1266,12 @@ async def admin_actions(callback: CallbackQuery, state: FSMContext):
     if action == "addslot":
         await callback.message.answer(templates["admin_add_slot_prompt"])
         await state.set_state(AdminState.adding_slot)
+    elif action == "recurring":
+        await callback.message.answer(templates["admin_recurring_prompt"])
+        await state.set_state(AdminState.adding_recurring)
+    elif action == "range":
+        await callback.message.answer(templates["admin_range_prompt"])
+        await state.set_state(AdminState.editing_range)
     elif action == "feedbacks":
         await show_feedbacks(callback.message, state)
     elif action == "delslot":
@@ -1269,6 +1287,9 @@ async def admin_actions(callback: CallbackQuery, state: FSMContext):
         await manage_photographers(callback.message, state)
     elif action == "discount":
         await manage_discounts(callback.message, state)
+    elif action == "broadcast":
+        await callback.message.answer(templates["admin_broadcast_prompt"])
+        await state.set_state(AdminState.writing_broadcast)
     elif action == "changepw":
         await change_password_start(callback.message, state)
     elif action == "logout":
@@ -1404,6 +1425,16 @@ async def set_discount_value(message: Message, state: FSMContext):
     
     await state.clear()
 
+def get_stats_keyboard():
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="📅 По дням", callback_data="stats:day"),
+            InlineKeyboardButton(text="🗓 По неделям", callback_data="stats:week"),
+            InlineKeyboardButton(text="📆 По месяцам", callback_data="stats:month")
+        ],
+        [InlineKeyboardButton(text="🔄 Пересчитать", callback_data="stats:rebuild")]
+    ])
+
 async def show_stats(message: Message):
     stats = await get_stats()
     await message.answer(
@@ -1412,42 +1443,137 @@ async def show_stats(message: Message):
             last_week=stats["last_week"],
             free_slots=stats["free_slots"],
             avg_rating=stats["avg_rating"]
-        )
+        ),
+        reply_markup=get_stats_keyboard()
     )
-async def show_feedbacks(message: Message, state: FSMContext, page: int = 0):
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            "SELECT user_name, text, photo_id, rating, created_at FROM feedback ORDER BY created_at DESC"
-        )
-        all_feedbacks = await cursor.fetchall()
 
-    if not all_feedbacks:
-        await message.answer("📭 Отзывов пока нет.")
+@router.callback_query(F.data.startswith("stats:"))
+async def handle_stats_actions(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
         return
 
-    if page >= len(all_feedbacks):
-        await message.answer("✅ Отзывов больше нет.")
+    action = callback.data.split(":", 1)[1]
+
+    if action == "rebuild":
+        drift = await rebuild_stats()
+        if drift:
+            await callback.message.answer(f"🔄 Статистика пересчитана, расхождения: {drift}")
+            logger.warning(f"Stats drift fixed by rebuild: {drift}")
+        else:
+            await callback.message.answer("🔄 Статистика пересчитана, расхождений нет.")
+    elif action in ("day", "week", "month"):
+        date_format = "%m.%Y" if action == "month" else "%d.%m.%Y"
+        lines = []
+        for start, values in await breakdown(action):
+            avg = values["rating_sum"] / values["rating_count"] if values["rating_count"] else 0
+            lines.append(f"{start.strftime(date_format)}: записей {values['bookings']}, "
+                         f"отзывов {values['feedback']}, рейтинг {avg:.1f}")
+        await callback.message.answer("📊 Статистика:\n\n" + "\n".join(lines))
+
+    await callback.answer()
+
+@router.message(Command("perf"))
+async def cmd_perf(message: Message):
+    if message.from_user.id not in Config.ADMIN_IDS or not await check_admin_session(message.from_user.id):
         return
 
-    user_name, text, photo_id, rating, created_at = all_feedbacks[page]
+    lines = ["⏱ Обработчики (p50 / p95, мс; запросов к БД и Bot API на вызов):"]
+    for row in metrics.handler_summary():
+        errors = f", ошибок {row['errors']}" if row["errors"] else ""
+        lines.append(f"{row['handler']}: {row['count']} шт., {row['p50_ms']} / {row['p95_ms']}, "
+                     f"БД {row['db_per_call']}, API {row['api_per_call']}{errors}")
+    for title, which in (("🗄 SQLite (p95, мс):", "db"), ("📡 Bot API с очередью (p95, мс):", "api")):
+        lines.append("")
+        lines.append(title)
+        for row in metrics.call_summary(which):
+            errors = f", ошибок {row['errors']}" if row["errors"] else ""
+            lines.append(f"{row['name']}: {row['count']} шт., {row['p95_ms']}{errors}")
+
+    lines.append("")
+    lines.append(f"🐢 Самые дорогие запросы (медленных: {query_log.slow}):")
+    for row in query_log.top(3):
+        scan = ", полный просмотр" if row["full_scan"] else ""
+        lines.append(f"{html.escape(row['sql'][:120])}: {row['count']} шт., всего {row['total_ms']} мс, "
+                     f"макс. {row['max_ms']} мс{scan}")
+
+    sender_stats = sender.stats()
+    pool_stats = db_pool.stats()
+    lines.append("")
+    lines.append(f"📤 Очередь отправки: {sum(sender_stats['queued'].values())}, "
+                 f"ожидание p95 {sender_stats['wait_p95_ms']} мс")
+    lines.append(f"🔌 Ожидание соединения: чтение {pool_stats['reader']['wait_avg_ms']} мс, "
+                 f"запись {pool_stats['writer']['wait_avg_ms']} мс")
+    loop_stats = loop_monitor.stats()
+    blockers = ", ".join(f"{name} ×{count}" for name, count in loop_monitor.top_blockers(3))
+    lines.append(f"🔁 Задержка цикла: p50 {loop_stats['lag_p50_ms']} / p99 {loop_stats['lag_p99_ms']} / "
+                 f"макс. {loop_stats['lag_max_ms']} мс, блокировок {loop_stats['blocks']}"
+                 + (f" ({html.escape(blockers)})" if blockers else ""))
+    await message.answer("\n".join(lines))
+
+RATING_CYCLE = [0, 5, 4, 3, 2, 1]
+PHOTO_CYCLE = {"a": "y", "y": "n", "n": "a"}
+PHOTO_LABELS = {"a": "все", "y": "с фото", "n": "без фото"}
+
+def render_feedback_page(page, flt: FeedbackFilter):
+    rating_label = f"{flt.rating}⭐" if flt.rating else "все"
+    header = f"📬 Отзывы (рейтинг: {rating_label}, фото: {PHOTO_LABELS[flt.photo]})\n\n"
+
+    if page.rows:
+        blocks = []
+        for idx, row in enumerate(page.rows, start=1):
+            photo_mark = " 📷" if row.photo_id else ""
+            rating = f"{row.rating}/5" if row.rating else "—"
+            blocks.append(
+                f"{idx}. 👤 <b>{html.escape(row.user_name or '')}</b>{photo_mark}\n"
+                f"🗓 {row.created_at} ⭐ {rating}\n"
+                f"{html.escape(row.text or '')}"
+            )
+        text = header + "\n\n".join(blocks)
+    else:
+        text = header + "📭 Отзывов нет."
 
-    caption = (
-        f"👤 <b>{user_name}</b>\n"
-        f"🗓 {created_at}\n"
-        f"⭐ Рейтинг: {rating}/5\n\n"
-        f"{text}"
-    )
+    code = flt.encode()
+    buttons = []
 
-    nav_buttons = InlineKeyboardMarkup(inline_keyboard=[
-    [InlineKeyboardButton(text="➡️ Следующий", callback_data="feedback:page:1")]
+    photo_buttons = [
+        InlineKeyboardButton(text=f"📷 {idx}", callback_data=f"fbphoto:{row.id}")
+        for idx, row in enumerate(page.rows, start=1) if row.photo_id
+    ]
+    if photo_buttons:
+        buttons.append(photo_buttons)
+
+    nav = []
+    if page.has_prev:
+        first = page.rows[0]
+        nav.append(InlineKeyboardButton(
+            text="⬅️ Новее", callback_data=f"fb:p:{code}:{encode_key(first.created_at)}:{first.id}"))
+    if page.has_next:
+        last = page.rows[-1]
+        nav.append(InlineKeyboardButton(
+            text="Старше ➡️", callback_data=f"fb:n:{code}:{encode_key(last.created_at)}:{last.id}"))
+    if nav:
+        buttons.append(nav)
+
+    next_rating = RATING_CYCLE[(RATING_CYCLE.index(flt.rating) + 1) % len(RATING_CYCLE)]
+    buttons.append([
+        InlineKeyboardButton(text="⭐ Рейтинг", callback_data=f"fb:f:{FeedbackFilter(next_rating, flt.photo).encode()}"),
+        InlineKeyboardButton(text="📷 Фото", callback_data=f"fb:f:{FeedbackFilter(flt.rating, PHOTO_CYCLE[flt.photo]).encode()}"),
+        InlineKeyboardButton(text="📅 К дате", callback_data=f"fb:d:{code}")
     ])
 
-    if photo_id:
-        await message.answer_photo(photo_id, caption=caption, reply_markup=nav_buttons)
-    else:
-        await message.answer(caption, reply_markup=nav_buttons)
+    return text, InlineKeyboardMarkup(inline_keyboard=buttons)
 
-    await state.update_data(feedback_page=page)
+async def show_feedbacks(message: Message, state: FSMContext, flt: FeedbackFilter = FeedbackFilter()):
+    page = await fetch_page(flt)
+
+    if not page.rows and flt == FeedbackFilter():
+        await message.answer("📭 Отзывов пока нет.")
+        return
+
+    text, keyboard = render_feedback_page(page, flt)
+    await message.answer(text, reply_markup=keyboard)
 
 @router.callback_query(F.data.startswith("logout:"))
 async def admin_logout_confirm(callback: CallbackQuery):
@@ -1464,17 +1590,73 @@ async def admin_logout_confirm(callback: CallbackQuery):
 
     await callback.answer()
 
-@router.callback_query(F.data.startswith("feedback:page:"))
+@router.callback_query(F.data.startswith("fb:"))
 async def paginate_feedbacks(callback: CallbackQuery, state: FSMContext):
-    page_str = callback.data.split(":")[-1]
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    parts = callback.data.split(":")
     try:
-        page = int(page_str)
-    except ValueError:
+        action = parts[1]
+        flt = FeedbackFilter.decode(parts[2])
+        cursor = (decode_key(parts[3]), int(parts[4])) if action in ("n", "p") else None
+    except (IndexError, ValueError):
         await callback.answer("Ошибка страницы")
         return
 
-    await callback.message.delete()
-    await show_feedbacks(callback.message, state, page=page)
+    if action == "d":
+        await state.update_data(feedback_filter=flt.encode())
+        await state.set_state(AdminState.feedback_jump)
+        await callback.message.answer("📅 Отправьте дату (ДД.ММ.ГГГГ), с которой показать отзывы:")
+        await callback.answer()
+        return
+
+    direction = {"n": "next", "p": "prev"}.get(action, "first")
+    page = await fetch_page(flt, direction, cursor)
+    text, keyboard = render_feedback_page(page, flt)
+
+    try:
+        await callback.message.edit_text(text, reply_markup=keyboard)
+    except TelegramBadRequest:
+        await callback.message.answer(text, reply_markup=keyboard)
+    await callback.answer()
+
+@router.message(AdminState.feedback_jump)
+async def feedback_jump_to_date(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    date_text = message.text.strip()
+    if not validate_date_format(date_text):
+        await message.answer("❌ Неверный формат даты. Используйте ДД.ММ.ГГГГ")
+        return
+
+    data = await state.get_data()
+    await state.clear()
+    flt = FeedbackFilter.decode(data.get("feedback_filter", "0a"))
+
+    # Отзывы, оставленные в этот день (по местному времени) и раньше
+    page = await fetch_page(flt, "next", (day_end_key(datetime.strptime(date_text, "%d.%m.%Y")), 0))
+    text, keyboard = render_feedback_page(page, flt)
+    await message.answer(text, reply_markup=keyboard)
+
+@router.callback_query(F.data.startswith("fbphoto:"))
+async def show_feedback_photo(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    row = await database.fetchone(
+        "SELECT user_name, photo_id FROM feedback WHERE id = ?",
+        (int(callback.data.split(":", 1)[1]),))
+    if not row or not row[1]:
+        await callback.answer("Фото не найдено", show_alert=True)
+        return
+
+    await callback.message.answer_photo(row[1], caption=f"📷 {html.escape(row[0] or '')}")
     await callback.answer()
 
 @router.message(AdminState.adding_slot)
@@ -1502,6 +1684,281 @@ async def admin_addslot_save(message: Message, state: FSMContext):
 
     await state.clear()
 
+@router.message(Command("addslots"))
+async def cmd_addslots(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS or not await check_admin_session(message.from_user.id):
+        return
+
+    await message.answer(templates["admin_recurring_prompt"])
+    await state.set_state(AdminState.adding_recurring)
+
+@router.message(AdminState.adding_recurring)
+async def admin_recurring_preview(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    rule_text = message.text.strip()
+    try:
+        datetimes = expand_rule(parse_recurrence(rule_text))
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n" + templates["admin_recurring_prompt"])
+        return
+
+    if not datetimes:
+        await message.answer("⚠️ По этому правилу не получается ни одного будущего слота.")
+        return
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Создать", callback_data="recurring:yes"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="recurring:no")
+    ]])
+    await message.answer(
+        templates["admin_recurring_preview"].format(
+            count=len(datetimes),
+            first=format_datetime_ru(datetimes[0]),
+            last=format_datetime_ru(datetimes[-1])
+        ),
+        reply_markup=keyboard
+    )
+    await state.update_data(recurring_rule=rule_text)
+    await state.set_state(AdminState.confirming_recurring)
+
+@router.callback_query(F.data.startswith("recurring:"), AdminState.confirming_recurring)
+async def admin_recurring_confirm(callback: CallbackQuery, state: FSMContext):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    action = callback.data.split(":", 1)[1]
+    data = await state.get_data()
+    await state.clear()
+
+    if action != "yes":
+        await callback.message.edit_text("❌ Создание серии слотов отменено.")
+        await callback.answer()
+        return
+
+    try:
+        rule = parse_recurrence(data.get("recurring_rule", ""))
+        created, skipped = await bulk_add_slots(expand_rule(rule), rule.photographer_id)
+    except ValueError as e:
+        await callback.message.edit_text(f"❌ {e}")
+        await callback.answer()
+        return
+
+    await callback.message.edit_text(templates["admin_recurring_done"].format(created=created, skipped=skipped))
+    logger.info(f"Admin {user_id} generated slots: created={created}, skipped={skipped}")
+    await callback.answer()
+
+@router.message(Command("slotsrange"))
+async def cmd_slotsrange(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS or not await check_admin_session(message.from_user.id):
+        return
+
+    await message.answer(templates["admin_range_prompt"])
+    await state.set_state(AdminState.editing_range)
+
+@router.message(AdminState.editing_range)
+async def admin_range_preview(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    command_text = message.text.strip()
+    try:
+        action, delta, start, end = parse_range_command(command_text)
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n" + templates["admin_range_prompt"])
+        return
+
+    free, booked = await count_range(start, end)
+    warning = ""
+    if action == "delete":
+        action_text = "Удаление"
+    else:
+        action_text = f"Сдвиг на {int(delta.total_seconds() // 60):+d} мин"
+        past = await count_past_targets(start, end, delta)
+        if past:
+            warning = f"\n⚠️ Слотов, которые попали бы в прошлое (останутся на месте): {past}"
+
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Выполнить", callback_data="range:yes"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="range:no")
+    ]])
+    await message.answer(
+        templates["admin_range_preview"].format(
+            action=action_text,
+            start=format_datetime_ru(start),
+            end=format_datetime_ru(end),
+            free=free,
+            booked=booked
+        ) + warning,
+        reply_markup=keyboard
+    )
+    await state.update_data(range_command=command_text)
+    await state.set_state(AdminState.confirming_range)
+
+@router.callback_query(F.data.startswith("range:"), AdminState.confirming_range)
+async def admin_range_confirm(callback: CallbackQuery, state: FSMContext):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    data = await state.get_data()
+    await state.clear()
+
+    if callback.data.split(":", 1)[1] != "yes":
+        await callback.message.edit_text("❌ Операция отменена.")
+        await callback.answer()
+        return
+
+    try:
+        action, delta, start, end = parse_range_command(data.get("range_command", ""))
+    except ValueError as e:
+        await callback.message.edit_text(f"❌ {e}")
+        await callback.answer()
+        return
+
+    if action == "delete":
+        result = await delete_free_slots(start, end)
+    else:
+        result = await shift_free_slots(start, end, delta)
+
+    await callback.message.edit_text(
+        templates["admin_range_done"].format(changed=result.changed, conflicts=result.conflicts))
+
+    if result.booked:
+        lines = [
+            f"{format_datetime_ru(b.dt)} — {b.name}, {b.contact} (ID: {b.user_id})"
+            for b in result.booked[:50]
+        ]
+        if len(result.booked) > 50:
+            lines.append(f"… и ещё {len(result.booked) - 50}")
+        await callback.message.answer(templates["admin_range_booked"].format(list="\n".join(lines)))
+
+    logger.info(f"Admin {user_id} {action} slots {start}–{end}: changed={result.changed}, "
+                f"conflicts={result.conflicts}, booked={len(result.booked)}")
+    await callback.answer()
+
+@router.message(Command("broadcast"))
+async def cmd_broadcast(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS or not await check_admin_session(message.from_user.id):
+        return
+
+    await message.answer(templates["admin_broadcast_prompt"])
+    await state.set_state(AdminState.writing_broadcast)
+
+@router.message(AdminState.writing_broadcast)
+async def admin_broadcast_preview(message: Message, state: FSMContext):
+    if message.from_user.id not in Config.ADMIN_IDS:
+        return
+
+    if not message.text:
+        await message.answer(templates["admin_broadcast_prompt"])
+        return
+
+    count = await count_audience()
+    if not count:
+        await message.answer(templates["admin_broadcast_empty"])
+        await state.clear()
+        return
+
+    # html_text сохраняет форматирование администратора для parse_mode="HTML"
+    text = message.html_text
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="✅ Отправить", callback_data="broadcast:yes"),
+        InlineKeyboardButton(text="❌ Отмена", callback_data="broadcast:no")
+    ]])
+    await message.answer(
+        templates["admin_broadcast_preview"].format(count=count, text=text),
+        reply_markup=keyboard
+    )
+    await state.update_data(broadcast_text=text)
+    await state.set_state(AdminState.confirming_broadcast)
+
+def get_broadcast_keyboard(broadcast_id: int):
+    return InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⏹ Остановить", callback_data=f"bcstop:{broadcast_id}")
+    ]])
+
+async def report_broadcast_progress(progress):
+    if not progress.progress_message_id:
+        return
+
+    text = templates["admin_broadcast_progress"].format(
+        id=progress.id,
+        status=progress.status_name,
+        processed=progress.processed,
+        total=progress.total,
+        sent=progress.sent,
+        failed=progress.failed,
+        blocked=progress.blocked,
+        rate=progress.rate
+    )
+    try:
+        await bot.edit_message_text(
+            text,
+            chat_id=progress.progress_chat_id,
+            message_id=progress.progress_message_id,
+            reply_markup=get_broadcast_keyboard(progress.id) if progress.status == "running" else None
+        )
+    except TelegramBadRequest as e:
+        if "message is not modified" not in str(e):
+            raise
+
+@router.callback_query(F.data.startswith("broadcast:"), AdminState.confirming_broadcast)
+async def admin_broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    data = await state.get_data()
+    await state.clear()
+
+    text = data.get("broadcast_text")
+    if callback.data.split(":", 1)[1] != "yes" or not text:
+        await callback.message.edit_text("❌ Рассылка отменена.")
+        await callback.answer()
+        return
+
+    progress = await create_broadcast(text, user_id)
+    await callback.message.edit_text(
+        templates["admin_broadcast_progress"].format(
+            id=progress.id,
+            status=progress.status_name,
+            processed=0,
+            total=progress.total,
+            sent=0,
+            failed=0,
+            blocked=0,
+            rate=0
+        ),
+        reply_markup=get_broadcast_keyboard(progress.id)
+    )
+    await attach_progress_message(progress.id, callback.message.chat.id, callback.message.message_id)
+    if leader_election.is_leader:
+        broadcast_runner.start(bot, progress.id, report_broadcast_progress)
+    # Иначе рассылку подхватит лидер (broadcasts_job)
+
+    logger.info(f"Admin {user_id} started broadcast {progress.id} to {progress.total} users")
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("bcstop:"))
+async def admin_broadcast_stop(callback: CallbackQuery):
+    user_id = callback.from_user.id
+    if user_id not in Config.ADMIN_IDS or not await check_admin_session(user_id):
+        await callback.answer("❌ Доступ запрещен")
+        return
+
+    broadcast_id = int(callback.data.split(":", 1)[1])
+    if await cancel_broadcast(broadcast_id):
+        logger.info(f"Admin {user_id} stopped broadcast {broadcast_id}")
+        await callback.answer("⏹ Рассылка будет остановлена после текущей пачки")
+    else:
+        await callback.answer("Рассылка уже завершена")
+
 @router.message(AdminState.deleting_slot)
 async def admin_delslot_delete(message: Message, state: FSMContext):
     if message.from_user.id not in Config.ADMIN_IDS:
@@ -1528,53 +1985,31 @@ async def admin_delslot_delete(message: Message, state: FSMContext):
 
     await state.clear()
 
-async def export_bookings_command(message: Message):
-    async with aiosqlite.connect("bot.db") as db:
-        cursor = await db.execute(
-            """SELECT s.datetime, b.name, b.contact, b.shoot_type, b.created_at, p.username
-               FROM bookings b
-               JOIN slots s ON b.slot_id = s.id
-               LEFT JOIN photographers p ON s.photographer_id = p.id
-               ORDER BY s.datetime"""
-        )
-        rows = await cursor.fetchall()
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    if message.from_user.id not in Config.ADMIN_IDS or not await check_admin_session(message.from_user.id):
+        return
 
-    if not rows:
-        await message.answer(templates["admin_export_no_data"])
-        return
-
-    # Создание Excel-файла
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Записи"
-
-    headers = ["Дата", "Время", "Имя", "Телефон", "Тип съёмки", "Дата записи", "Фотограф"]
-    ws.append(headers)
-
-    for dt_text, name, contact, shoot_type, created_at, photographer in rows:
-        dt_obj = datetime.strptime(dt_text, "%Y-%m-%d %H:%M:%S")
-        created_obj = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S")
-        photographer = photographer or "Не назначен"
-        ws.append([
-            dt_obj.strftime("%d.%m.%Y"),
-            dt_obj.strftime("%H:%M"),
-            name,
-            contact,
-            shoot_type,
-            created_obj.strftime("%d.%m.%Y %H:%M"),
-            photographer
-        ])
+    parts = message.text.split(maxsplit=1)
+    try:
+        flt = parse_export_filter(parts[1] if len(parts) > 1 else "")
+    except ValueError as e:
+        await message.answer(f"❌ {e}\n\n" + templates["admin_export_usage"])
+        return
+    await export_bookings_command(message, flt)
 
-    filename = f"bookings_export_{datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
+async def export_bookings_command(message: Message, flt: ExportFilter = ExportFilter()):
     try:
-        wb.save(filename)
+        result = await booking_exporter.export(flt)
+        if result is None:
+            await message.answer(templates["admin_export_no_data"])
+            return
+        # Книга собирается в памяти: на диске не остаётся файлов выгрузки
         await message.answer_document(
-            FSInputFile(filename),
-            caption=templates["admin_export_success"].format(count=len(rows))
+            BufferedInputFile(result.data, filename=result.filename),
+            caption=templates["admin_export_success"].format(count=result.count)
         )
-        logger.info(f"Admin exported bookings to Excel: {filename}")
-        await asyncio.sleep(1)
-        os.remove(filename)
+        logger.info("Admin exported %s bookings to Excel: %s", result.count, result.filename)
     except Exception as e:
         logger.error(f"Export to Excel failed: {e}")
         await message.answer("❌ Ошибка при экспорте Excel-файла.")
@@ -1671,96 +2106,66 @@ async def admin_changepassword_set(message: Message, state: FSMContext):
     await state.clear()
 
 # Background tasks
-async def reminder_task():
+@reminder_scheduler.handler("reminder")
+async def queue_reminders(db: aiosqlite.Connection, booking_ids: List[int]) -> List[int]:
+    placeholders = ", ".join("?" * len(booking_ids))
+    cursor = await db.execute(
+        f"""SELECT b.id, b.user_id, s.datetime, s.start_ts, b.name, b.contact
+        FROM bookings b
+        JOIN slots s ON b.slot_id = s.id
+        WHERE b.id IN ({placeholders}) AND b.reminder_sent = 0""",
+        booking_ids
+    )
+    now_ts = int(time.time())
+    notifications = []
+    for b_id, user_id, dt_text, start_ts, name, contact in await cursor.fetchall():
+        # Прошедшие съёмки пропускаем, флаг всё равно ставится
+        if start_ts < now_ts:
+            continue
+        remind_time = datetime.strptime(dt_text, "%Y-%m-%d %H:%M:%S").strftime("%H:%M")
+        notifications.append(Notification(
+            f"reminder:{b_id}:client", user_id,
+            templates["reminder_client"].format(time=remind_time), Priority.REMINDER))
+        admin_text = templates["reminder_admin"].format(time=remind_time, name=name, phone=contact)
+        notifications.extend(
+            Notification(f"reminder:{b_id}:admin:{admin_id}", admin_id, admin_text, Priority.REMINDER)
+            for admin_id in Config.ADMIN_IDS
+        )
+
+    await enqueue(db, notifications)
+    logger.info(f"Queued reminders for bookings {booking_ids}")
+    return booking_ids
+
+@reminder_scheduler.handler("review")
+async def queue_review_prompts(db: aiosqlite.Connection, booking_ids: List[int]) -> List[int]:
+    # 💬 Просим оставить отзыв через сутки после съёмки
+    placeholders = ", ".join("?" * len(booking_ids))
+    cursor = await db.execute(
+        f"SELECT id, user_id FROM bookings WHERE id IN ({placeholders}) AND review_requested = 0",
+        booking_ids
+    )
+    await enqueue(db, [
+        Notification(
+            f"review:{booking_id}", user_id,
+            "🌟 Как прошла ваша фотосессия?\n"
+            "Пожалуйста, поделитесь впечатлением — отправьте команду /feedback 💬",
+            Priority.REMINDER)
+        for booking_id, user_id in await cursor.fetchall()
+    ])
+    logger.info(f"Queued review prompts for bookings {booking_ids}")
+    return booking_ids
+
+
+async def slot_index_audit_task():
     while True:
         try:
-            now = datetime.now()
-            next_24h = now + timedelta(hours=24)
-
-            async with aiosqlite.connect("bot.db") as db:
-                cursor = await db.execute(
-                    """SELECT b.id, b.user_id, s.datetime, b.name, b.contact
-                    FROM bookings b
-                    JOIN slots s ON b.slot_id = s.id
-                    WHERE b.reminder_sent = 0
-                    AND s.datetime BETWEEN ? AND ?""",
-                    (now.strftime("%Y-%m-%d %H:%M:%S"),
-                     next_24h.strftime("%Y-%m-%d %H:%M:%S"))
-                )
-                bookings = await cursor.fetchall()
-
-                for b_id, user_id, dt_text, name, contact in bookings:
-                    appt_dt = datetime.strptime(dt_text, "%Y-%m-%d %H:%M:%S")
-                    remind_time = appt_dt.strftime("%H:%M")
-
-                    # Отправляем клиенту
-                    try:
-                        await bot.send_message(
-                            user_id,
-                            templates["reminder_client"].format(time=remind_time)
-                        )
-                        sent_client = True
-                    except Exception as e:
-                        logger.error(f"Reminder to user {user_id} failed: {e}")
-                        sent_client = False
-
-                    # Отправляем всем администраторам
-                    sent_admin = False
-                    for admin_id in Config.ADMIN_IDS:
-                        try:
-                            await bot.send_message(
-                                admin_id,
-                                templates["reminder_admin"].format(time=remind_time, name=name, phone=contact)
-                            )
-                            sent_admin = True
-                        except Exception as e:
-                            logger.error(f"Reminder to admin {admin_id} failed: {e}")
-
-                    # Обновляем флаг, если хотя бы один отправлен
-                    if sent_client or sent_admin:
-                        await db.execute(
-                            "UPDATE bookings SET reminder_sent = 1 WHERE id = ?",
-                            (b_id,)
-                        )
-                        await db.commit()
-                        logger.info(f"Sent reminder for booking {b_id}")
-
-            # 💬 Просим оставить отзыв через сутки после съёмки
-            async with aiosqlite.connect("bot.db") as db:
-                cursor = await db.execute(
-                    """
-                    SELECT b.user_id, s.datetime, b.name, b.id
-                    FROM bookings b
-                    JOIN slots s ON b.slot_id = s.id
-                    WHERE datetime(s.datetime) <= datetime('now', '-1 day')
-                      AND b.review_requested = 0
-                    """
-                )
-                rows = await cursor.fetchall()
-
-                for user_id, dt_text, name, booking_id in rows:
-                    try:
-                        await bot.send_message(
-                            user_id,
-                            "🌟 Как прошла ваша фотосессия?\n"
-                            "Пожалуйста, поделитесь впечатлением — отправьте команду /feedback 💬"
-                        )
-                        await db.execute(
-                            "UPDATE bookings SET review_requested = 1 WHERE id = ?",
-                            (booking_id,)
-                        )
-                        await db.commit()
-                        logger.info(f"Review prompt sent to user {user_id}")
-                    except Exception as e:
-                        logger.error(f"Failed to send review prompt to {user_id}: {e}")
-
-            await asyncio.sleep(600)  # каждые 10 минут
-
+            await asyncio.sleep(3600)
+            slot_index.prune(database.local_now())
+            await check_consistency()
         except Exception as e:
-            logger.error(f"Reminder task failed: {str(e)}")
+            logger.error(f"Slot index audit failed: {str(e)}")
             await asyncio.sleep(60)
 
-
 async def session_cleanup_task():
     while True:
         try:
@@ -1785,12 +2190,79 @@ async def error_handler(event: types.ErrorEvent):
     if isinstance(event.update, types.Message):
         await event.update.answer("⚠️ Произошла ошибка. Пожалуйста, попробуйте позже.")
 
+# Задачи, которые должны идти в одном экземпляре на все процессы бота
+@leader_election.job
+async def reminders_job():
+    await reminder_scheduler.load()
+    # Записи, сделанные не лидером (другим процессом или до избрания), попадают в кучу только через базу
+    await asyncio.gather(reminder_scheduler.run(), reminder_scheduler.watch_new(cluster.CLUSTER_SYNC_INTERVAL))
+
+@leader_election.job
+async def outbox_job():
+    await outbox.run(bot)
+
+@leader_election.job
+async def broadcasts_job():
+    await broadcast_runner.watch(bot, report_broadcast_progress, BROADCAST_WATCH_INTERVAL)
+
+@leader_election.job
+async def slot_changes_cleanup_job():
+    while True:
+        try:
+            await prune_changes()
+        except Exception as e:
+            logger.error(f"Slot changes cleanup failed: {str(e)}")
+        await asyncio.sleep(3600)
+
+leader_election.on_stop(broadcast_runner.stop_all)
+
+async def slot_index_sync_task():
+    # Рабочий процесс подтягивает слоты, изменённые в других процессах
+    while True:
+        try:
+            await asyncio.sleep(cluster.CLUSTER_SYNC_INTERVAL)
+            await sync_changes()
+        except Exception as e:
+            logger.error(f"Slot index sync failed: {str(e)}")
+            await asyncio.sleep(60)
+
+# Цикл событий держит на задачи только слабые ссылки: храним их до остановки
+background_tasks: List[asyncio.Task] = []
+
 # ✅ Новый on_startup
 async def on_startup(dispatcher: Dispatcher, bot: Bot):
-    asyncio.create_task(reminder_task())
-    asyncio.create_task(session_cleanup_task())
+    loop_monitor.start()
+    await sender.start()
+    if cluster.IS_WORKER:
+        outbox.idle_poll = cluster.CLUSTER_SYNC_INTERVAL
+        background_tasks.append(asyncio.create_task(slot_index_sync_task()))
+    leader_election.start()
+    # Рабочие процессы занимают порты следом за супервизором
+    await metrics.serve(port=METRICS_PORT + 1 + int(cluster.WORKER_ID) if METRICS_PORT and cluster.IS_WORKER
+                        else METRICS_PORT)
+    background_tasks.extend([
+        asyncio.create_task(session_cleanup_task()),
+        asyncio.create_task(slot_index_audit_task()),
+        asyncio.create_task(query_log.run_reports()),
+    ])
     logger.info("✅ Background tasks started")
 
+async def on_shutdown(dispatcher: Dispatcher, bot: Bot):
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await leader_election.stop()
+    await metrics.stop()
+    await loop_monitor.stop()
+    await sender.stop()
+    await storage.close()
+    await db_pool.close()
+    card_renderer.shutdown()
+    booking_exporter.shutdown()
+    logger.info(f"DB pool stats: {db_pool.stats()}")
+    logger.info(f"Sender stats: {sender.stats()}")
+
 # ✅ Новый main
 async def main():
     try:
@@ -1798,13 +2270,108 @@ async def main():
     except ValueError as e:
         logger.error(f"Configuration error: {e}")
         return
+    if not whole_hour_offset():
+        logger.warning(f"Timezone {Config.TIMEZONE} is not a whole-hour UTC offset: "
+                       f"/stats day and week totals may include bookings from neighbouring days")
 
-    await init_db()
     dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
     dp.errors.register(error_handler)
 
-    logger.info("Bot starting...")
-    await dp.start_polling(bot)
+    if cluster.IS_WORKER:
+        await init_db()
+        await run_webhook("127.0.0.1", cluster.WORKER_PORT, cluster.WORKER_SECRET)
+        return
+
+    if Config.BOT_WORKERS > 1:
+        # Миграции один раз до запуска рабочих; базой супервизор сам не пользуется
+        await init_db(load_caches=False)
+        await db_pool.close()
+        await run_supervisor()
+        return
+
+    await init_db()
+    if Config.BOT_MODE == "webhook":
+        await run_webhook(Config.WEBHOOK_HOST, Config.WEBHOOK_PORT, Config.WEBHOOK_SECRET, public=True)
+    else:
+        logger.info("Bot starting...")
+        # getUpdates не работает, пока установлен вебхук
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+
+async def set_public_webhook():
+    await bot.set_webhook(
+        Config.WEBHOOK_URL.rstrip("/") + Config.WEBHOOK_PATH,
+        secret_token=Config.WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types(),
+    )
+
+async def serve_app(app: web.Application, host: str, port: int):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    try:
+        await cluster.wait_for_signal()
+    finally:
+        await runner.cleanup()
+
+async def run_webhook(host: str, port: int, secret: str, public: bool = False):
+    server = WebhookServer(dp, bot, secret)
+    app = server.build_app(Config.WEBHOOK_PATH)
+    metrics.source("webhook", server.stats)
+
+    async def on_app_startup(app):
+        await dp.emit_startup(bot=bot, dispatcher=dp)
+        if public:
+            await set_public_webhook()
+        server.ready = True
+
+    async def on_app_shutdown(app):
+        # Сначала дорабатываем принятые апдейты, потом закрываем базу и отправку
+        await server.drain()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        logger.info(f"Webhook stats: {server.stats()}")
+
+    app.on_startup.append(on_app_startup)
+    app.on_shutdown.append(on_app_shutdown)
+
+    worker = f" (worker {cluster.WORKER_ID})" if cluster.IS_WORKER else ""
+    logger.info(f"Bot starting in webhook mode on {host}:{port}{Config.WEBHOOK_PATH}{worker}")
+    try:
+        await serve_app(app, host, port)
+    finally:
+        await bot.session.close()
+
+async def run_supervisor():
+    supervisor = Supervisor(Config.BOT_WORKERS, [sys.executable, os.path.abspath(__file__)])
+    metrics.source("supervisor", supervisor.stats)
+    loop_monitor.start()
+    await supervisor.start()
+    await metrics.serve()
+    try:
+        if Config.BOT_MODE == "webhook":
+            app = supervisor.build_app(Config.WEBHOOK_PATH, Config.WEBHOOK_SECRET)
+
+            async def on_app_startup(app):
+                await set_public_webhook()
+
+            app.on_startup.append(on_app_startup)
+            logger.info(f"Supervisor accepting webhooks on {Config.WEBHOOK_HOST}:{Config.WEBHOOK_PORT}")
+            await serve_app(app, Config.WEBHOOK_HOST, Config.WEBHOOK_PORT)
+        else:
+            await bot.delete_webhook()
+            poller = asyncio.create_task(supervisor.poll(bot, dp.resolve_used_update_types()))
+            logger.info("Supervisor polling for updates")
+            try:
+                await cluster.wait_for_signal()
+            finally:
+                poller.cancel()
+                await asyncio.gather(poller, return_exceptions=True)
+    finally:
+        await supervisor.stop()
+        await loop_monitor.stop()
+        await metrics.stop()
+        await bot.session.close()
 
 # ⏱ Запуск
 if __name__ == "__main__":
@@ -1812,4 +2379,6 @@ if __name__ == "__main__":
         asyncio.run(main())
     except (KeyboardInterrupt, SystemExit):
         logger.info("Bot stopped")
+    finally:
+        log_pipeline.stop()
 
@@ -0,0 +1,137 @@
+import time
+import hashlib
+import logging
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, InputMediaPhoto, Message
+
+import database
+
+logger = logging.getLogger("bot")
+
+# Ключи кэша:
+#   sha256:<hex> — сгенерированные файлы (карточки); изменилось содержимое —
+#                  изменился ключ, старая запись просто перестаёт использоваться
+#   url:<адрес>  — внешние ссылки (портфолио); сменился список в конфиге —
+#                  лишние записи удаляет prune_urls()
+# Если Telegram отклоняет сохранённый file_id, запись удаляется и файл
+# загружается заново.
+
+
+def bytes_key(data: bytes) -> str:
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def url_key(url: str) -> str:
+    return f"url:{url}"
+
+
+def photo_file_id(message: Message) -> Optional[str]:
+    return message.photo[-1].file_id if message.photo else None
+
+
+class MediaCache:
+    """Соответствие ключ -> file_id: копия в памяти, запись сразу в БД"""
+
+    def __init__(self):
+        self._ids: Dict[str, str] = {}
+        self._loaded = False
+        self.hits = 0
+        self.uploads = 0
+
+    async def load(self):
+        rows = await database.fetchall("SELECT key, file_id FROM media_cache")
+        self._ids = dict(rows)
+        self._loaded = True
+        logger.info(f"Media cache loaded: {len(self._ids)} file_id")
+
+    async def get(self, key: str) -> Optional[str]:
+        if not self._loaded:
+            await self.load()
+        return self._ids.get(key)
+
+    async def put(self, key: str, file_id: str):
+        if self._ids.get(key) == file_id:
+            return
+        self._ids[key] = file_id
+        await database.execute(
+            """INSERT INTO media_cache (key, file_id, updated_ts) VALUES (?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET file_id = excluded.file_id, updated_ts = excluded.updated_ts""",
+            (key, file_id, int(time.time())))
+
+    async def forget(self, *keys: str):
+        for key in keys:
+            self._ids.pop(key, None)
+        await database.execute(
+            f"DELETE FROM media_cache WHERE key IN ({', '.join('?' * len(keys))})", keys)
+
+    async def prune_urls(self, urls: Iterable[str]) -> int:
+        """Удаляет file_id ссылок, которых больше нет в конфигурации"""
+        if not self._loaded:
+            await self.load()
+        keep = {url_key(url) for url in urls}
+        stale = [key for key in self._ids if key.startswith("url:") and key not in keep]
+        if stale:
+            await self.forget(*stale)
+        return len(stale)
+
+    def stats(self) -> dict:
+        return {"cached": len(self._ids), "hits": self.hits, "uploads": self.uploads}
+
+
+media_cache = MediaCache()
+
+
+async def send_cached_photo(send: Callable[..., Awaitable[Message]], data: bytes,
+                            filename: str, **kwargs) -> Message:
+    """Отправляет фото по сохранённому file_id, при его отсутствии — загружает байты.
+
+    send — bot.send_photo с привязанным chat_id или message.answer_photo.
+    """
+    key = bytes_key(data)
+    file_id = await media_cache.get(key)
+    if file_id:
+        try:
+            message = await send(photo=file_id, **kwargs)
+            media_cache.hits += 1
+            return message
+        except TelegramBadRequest as e:
+            logger.warning(f"Cached file_id rejected for {key}: {e}")
+            await media_cache.forget(key)
+
+    message = await send(photo=BufferedInputFile(data, filename=filename), **kwargs)
+    media_cache.uploads += 1
+    file_id = photo_file_id(message)
+    if file_id:
+        await media_cache.put(key, file_id)
+    return message
+
+
+async def send_cached_album(bot, chat_id: int, urls: List[str]) -> List[Message]:
+    """Альбом из ссылок: уже известные Telegram фото отправляются по file_id"""
+    keys = [url_key(url) for url in urls]
+    file_ids = [await media_cache.get(key) for key in keys]
+    media = [InputMediaPhoto(media=file_id or url) for file_id, url in zip(file_ids, urls)]
+
+    try:
+        messages = await bot.send_media_group(chat_id, media)
+    except TelegramBadRequest as e:
+        cached = [key for key, file_id in zip(keys, file_ids) if file_id]
+        if not cached:
+            raise
+        # Неизвестно, какой именно file_id устарел, — сбрасываем все
+        logger.warning(f"Cached album rejected, re-sending by URL: {e}")
+        await media_cache.forget(*cached)
+        file_ids = [None] * len(urls)
+        messages = await bot.send_media_group(chat_id, [InputMediaPhoto(media=url) for url in urls])
+
+    for key, file_id, message in zip(keys, file_ids, messages):
+        if file_id:
+            media_cache.hits += 1
+            continue
+        media_cache.uploads += 1
+        new_id = photo_file_id(message)
+        if new_id:
+            await media_cache.put(key, new_id)
+    return messages
@@ -0,0 +1,323 @@
+import os
+import time
+import asyncio
+import inspect
+import logging
+import contextvars
+from bisect import bisect_left
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger("bot")
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))  # 0 — HTTP-эндпоинт выключен
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LATENCY_SAMPLES = 1000
+UNHANDLED = "unhandled"  # апдейт не дошёл ни до одного обработчика
+
+StatsSource = Callable[[], Union[dict, Awaitable[dict]]]
+
+
+def _percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами для Prometheus и окном последних значений для перцентилей"""
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=LATENCY_SAMPLES)
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.samples.append(value)
+
+    def percentile(self, p: float) -> float:
+        return _percentile(self.samples, p)
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        result, running = [], 0
+        for bound, count in zip(self.buckets, self.counts):
+            running += count
+            result.append((f"{bound:g}", running))
+        result.append(("+Inf", self.count))
+        return result
+
+
+class _Activity:
+    """Текущий апдейт или фоновая задача: к ней относятся вызовы БД и Bot API"""
+
+    __slots__ = ("name", "started", "db_calls", "api_calls")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started = time.perf_counter()
+        self.db_calls = 0
+        self.api_calls = 0
+
+
+_activity: contextvars.ContextVar[Optional[_Activity]] = contextvars.ContextVar("metrics_activity", default=None)
+
+
+def current_activity() -> Optional[_Activity]:
+    """Обработчик или фоновая задача, в которой выполняется код"""
+    return _activity.get()
+
+
+# Та же активность по задаче asyncio: из другого потока ContextVar задачи не прочитать
+_task_activity: Dict[asyncio.Task, _Activity] = {}
+
+
+def task_activity(task: Optional[asyncio.Task]) -> Optional[_Activity]:
+    """Активность задачи; можно вызывать из стороннего потока (см. loop_monitor)"""
+    return _task_activity.get(task) if task is not None else None
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _flatten(prefix: str, value: Any, out: List[Tuple[str, float]]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}_{key}", item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out.append((prefix, value))
+    elif isinstance(value, bool):
+        out.append((prefix, int(value)))
+
+
+class Metrics:
+    """Задержки обработчиков, запросов к SQLite и Bot API.
+
+    Обработчики апдейтов и фоновые задачи оборачиваются в track(); всё,
+    что они делают с базой и Bot API, считается на их имя. Готовые
+    stats() модулей подключаются через source() и отдаются как gauge.
+    """
+
+    def __init__(self):
+        self.handlers: Dict[str, Histogram] = {}
+        self.handler_errors = Counter()
+        self.handler_db_calls = Counter()
+        self.handler_api_calls = Counter()
+        self.db: Dict[str, Histogram] = {}
+        self.db_errors = Counter()
+        self.api: Dict[str, Histogram] = {}
+        self.api_errors = Counter()
+        self._sources: Dict[str, StatsSource] = {}
+        self._runner: Optional[web.AppRunner] = None
+        self.started = time.time()
+
+    def source(self, name: str, stats: StatsSource):
+        self._sources[name] = stats
+
+    @asynccontextmanager
+    async def track(self, name: str):
+        activity = _Activity(name)
+        token = _activity.set(activity)
+        task = asyncio.current_task()
+        outer = _task_activity.get(task)
+        _task_activity[task] = activity
+        try:
+            yield activity
+        except BaseException:
+            self.handler_errors[activity.name] += 1
+            raise
+        finally:
+            _activity.reset(token)
+            if outer is None:
+                _task_activity.pop(task, None)
+            else:
+                _task_activity[task] = outer
+            self.handlers.setdefault(activity.name, Histogram()).observe(time.perf_counter() - activity.started)
+            self.handler_db_calls[activity.name] += activity.db_calls
+            self.handler_api_calls[activity.name] += activity.api_calls
+
+    def set_handler(self, name: str):
+        activity = _activity.get()
+        if activity is not None:
+            activity.name = name
+
+    def observe_db(self, sql: str, seconds: float, failed: bool = False):
+        words = sql.split(None, 1)
+        op = words[0].upper() if words else "?"
+        self.db.setdefault(op, Histogram()).observe(seconds)
+        if failed:
+            self.db_errors[op] += 1
+        activity = _activity.get()
+        if activity is not None:
+            activity.db_calls += 1
+
+    def observe_api(self, method: str, seconds: float, failed: bool = False):
+        self.api.setdefault(method, Histogram()).observe(seconds)
+        if failed:
+            self.api_errors[method] += 1
+        activity = _activity.get()
+        if activity is not None:
+            activity.api_calls += 1
+
+    async def gauges(self) -> List[Tuple[str, float]]:
+        result: List[Tuple[str, float]] = []
+        for name, stats in self._sources.items():
+            try:
+                value = stats()
+                if inspect.isawaitable(value):
+                    value = await value
+            except Exception as e:
+                logger.warning(f"Metrics source {name} failed: {e}")
+                continue
+            _flatten(f"bot_{name}", value, result)
+        return result
+
+    async def render(self) -> str:
+        """Все метрики в текстовом формате Prometheus"""
+        lines: List[str] = []
+
+        def histograms(metric: str, label: str, items: Dict[str, Histogram], help_text: str):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} histogram")
+            for key, hist in sorted(items.items()):
+                labels = f'{label}="{_escape(key)}"'
+                for bound, count in hist.cumulative():
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f"{metric}_sum{{{labels}}} {hist.total:.6f}")
+                lines.append(f"{metric}_count{{{labels}}} {hist.count}")
+
+        def counters(metric: str, label: str, items: Counter, help_text: str):
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for key, value in sorted(items.items()):
+                lines.append(f'{metric}{{{label}="{_escape(key)}"}} {value}')
+
+        histograms("bot_handler_seconds", "handler", self.handlers, "Handler and background job latency")
+        counters("bot_handler_errors_total", "handler", self.handler_errors, "Handler exceptions")
+        counters("bot_handler_db_calls_total", "handler", self.handler_db_calls, "SQL statements run by handler")
+        counters("bot_handler_api_calls_total", "handler", self.handler_api_calls, "Bot API calls made by handler")
+        histograms("bot_db_query_seconds", "op", self.db, "SQLite statement latency")
+        counters("bot_db_errors_total", "op", self.db_errors, "Failed SQLite statements")
+        histograms("bot_api_request_seconds", "method", self.api, "Bot API call latency including send queue")
+        counters("bot_api_errors_total", "method", self.api_errors, "Failed Bot API calls")
+        for name, value in await self.gauges():
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value:g}")
+        lines.append("# TYPE bot_uptime_seconds gauge")
+        lines.append(f"bot_uptime_seconds {time.time() - self.started:.0f}")
+        return "\n".join(lines) + "\n"
+
+    def handler_summary(self, limit: int = 10) -> List[dict]:
+        """Самые медленные обработчики по p95 для /perf"""
+        rows = []
+        for name, hist in self.handlers.items():
+            rows.append({
+                "handler": name,
+                "count": hist.count,
+                "p50_ms": round(hist.percentile(0.5) * 1000, 1),
+                "p95_ms": round(hist.percentile(0.95) * 1000, 1),
+                "errors": self.handler_errors[name],
+                "db_per_call": round(self.handler_db_calls[name] / hist.count, 1) if hist.count else 0.0,
+                "api_per_call": round(self.handler_api_calls[name] / hist.count, 1) if hist.count else 0.0,
+            })
+        rows.sort(key=lambda row: row["p95_ms"], reverse=True)
+        return rows[:limit]
+
+    def call_summary(self, which: str, limit: int = 5) -> List[dict]:
+        """Самые медленные операции БД (which="db") или методы Bot API (which="api")"""
+        items, errors = (self.db, self.db_errors) if which == "db" else (self.api, self.api_errors)
+        rows = [{
+            "name": name,
+            "count": hist.count,
+            "p95_ms": round(hist.percentile(0.95) * 1000, 1),
+            "errors": errors[name],
+        } for name, hist in items.items()]
+        rows.sort(key=lambda row: row["p95_ms"], reverse=True)
+        return rows[:limit]
+
+    async def handle(self, request: web.Request) -> web.Response:
+        return web.Response(text=await self.render(), content_type="text/plain", charset="utf-8")
+
+    async def serve(self, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        """Локальный HTTP-эндпоинт /metrics; без порта не запускается"""
+        if not port or self._runner:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        logger.info(f"Metrics available on http://{host}:{port}/metrics")
+
+    async def stop(self):
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics = Metrics()
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware апдейта: время обработки, ошибки, вызовы БД и Bot API"""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        async with self.registry.track(UNHANDLED):
+            return await handler(event, data)
+
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Подписывает апдейт именем обработчика, который его принял"""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        if handler_object is not None:
+            self.registry.set_handler(handler_object.callback.__name__)
+        return await handler(event, data)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Время каждого вызова Bot API вместе с ожиданием в очереди sender"""
+
+    def __init__(self, registry: Metrics = metrics):
+        self.registry = registry
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        name = name[:1].lower() + name[1:]
+        if name == "getUpdates":  # long polling: время ожидания апдейтов, а не задержка API
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            result = await make_request(bot, method)
+        except BaseException:
+            self.registry.observe_api(name, time.perf_counter() - started, failed=True)
+            raise
+        self.registry.observe_api(name, time.perf_counter() - started)
+        return result
+
+
+def setup(dispatcher: Dispatcher, registry: Metrics = metrics):
+    """Подключает middleware метрик ко всем типам апдейтов диспетчера"""
+    dispatcher.update.outer_middleware(UpdateMetricsMiddleware(registry))
+    # Внутренние middleware диспетчера действуют и на вложенные роутеры
+    for name, observer in dispatcher.observers.items():
+        if name not in ("update", "error"):
+            observer.middleware(HandlerNameMiddleware(registry))
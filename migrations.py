@@ -0,0 +1,371 @@
+import logging
+from datetime import datetime
+
+import aiosqlite
+
+import database
+
+logger = logging.getLogger("bot")
+
+
+async def _columns(db: aiosqlite.Connection, table: str) -> set:
+    cursor = await db.execute(f"PRAGMA table_info({table})")
+    return {row[1] for row in await cursor.fetchall()}
+
+
+async def _add_column(db: aiosqlite.Connection, table: str, column: str, decl: str):
+    if column not in await _columns(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+
+
+async def create_base_schema(db: aiosqlite.Connection):
+    """Исходная схема (версия 0); всё последующее — через MIGRATIONS"""
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS slots (
+        id INTEGER PRIMARY KEY,
+        datetime TEXT UNIQUE,
+        photographer_id INTEGER
+    )
+    """)
+    
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS bookings (
+        id INTEGER PRIMARY KEY,
+        slot_id INTEGER UNIQUE,
+        user_id INTEGER,
+        name TEXT,
+        contact TEXT,
+        shoot_type TEXT,
+        reminder_sent INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY(slot_id) REFERENCES slots(id) ON DELETE CASCADE
+    )
+    """)
+    
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS feedback (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER,
+        user_name TEXT,
+        text TEXT,
+        photo_id TEXT,
+        rating INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """)
+    
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS user_settings (
+        user_id INTEGER PRIMARY KEY,
+        language TEXT DEFAULT 'ru',
+        discount_eligible INTEGER DEFAULT 0
+    )
+    """)
+    
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS photographers (
+        id INTEGER PRIMARY KEY,
+        user_id INTEGER UNIQUE,
+        username TEXT,
+        specialties TEXT
+    )
+    """)
+    
+    # Индексы
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_slot_unique ON bookings(slot_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_datetime ON slots(datetime)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_user ON bookings(user_id)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created ON bookings(created_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_feedback_rating ON feedback(rating)")
+
+
+async def migration_1_review_flag(db: aiosqlite.Connection):
+    # Колонка использовалась reminder_task, но не создавалась в init_db
+    await _add_column(db, "bookings", "review_requested", "INTEGER DEFAULT 0")
+
+
+async def migration_2_epoch_times(db: aiosqlite.Connection):
+    """UTC epoch начала слота и ключ локального дня вместо сравнения строк"""
+    await _add_column(db, "slots", "start_ts", "INTEGER")
+    await _add_column(db, "slots", "day_key", "INTEGER")
+    await _add_column(db, "bookings", "day_key", "INTEGER")
+    await _add_column(db, "bookings", "created_ts", "INTEGER")
+
+    cursor = await db.execute("SELECT id, datetime FROM slots WHERE start_ts IS NULL")
+    rows = await cursor.fetchall()
+    updates = []
+    for slot_id, dt_text in rows:
+        dt = datetime.strptime(dt_text, "%Y-%m-%d %H:%M:%S")
+        updates.append((database.to_epoch(dt), database.day_key(dt), slot_id))
+    await db.executemany("UPDATE slots SET start_ts = ?, day_key = ? WHERE id = ?", updates)
+
+    # created_at заполнялся CURRENT_TIMESTAMP, то есть уже в UTC
+    await db.execute(
+        """UPDATE bookings SET
+            created_ts = CAST(strftime('%s', created_at) AS INTEGER),
+            day_key = (SELECT s.day_key FROM slots s WHERE s.id = bookings.slot_id)
+        WHERE created_ts IS NULL""")
+
+    # Старые двойные записи на один день оставляем, но без ключа дня,
+    # иначе уникальный индекс не создастся
+    cursor = await db.execute(
+        """UPDATE bookings SET day_key = NULL
+        WHERE day_key IS NOT NULL
+          AND id NOT IN (SELECT MIN(id) FROM bookings GROUP BY user_id, day_key)""")
+    if cursor.rowcount:
+        logger.warning(f"Migration 2: {cursor.rowcount} legacy same-day bookings kept without day_key")
+
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_slots_start_ts ON slots(start_ts)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_bookings_created_ts ON bookings(created_ts)")
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_bookings_user_day ON bookings(user_id, day_key)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bookings_review_pending ON bookings(slot_id) WHERE review_requested = 0")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_bookings_reminder_pending ON bookings(slot_id) WHERE reminder_sent = 0")
+
+
+async def recompute_stats(db: aiosqlite.Connection):
+    """Пересчитывает stats_totals и stats_hourly с нуля на переданном соединении"""
+    await db.execute("DELETE FROM stats_hourly")
+    await db.execute(
+        """INSERT INTO stats_hourly (hour, bookings)
+        SELECT created_ts / 3600, COUNT(*) FROM bookings
+        WHERE created_ts IS NOT NULL GROUP BY created_ts / 3600""")
+    await db.execute(
+        """INSERT INTO stats_hourly (hour, feedback, rating_sum, rating_count)
+        SELECT CAST(strftime('%s', created_at) AS INTEGER) / 3600, COUNT(*),
+               COALESCE(SUM(rating), 0), COUNT(rating)
+        FROM feedback WHERE true GROUP BY 1
+        ON CONFLICT(hour) DO UPDATE SET
+            feedback = excluded.feedback,
+            rating_sum = excluded.rating_sum,
+            rating_count = excluded.rating_count""")
+    await db.execute(
+        """UPDATE stats_totals SET
+            bookings = (SELECT COUNT(*) FROM bookings),
+            feedback = (SELECT COUNT(*) FROM feedback),
+            rating_sum = (SELECT COALESCE(SUM(rating), 0) FROM feedback),
+            rating_count = (SELECT COUNT(rating) FROM feedback)
+        WHERE id = 1""")
+
+
+async def migration_3_stats_counters(db: aiosqlite.Connection):
+    """Агрегаты для статистики, которые поддерживаются триггерами.
+
+    Часы считаются от UTC epoch (created_ts / 3600): границы часа совпадают
+    с местными, только если смещение часового пояса — целое число часов.
+    """
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS stats_totals (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        bookings INTEGER NOT NULL DEFAULT 0,
+        feedback INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    await db.execute("INSERT OR IGNORE INTO stats_totals (id) VALUES (1)")
+
+    await db.execute("""
+    CREATE TABLE IF NOT EXISTS stats_hourly (
+        hour INTEGER PRIMARY KEY,
+        bookings INTEGER NOT NULL DEFAULT 0,
+        feedback INTEGER NOT NULL DEFAULT 0,
+        rating_sum INTEGER NOT NULL DEFAULT 0,
+        rating_count INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_stats_booking_insert AFTER INSERT ON bookings
+    BEGIN
+        UPDATE stats_totals SET bookings = bookings + 1 WHERE id = 1;
+        INSERT INTO stats_hourly (hour, bookings)
+        VALUES (COALESCE(NEW.created_ts, CAST(strftime('%s', 'now') AS INTEGER)) / 3600, 1)
+        ON CONFLICT(hour) DO UPDATE SET bookings = bookings + 1;
+    END
+    """)
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_stats_booking_delete AFTER DELETE ON bookings
+    BEGIN
+        UPDATE stats_totals SET bookings = bookings - 1 WHERE id = 1;
+        UPDATE stats_hourly SET bookings = bookings - 1 WHERE hour = OLD.created_ts / 3600;
+    END
+    """)
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_stats_feedback_insert AFTER INSERT ON feedback
+    BEGIN
+        UPDATE stats_totals SET
+            feedback = feedback + 1,
+            rating_sum = rating_sum + COALESCE(NEW.rating, 0),
+            rating_count = rating_count + (NEW.rating IS NOT NULL)
+        WHERE id = 1;
+        INSERT INTO stats_hourly (hour, feedback, rating_sum, rating_count)
+        VALUES (CAST(strftime('%s', COALESCE(NEW.created_at, 'now')) AS INTEGER) / 3600,
+                1, COALESCE(NEW.rating, 0), NEW.rating IS NOT NULL)
+        ON CONFLICT(hour) DO UPDATE SET
+            feedback = feedback + 1,
+            rating_sum = rating_sum + excluded.rating_sum,
+            rating_count = rating_count + excluded.rating_count;
+    END
+    """)
+    await db.execute("""
+    CREATE TRIGGER IF NOT EXISTS trg_stats_feedback_delete AFTER DELETE ON feedback
+    BEGIN
+        UPDATE stats_totals SET
+            feedback = feedback - 1,
+            rating_sum = rating_sum - COALESCE(OLD.rating, 0),
+            rating_count = rating_count - (OLD.rating IS NOT NULL)
+        WHERE id = 1;
+        UPDATE stats_hourly SET
+            feedback = feedback - 1,
+            rating_sum = rating_sum - COALESCE(OLD.rating, 0),
+            rating_count = rating_count - (OLD.rating IS NOT NULL)
+        WHERE hour = CAST(strftime('%s', OLD.created_at) AS INTEGER) / 3600;
+    END
+    """)
+
+    await recompute_stats(db)
+
+
+async def migration_4_feedback_keyset(db: aiosqlite.Connection):
+    # Ключ постраничного просмотра отзывов; второй — для фильтра по рейтингу
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_feedback_created_id ON feedback(created_at, id)")
+    await db.execute(
+        "CREATE INDEX IF NOT EXISTS idx_feedback_rating_created ON feedback(rating, created_at, id)")
+
+
+async def migration_5_media_cache(db: aiosqlite.Connection):
+    # file_id, которые Telegram вернул после первой загрузки файла
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS media_cache (
+            key TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            updated_ts INTEGER NOT NULL
+        )""")
+
+
+async def migration_6_outbox(db: aiosqlite.Connection):
+    # Уведомления пишутся в одной транзакции с событием и доставляются фоновой задачей
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dedup_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_ts INTEGER NOT NULL,
+            last_error TEXT,
+            created_ts INTEGER NOT NULL
+        )""")
+    await db.execute(
+        """CREATE INDEX IF NOT EXISTS idx_outbox_due
+        ON outbox(next_attempt_ts, priority, id) WHERE status = 'pending'""")
+
+
+async def migration_7_broadcasts(db: aiosqlite.Connection):
+    await _add_column(db, "user_settings", "bot_blocked", "INTEGER DEFAULT 0")
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            created_by INTEGER,
+            created_ts INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'running',
+            total INTEGER NOT NULL DEFAULT 0,
+            sent INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            blocked INTEGER NOT NULL DEFAULT 0,
+            finished_ts INTEGER,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER
+        )""")
+    # Снимок получателей на момент запуска; по нему рассылка и возобновляется
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID""")
+
+
+async def migration_8_fsm_state(db: aiosqlite.Connection):
+    # Состояния диалогов aiogram (см. fsm_storage.SQLiteStorage)
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS fsm_state (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data TEXT NOT NULL DEFAULT '{}',
+            updated_ts INTEGER NOT NULL
+        ) WITHOUT ROWID""")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_fsm_state_updated ON fsm_state(updated_ts)")
+
+
+async def migration_9_cluster(db: aiosqlite.Connection):
+    """Аренда лидера и журнал изменений слотов для режима с несколькими процессами"""
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS leader_lease (
+            name TEXT PRIMARY KEY,
+            holder TEXT NOT NULL,
+            expires_ts REAL NOT NULL
+        )""")
+    # По журналу каждый процесс точечно обновляет свой индекс свободных слотов
+    await db.execute(
+        """CREATE TABLE IF NOT EXISTS slot_changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            slot_id INTEGER NOT NULL,
+            changed_ts INTEGER NOT NULL DEFAULT (CAST(strftime('%s', 'now') AS INTEGER))
+        )""")
+    for table, event, row in (
+        ("slots", "INSERT", "NEW.id"),
+        ("slots", "UPDATE", "NEW.id"),
+        ("slots", "DELETE", "OLD.id"),
+        ("bookings", "INSERT", "NEW.slot_id"),
+        ("bookings", "DELETE", "OLD.slot_id"),
+    ):
+        await db.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_slot_changes_{table}_{event.lower()} AFTER {event} ON {table}
+        BEGIN
+            INSERT INTO slot_changes (slot_id) VALUES ({row});
+        END
+        """)
+
+
+# Порядок менять нельзя: номер миграции = значение PRAGMA user_version
+MIGRATIONS = [
+    migration_1_review_flag,
+    migration_2_epoch_times,
+    migration_3_stats_counters,
+    migration_4_feedback_keyset,
+    migration_5_media_cache,
+    migration_6_outbox,
+    migration_7_broadcasts,
+    migration_8_fsm_state,
+    migration_9_cluster,
+]
+
+
+async def apply_migrations(db: aiosqlite.Connection):
+    cursor = await db.execute("PRAGMA user_version")
+    current = (await cursor.fetchone())[0]
+    if db.in_transaction:
+        await db.commit()
+
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        if version <= current:
+            continue
+
+        await db.execute("BEGIN")
+        try:
+            await migration(db)
+            await db.execute(f"PRAGMA user_version = {version}")
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            logger.error(f"Schema migration {version} ({migration.__name__}) failed")
+            raise
+        logger.info(f"Schema migrated to version {version}: {migration.__name__}")
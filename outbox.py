@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional
+
+import aiosqlite
+from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
+
+import database
+from metrics import metrics
+from sender import Priority, send_priority
+
+logger = logging.getLogger("bot")
+
+OUTBOX_BATCH = int(os.getenv("OUTBOX_BATCH", "50"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = 5  # секунд; 5, 10, 20, ... до OUTBOX_BACKOFF_MAX
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_IDLE_POLL = 300  # страховочный опрос, если никто не разбудил
+OUTBOX_KEEP_SENT = 7 * 86400  # доставленные строки хранятся для дедупликации
+
+# Повторять бессмысленно: бот заблокирован, чат не найден и т.п.
+PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest)
+
+
+class Notification(NamedTuple):
+    """dedup_key уникален для получателя и события, например booking:12:admin:555"""
+    dedup_key: str
+    chat_id: int
+    text: str
+    priority: int = Priority.INTERACTIVE
+
+
+async def enqueue(db: aiosqlite.Connection, notifications: Iterable[Notification]) -> int:
+    """Записывает уведомления в рамках текущей транзакции; повторы по dedup_key игнорируются"""
+    now = int(time.time())
+    cursor = await db.executemany(
+        """INSERT OR IGNORE INTO outbox (dedup_key, chat_id, text, priority, next_attempt_ts, created_ts)
+        VALUES (?, ?, ?, ?, ?, ?)""",
+        [(n.dedup_key, n.chat_id, n.text, int(n.priority), now, now) for n in notifications])
+    return cursor.rowcount
+
+
+def backoff(attempts: int) -> int:
+    return min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX)
+
+
+class OutboxDeliverer:
+    """Фоновая доставка outbox пачками с экспоненциальной задержкой повторов.
+
+    Доставка «хотя бы один раз»: если процесс упадёт между отправкой и
+    отметкой, сообщение уйдёт повторно после перезапуска.
+    """
+
+    def __init__(self, batch: int = OUTBOX_BATCH):
+        self.batch = batch
+        self._wakeup = asyncio.Event()
+        self._last_prune = 0.0
+        # Из других процессов wake() не дойдёт — там очередь опрашивается чаще
+        self.idle_poll = OUTBOX_IDLE_POLL
+        self.counters = Counter()
+
+    def wake(self):
+        """Вызывается после коммита транзакции с новыми уведомлениями"""
+        self._wakeup.set()
+
+    async def _next_due(self) -> Optional[int]:
+        row = await database.fetchone(
+            "SELECT MIN(next_attempt_ts) FROM outbox WHERE status = 'pending'")
+        return row[0]
+
+    async def _send(self, bot, row) -> Optional[Exception]:
+        _, chat_id, text, priority, _ = row
+        try:
+            with send_priority(Priority(priority)):
+                await bot.send_message(chat_id, text)
+            return None
+        except Exception as e:
+            return e
+
+    async def deliver_batch(self, bot) -> int:
+        now = int(time.time())
+        rows = await database.fetchall(
+            """SELECT id, chat_id, text, priority, attempts FROM outbox
+            WHERE status = 'pending' AND next_attempt_ts <= ?
+            ORDER BY priority, id LIMIT ?""",
+            (now, self.batch))
+        if not rows:
+            return 0
+        async with metrics.track("outbox_batch"):
+            await self._deliver(bot, rows)
+        return len(rows)
+
+    async def _deliver(self, bot, rows):
+        errors = await asyncio.gather(*(self._send(bot, row) for row in rows))
+
+        sent, retry, dead = [], [], []
+        now = int(time.time())
+        for (outbox_id, chat_id, _, _, attempts), error in zip(rows, errors):
+            if error is None:
+                sent.append((now, outbox_id))
+                continue
+            attempts += 1
+            if isinstance(error, PERMANENT_ERRORS) or attempts >= OUTBOX_MAX_ATTEMPTS:
+                dead.append((attempts, str(error), outbox_id))
+                logger.error(f"Outbox message {outbox_id} to {chat_id} dead-lettered: {error}")
+            else:
+                retry.append((attempts, now + backoff(attempts), str(error), outbox_id))
+                logger.warning(f"Outbox message {outbox_id} to {chat_id} failed (attempt {attempts}): {error}")
+
+        async with database.pool.writer() as db:
+            await db.executemany(
+                "UPDATE outbox SET status = 'sent', attempts = attempts + 1, next_attempt_ts = ? WHERE id = ?", sent)
+            await db.executemany(
+                "UPDATE outbox SET attempts = ?, next_attempt_ts = ?, last_error = ? WHERE id = ?", retry)
+            await db.executemany(
+                "UPDATE outbox SET status = 'dead', attempts = ?, last_error = ? WHERE id = ?", dead)
+
+        self.counters.update(delivered=len(sent), retried=len(retry), dead_lettered=len(dead))
+
+    async def prune(self):
+        deleted = await database.execute(
+            "DELETE FROM outbox WHERE status = 'sent' AND next_attempt_ts < ?",
+            (int(time.time()) - OUTBOX_KEEP_SENT,))
+        if deleted:
+            logger.info(f"Outbox: pruned {deleted} delivered messages")
+
+    async def run(self, bot):
+        while True:
+            try:
+                self._wakeup.clear()
+                if await self.deliver_batch(bot) >= self.batch:
+                    continue  # очередь не пуста — следующая пачка сразу
+
+                if time.time() - self._last_prune > 3600:
+                    self._last_prune = time.time()
+                    await self.prune()
+
+                due = await self._next_due()
+                timeout = self.idle_poll if due is None else min(max(due - time.time(), 0), self.idle_poll)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            except Exception as e:
+                logger.error(f"Outbox delivery failed: {e}")
+                await asyncio.sleep(60)
+
+    async def stats(self) -> dict:
+        rows = await database.fetchall("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+        return {**dict(rows), **self.counters}
+
+
+outbox = OutboxDeliverer()
@@ -0,0 +1,180 @@
+import os
+import re
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger("bot")
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+QUERY_REPORT_INTERVAL = int(os.getenv("QUERY_REPORT_INTERVAL", "3600"))  # секунд; 0 — без отчёта
+QUERY_REPORT_TOP = int(os.getenv("QUERY_REPORT_TOP", "10"))
+QUERY_STATS_MAX = 2000  # нормализованных запросов в памяти
+# Служебные команды: не нормализуются в статистику и не объясняются
+SKIP_PREFIXES = ("EXPLAIN", "PRAGMA", "BEGIN", "COMMIT", "ROLLBACK", "SAVEPOINT", "RELEASE")
+NO_PLAN_PREFIXES = ("CREATE", "DROP", "ALTER", "VACUUM", "ANALYZE", "REINDEX")
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+Explainer = Callable[[str, Sequence[Any]], Awaitable[List[str]]]
+
+
+def normalize(sql: str) -> str:
+    """Запрос без литералов и лишних пробелов: IN (?, ?, ?) и IN (?, ?) — один и тот же запрос"""
+    sql = _STRING.sub("?", sql)
+    sql = _NUMBER.sub("?", sql)
+    sql = _PLACEHOLDER_LIST.sub("(?…)", sql)
+    return _SPACES.sub(" ", sql).strip()
+
+
+def full_scans(plan: List[str]) -> List[str]:
+    """Строки плана с полным просмотром таблицы (SCAN без индекса)"""
+    return [line.strip() for line in plan
+            if line.strip().startswith("SCAN ") and " USING " not in line and "CONSTANT ROW" not in line]
+
+
+class QueryStats:
+    __slots__ = ("count", "total", "max", "rows", "last_sql", "last_params")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.rows = 0
+        # Последний вызов с параметрами нужен, чтобы снять план позже; в лог не пишется
+        self.last_sql = ""
+        self.last_params: Optional[Sequence[Any]] = None
+
+
+class QueryLog:
+    """Время и число строк каждого SQL-запроса, журнал медленных и сводка самых дорогих.
+
+    Запросы группируются по нормализованному тексту. Медленный запрос
+    (дольше SLOW_QUERY_MS) пишется в лог вместе с EXPLAIN QUERY PLAN;
+    план снимается один раз на запрос и кэшируется. explainer
+    подключает database, чтобы план строился на читающем соединении.
+    """
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold = threshold_ms / 1000
+        self.explainer: Optional[Explainer] = None
+        self._stats: Dict[str, QueryStats] = {}
+        self._plans: Dict[str, List[str]] = {}
+        self._explaining: Dict[str, asyncio.Task] = {}
+        self.slow = 0
+
+    def _entry(self, sql: str) -> Optional[QueryStats]:
+        if sql.lstrip()[:9].upper().startswith(SKIP_PREFIXES):
+            return None
+        key = normalize(sql)
+        entry = self._stats.get(key)
+        if entry is None:
+            if len(self._stats) >= QUERY_STATS_MAX:
+                # Вытесняем самый дешёвый запрос, чтобы не расти без предела
+                del self._stats[min(self._stats, key=lambda k: self._stats[k].total)]
+            entry = self._stats[key] = QueryStats()
+        return entry
+
+    def executed(self, sql: str, params: Optional[Sequence[Any]], seconds: float, rows: int = 0):
+        """Выполнение запроса; params=None для executemany"""
+        entry = self._entry(sql)
+        if entry is None:
+            return
+        entry.count += 1
+        entry.total += seconds
+        entry.rows += max(rows, 0)
+        entry.max = max(entry.max, seconds)
+        if params is not None:
+            entry.last_sql = sql
+            entry.last_params = tuple(params)
+
+    def fetched(self, sql: str, seconds: float, rows: int):
+        """Чтение строк курсором после выполнения"""
+        entry = self._entry(sql)
+        if entry is None:
+            return
+        entry.total += seconds
+        entry.rows += rows
+
+    def is_slow(self, seconds: float) -> bool:
+        return seconds >= self.threshold
+
+    def report_slow(self, sql: str, params: Optional[Sequence[Any]], seconds: float, rows: int):
+        if sql.lstrip()[:9].upper().startswith(SKIP_PREFIXES):
+            return
+        self.slow += 1
+        key = normalize(sql)
+        entry = self._stats.get(key)
+        if entry is not None:
+            entry.max = max(entry.max, seconds)
+        asyncio.get_running_loop().create_task(self._log_slow(key, sql, params, seconds, rows))
+
+    async def _log_slow(self, key: str, sql: str, params: Optional[Sequence[Any]], seconds: float, rows: int):
+        plan = await self.plan(key, sql, params)
+        plan_text = "\n  ".join(plan) if plan else "no plan"
+        logger.warning(f"Slow query {seconds * 1000:.0f} ms, rows {rows}: {key}\n  {plan_text}")
+
+    async def plan(self, key: str, sql: str, params: Optional[Sequence[Any]]) -> List[str]:
+        """EXPLAIN QUERY PLAN запроса; повторные вызовы берут план из кэша"""
+        if key in self._plans:
+            return self._plans[key]
+        if self.explainer is None or params is None or sql.lstrip()[:9].upper().startswith(NO_PLAN_PREFIXES):
+            return []
+        task = self._explaining.get(key)
+        if task is None:
+            task = self._explaining[key] = asyncio.get_running_loop().create_task(self.explainer(sql, params))
+        try:
+            plan = await asyncio.shield(task)
+        except Exception as e:
+            # Например, временная таблица писателя не видна читающему соединению
+            plan = [f"plan unavailable: {e}"]
+        finally:
+            self._explaining.pop(key, None)
+        self._plans[key] = plan
+        return plan
+
+    def top(self, limit: int = QUERY_REPORT_TOP) -> List[dict]:
+        """Самые дорогие запросы по суммарному времени"""
+        rows = []
+        for key, entry in sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]:
+            rows.append({
+                "sql": key,
+                "count": entry.count,
+                "total_ms": round(entry.total * 1000, 1),
+                "avg_ms": round(entry.total / entry.count * 1000, 2) if entry.count else 0.0,
+                "max_ms": round(entry.max * 1000, 1),
+                "avg_rows": round(entry.rows / entry.count, 1) if entry.count else 0.0,
+                "full_scan": bool(full_scans(self._plans.get(key, []))),
+            })
+        return rows
+
+    async def report(self, limit: int = QUERY_REPORT_TOP) -> str:
+        # Для вершины списка план снимается даже у быстрых запросов: полный просмотр виден заранее
+        for key, entry in sorted(self._stats.items(), key=lambda item: item[1].total, reverse=True)[:limit]:
+            await self.plan(key, entry.last_sql, entry.last_params)
+        lines = [f"Top {limit} queries by total time (slow: {self.slow}):"]
+        for n, row in enumerate(self.top(limit), start=1):
+            scan = " FULL SCAN" if row["full_scan"] else ""
+            lines.append(f"{n}. {row['total_ms']} ms total, {row['count']} calls, avg {row['avg_ms']} ms, "
+                         f"max {row['max_ms']} ms, rows {row['avg_rows']}{scan}: {row['sql']}")
+        return "\n".join(lines)
+
+    async def run_reports(self, interval: int = QUERY_REPORT_INTERVAL, limit: int = QUERY_REPORT_TOP):
+        if not interval:
+            return
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if self._stats:
+                    logger.info(await self.report(limit))
+            except Exception as e:
+                logger.error(f"Query report failed: {e}")
+
+    def stats(self) -> dict:
+        return {"statements": len(self._stats), "slow": self.slow, "plans": len(self._plans)}
+
+
+query_log = QueryLog()
@@ -0,0 +1,174 @@
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiosqlite
+
+import database
+from metrics import metrics
+from outbox import outbox
+
+logger = logging.getLogger("bot")
+
+REMIND_BEFORE = 24 * 3600  # напоминание за сутки до съёмки
+REVIEW_AFTER = 24 * 3600  # просьба об отзыве через сутки после
+RETRY_DELAY = 600  # повтор, если обработчик упал
+BATCH_WINDOW = 1  # задачи со сроком в пределах секунды обрабатываются одной пачкой
+
+# Вид задачи -> флаг в bookings, который ставится после выполнения
+DONE_COLUMNS = {
+    "reminder": "reminder_sent",
+    "review": "review_requested",
+}
+
+PENDING_QUERY = """SELECT b.id, s.start_ts, b.reminder_sent, b.review_requested
+    FROM bookings b
+    JOIN slots s ON s.id = b.slot_id
+    WHERE (b.reminder_sent = 0 AND s.start_ts >= ?) OR b.review_requested = 0"""
+
+# Получает транзакцию и id записей, у которых подошёл срок; кладёт уведомления
+# в outbox и возвращает id обработанных. Флаг ставится в той же транзакции.
+JobHandler = Callable[[aiosqlite.Connection, List[int]], Awaitable[Iterable[int]]]
+
+
+class ReminderScheduler:
+    """Min-heap задач по записям со сном до ближайшего срока.
+
+    Перенесённые задачи из кучи не удаляются: актуальный срок хранится
+    в _due, а устаревшие элементы кучи пропускаются при извлечении. Записи,
+    удалённые из базы, отдельно не снимаются — обработчики их просто не найдут.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, str, int]] = []
+        self._due: Dict[Tuple[str, int], int] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._handlers: Dict[str, JobHandler] = {}
+        self.fired = 0
+        self.last_booking_id = 0
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def handler(self, kind: str):
+        def register(func: JobHandler) -> JobHandler:
+            self._handlers[kind] = func
+            return func
+        return register
+
+    def _push(self, kind: str, booking_id: int, due: int):
+        # Свою запись лидер планирует сразу, а потом видит её ещё раз в sync_new
+        if self._due.get((kind, booking_id)) == due:
+            return
+        self._due[(kind, booking_id)] = due
+        heapq.heappush(self._heap, (due, next(self._seq), kind, booking_id))
+        if self._heap[0][3] == booking_id and self._heap[0][2] == kind:
+            self._wakeup.set()
+
+    def schedule_booking(self, booking_id: int, start_ts: int, reminder: bool = True, review: bool = True):
+        now = int(time.time())
+        if reminder and start_ts >= now:
+            self._push("reminder", booking_id, start_ts - REMIND_BEFORE)
+        if review:
+            self._push("review", booking_id, start_ts + REVIEW_AFTER)
+
+    async def load(self):
+        row = await database.fetchone("SELECT COALESCE(MAX(id), 0) FROM bookings")
+        self.last_booking_id = row[0]
+        rows = await database.fetchall(PENDING_QUERY, (int(time.time()),))
+        self._heap.clear()
+        self._due.clear()
+        for booking_id, start_ts, reminder_sent, review_requested in rows:
+            self.schedule_booking(booking_id, start_ts, not reminder_sent, not review_requested)
+        logger.info(f"Reminder scheduler loaded {len(self._due)} jobs")
+
+    async def sync_new(self) -> int:
+        """Подхватывает записи, сделанные другими процессами"""
+        rows = await database.fetchall(
+            """SELECT b.id, s.start_ts, b.reminder_sent, b.review_requested
+            FROM bookings b
+            JOIN slots s ON s.id = b.slot_id
+            WHERE b.id > ? ORDER BY b.id""",
+            (self.last_booking_id,))
+        for booking_id, start_ts, reminder_sent, review_requested in rows:
+            self.schedule_booking(booking_id, start_ts, not reminder_sent, not review_requested)
+        if rows:
+            self.last_booking_id = rows[-1][0]
+        return len(rows)
+
+    async def watch_new(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sync_new()
+            except Exception as e:
+                logger.error(f"Reminder scheduler sync failed: {e}")
+
+    def next_due(self) -> Optional[int]:
+        while self._heap:
+            due, _, kind, booking_id = self._heap[0]
+            if self._due.get((kind, booking_id)) == due:
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def _pop_due(self, now: int) -> Dict[str, List[int]]:
+        batch: Dict[str, List[int]] = {}
+        while True:
+            due = self.next_due()
+            if due is None or due > now + BATCH_WINDOW:
+                return batch
+            _, _, kind, booking_id = heapq.heappop(self._heap)
+            del self._due[(kind, booking_id)]
+            batch.setdefault(kind, []).append(booking_id)
+
+    async def _fire(self, kind: str, booking_ids: List[int]):
+        try:
+            async with metrics.track(f"reminder_task:{kind}"), database.pool.writer(immediate=True) as db:
+                done = set(await self._handlers[kind](db, booking_ids))
+                if done:
+                    placeholders = ", ".join("?" * len(done))
+                    await db.execute(
+                        f"UPDATE bookings SET {DONE_COLUMNS[kind]} = 1 WHERE id IN ({placeholders})",
+                        tuple(done))
+            self.fired += len(done)
+            outbox.wake()
+        except Exception as e:
+            logger.error(f"Scheduled {kind} jobs failed: {e}")
+            done = set()
+
+        retry_at = int(time.time()) + RETRY_DELAY
+        for booking_id in booking_ids:
+            if booking_id not in done and (kind, booking_id) not in self._due:
+                self._push(kind, booking_id, retry_at)
+
+    async def run(self):
+        while True:
+            try:
+                due = self.next_due()
+                now = time.time()
+                if due is None or due > now:
+                    self._wakeup.clear()
+                    timeout = None if due is None else due - now
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                batch = self._pop_due(int(now))
+                await asyncio.gather(*(self._fire(kind, ids) for kind, ids in batch.items()))
+            except Exception as e:
+                logger.error(f"Reminder scheduler failed: {e}")
+                await asyncio.sleep(60)
+
+    def stats(self) -> dict:
+        due = self.next_due()
+        return {"jobs": len(self._due), "fired": self.fired, "next_in": None if due is None else due - int(time.time())}
+
+
+reminder_scheduler = ReminderScheduler()
@@ -0,0 +1,272 @@
+import os
+import time
+import asyncio
+import logging
+import itertools
+import contextvars
+from collections import Counter, deque
+from contextlib import contextmanager
+from enum import IntEnum
+from typing import Any, Awaitable, Callable, Dict, Optional, Union
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger("bot")
+
+# Ограничения Telegram: ~30 сообщений/с на бота, ~1/с в личный чат, 20/мин в группу
+SENDER_RATE = float(os.getenv("SENDER_RATE", "30"))
+SENDER_WORKERS = int(os.getenv("SENDER_WORKERS", "8"))
+SENDER_MAX_RETRIES = int(os.getenv("SENDER_MAX_RETRIES", "3"))
+PRIVATE_CHAT_LIMIT = (float(os.getenv("SENDER_CHAT_RATE", "1")), 3)  # токенов в секунду, размер всплеска
+GROUP_CHAT_LIMIT = (20 / 60, 3)
+CHAT_BUCKETS_MAX = 10000
+LATENCY_SAMPLES = 1000
+
+ChatId = Union[int, str]
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # ответы на действия пользователя
+    REMINDER = 1  # напоминания и фоновые уведомления
+    BULK = 2  # рассылки
+
+
+_priority: contextvars.ContextVar[Priority] = contextvars.ContextVar("send_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def send_priority(priority: Priority):
+    """Все отправки внутри блока (и в созданных в нём задачах) идут в указанную очередь"""
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: float) -> float:
+        """Сколько секунд ждать до следующего токена (0 — можно сейчас)"""
+        self._refill(now)
+        wait = self.blocked_until - now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return max(wait, 0.0)
+
+    def consume(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity and self.blocked_until <= now
+
+
+class _Job:
+    __slots__ = ("chat_id", "call", "priority", "future", "enqueued", "attempts")
+
+    def __init__(self, chat_id: ChatId, call: Callable[[], Awaitable[Any]], priority: Priority):
+        self.chat_id = chat_id
+        self.call = call
+        self.priority = priority
+        self.future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+        self.attempts = 0
+
+
+def _percentile(samples, p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+class RateLimitedSender:
+    """Очередь исходящих запросов к Bot API с приоритетами и ограничением скорости.
+
+    Общий token bucket на бота и отдельные на каждый чат; задача, чей чат
+    ещё не готов, откладывается и не занимает воркер. При 429 чат
+    блокируется на retry_after, и запрос повторяется.
+    """
+
+    def __init__(self, rate: float = SENDER_RATE, workers: int = SENDER_WORKERS,
+                 max_retries: int = SENDER_MAX_RETRIES):
+        self._global = TokenBucket(rate, rate)
+        self._chats: Dict[ChatId, TokenBucket] = {}
+        self._workers_count = workers
+        self._max_retries = max_retries
+        self._queue: Optional[asyncio.PriorityQueue] = None
+        self._workers = []
+        self._seq = itertools.count()
+        self._jobs = set()
+        self.running = False
+
+        self.depth = Counter()  # ожидают отправки, по приоритетам (включая отложенные)
+        self.counters = Counter()
+        self.wait_times = deque(maxlen=LATENCY_SAMPLES)
+        self.send_times = deque(maxlen=LATENCY_SAMPLES)
+
+    async def start(self):
+        if self.running:
+            return
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self._workers_count)]
+        self.running = True
+        logger.info(f"Sender started: {self._workers_count} workers, {self._global.rate:g} msg/s")
+
+    async def stop(self, timeout: float = 10):
+        if not self.running:
+            return
+        self.running = False
+        # Новые запросы уже идут напрямую; дожидаемся очереди и отложенных повторов
+        deadline = time.monotonic() + timeout
+        while self._jobs and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self._jobs:
+            logger.warning(f"Sender stopped with {len(self._jobs)} requests pending")
+        for job in self._jobs:
+            job.future.cancel()
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._jobs.clear()
+        self.depth.clear()
+
+    async def submit(self, chat_id: ChatId, call: Callable[[], Awaitable[Any]],
+                     priority: Optional[Priority] = None) -> Any:
+        if not self.running:
+            return await call()
+        job = _Job(chat_id, call, _priority.get() if priority is None else priority)
+        self.depth[job.priority] += 1
+        self.counters["submitted"] += 1
+        self._jobs.add(job)
+        self._put(job)
+        return await job.future
+
+    def _put(self, job: _Job):
+        if job.future.done():
+            self._finish(job)
+            return
+        self._queue.put_nowait((job.priority, next(self._seq), job))
+
+    def _defer(self, job: _Job, delay: float):
+        asyncio.get_running_loop().call_later(delay, self._put, job)
+
+    def _chat_bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= CHAT_BUCKETS_MAX:
+                now = time.monotonic()
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.idle(now)}
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = TokenBucket(*(GROUP_CHAT_LIMIT if is_group else PRIVATE_CHAT_LIMIT))
+        return bucket
+
+    async def _worker(self):
+        while True:
+            _, _, job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception as e:
+                logger.error(f"Sender worker error: {e}")
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, job: _Job):
+        self.depth[job.priority] -= 1
+        self._jobs.discard(job)
+
+    async def _process(self, job: _Job):
+        if job.future.done():  # вызывающий уже отменил ожидание
+            self._finish(job)
+            return
+
+        chat = self._chat_bucket(job.chat_id)
+        while True:
+            now = time.monotonic()
+            chat_wait = chat.delay(now)
+            if chat_wait > 0:
+                self.counters["deferred"] += 1
+                self._defer(job, chat_wait)
+                return
+            global_wait = self._global.delay(now)
+            if global_wait <= 0:
+                break
+            await asyncio.sleep(global_wait)
+        chat.consume()
+        self._global.consume()
+
+        started = time.monotonic()
+        if job.attempts == 0:
+            self.wait_times.append(started - job.enqueued)
+        job.attempts += 1
+        try:
+            result = await job.call()
+        except TelegramRetryAfter as e:
+            self.counters["retry_after"] += 1
+            chat.block(e.retry_after)
+            if job.attempts <= self._max_retries:
+                logger.warning(f"Flood control for chat {job.chat_id}: retry in {e.retry_after}s")
+                self._defer(job, e.retry_after)
+                return
+            self._fail(job, e)
+            return
+        except Exception as e:
+            self._fail(job, e)
+            return
+
+        self.send_times.append(time.monotonic() - started)
+        self.counters["sent"] += 1
+        self._finish(job)
+        if not job.future.done():
+            job.future.set_result(result)
+
+    def _fail(self, job: _Job, error: Exception):
+        self.counters["failed"] += 1
+        self._finish(job)
+        if not job.future.done():
+            job.future.set_exception(error)
+
+    def stats(self) -> dict:
+        return {
+            "queued": {p.name.lower(): self.depth[p] for p in Priority},
+            "submitted": self.counters["submitted"],
+            "sent": self.counters["sent"],
+            "failed": self.counters["failed"],
+            "retry_after": self.counters["retry_after"],
+            "deferred": self.counters["deferred"],
+            "wait_p50_ms": round(_percentile(self.wait_times, 0.5) * 1000, 1),
+            "wait_p95_ms": round(_percentile(self.wait_times, 0.95) * 1000, 1),
+            "send_p95_ms": round(_percentile(self.send_times, 0.95) * 1000, 1),
+        }
+
+
+sender = RateLimitedSender()
+
+
+class SenderMiddleware(BaseRequestMiddleware):
+    """Пропускает через sender все запросы Bot API, адресованные чату"""
+
+    def __init__(self, rate_limiter: RateLimitedSender = sender):
+        self.rate_limiter = rate_limiter
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        return await self.rate_limiter.submit(chat_id, lambda: make_request(bot, method))
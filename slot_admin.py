@@ -0,0 +1,352 @@
+import re
+from datetime import date, datetime, time, timedelta
+from typing import List, NamedTuple, Optional, Set, Tuple
+
+import database
+from slot_index import slot_index
+
+WEEKDAYS = {
+    "пн": 0, "вт": 1, "ср": 2, "чт": 3, "пт": 4, "сб": 5, "вс": 6,
+    "mon": 0, "tue": 1, "wed": 2, "thu": 3, "fri": 4, "sat": 5, "sun": 6,
+}
+
+MAX_GENERATED_SLOTS = 2000
+
+
+class RecurrenceRule(NamedTuple):
+    weekdays: Set[int]
+    start_time: time
+    end_time: time
+    step: timedelta
+    date_from: date
+    date_to: date
+    photographer_id: Optional[int] = None
+    excluded: Set[date] = set()
+
+
+def _parse_date(text: str) -> date:
+    return datetime.strptime(text, "%d.%m.%Y").date()
+
+
+def _parse_weekdays(text: str) -> Set[int]:
+    result = set()
+    for part in text.lower().split(","):
+        if "-" in part:
+            first, last = (WEEKDAYS[p] for p in part.split("-", 1))
+            day = first
+            while True:
+                result.add(day)
+                if day == last:
+                    break
+                day = (day + 1) % 7
+        else:
+            result.add(WEEKDAYS[part])
+    return result
+
+
+def parse_recurrence(text: str) -> RecurrenceRule:
+    """Разбирает правило вида
+
+        пн-пт 10:00-18:00 60 01.11.2026-30.11.2026 [ф=ID] [кроме=04.11.2026,...]
+
+    Шаг — в минутах. Бросает ValueError с понятным текстом.
+    """
+    parts = text.split()
+    if len(parts) < 4:
+        raise ValueError("Неверный формат правила")
+
+    try:
+        weekdays = _parse_weekdays(parts[0])
+    except KeyError:
+        raise ValueError("Неизвестный день недели")
+
+    window = re.fullmatch(r"(\d{1,2}:\d{2})-(\d{1,2}:\d{2})", parts[1])
+    if not window:
+        raise ValueError("Окно времени задаётся как ЧЧ:ММ-ЧЧ:ММ")
+    start_time = datetime.strptime(window.group(1), "%H:%M").time()
+    end_time = datetime.strptime(window.group(2), "%H:%M").time()
+    if end_time <= start_time:
+        raise ValueError("Конец окна должен быть позже начала")
+
+    if not parts[2].isdigit() or int(parts[2]) < 5:
+        raise ValueError("Шаг — целое число минут, не меньше 5")
+    step = timedelta(minutes=int(parts[2]))
+
+    try:
+        first, _, last = parts[3].partition("-")
+        date_from = _parse_date(first)
+        date_to = _parse_date(last) if last else date_from
+    except ValueError:
+        raise ValueError("Диапазон дат задаётся как ДД.ММ.ГГГГ-ДД.ММ.ГГГГ")
+    if date_to < date_from:
+        raise ValueError("Конец диапазона раньше начала")
+
+    photographer_id = None
+    excluded = set()
+    for option in parts[4:]:
+        key, _, value = option.partition("=")
+        key = key.lower()
+        try:
+            if key in ("ф", "ph"):
+                photographer_id = int(value)
+            elif key in ("кроме", "skip"):
+                excluded = {_parse_date(d) for d in value.split(",") if d}
+            else:
+                raise ValueError
+        except ValueError:
+            raise ValueError(f"Неверный параметр: {option}")
+
+    return RecurrenceRule(weekdays, start_time, end_time, step, date_from, date_to, photographer_id, excluded)
+
+
+def expand_rule(rule: RecurrenceRule, now: Optional[datetime] = None) -> List[datetime]:
+    """Все будущие даты-время слотов по правилу, по возрастанию"""
+    now = now or database.local_now()
+    result = []
+    day = rule.date_from
+    while day <= rule.date_to:
+        if day.weekday() in rule.weekdays and day not in rule.excluded:
+            current = datetime.combine(day, rule.start_time)
+            end = datetime.combine(day, rule.end_time)
+            while current < end:
+                if current > now:
+                    result.append(current)
+                current += rule.step
+        day += timedelta(days=1)
+
+    if len(result) > MAX_GENERATED_SLOTS:
+        raise ValueError(f"Слишком много слотов ({len(result)}), максимум {MAX_GENERATED_SLOTS}")
+    return result
+
+
+async def bulk_add_slots(datetimes: List[datetime], photographer_id: Optional[int] = None) -> Tuple[int, int]:
+    """Создаёт слоты одной транзакцией; возвращает (создано, пропущено)"""
+    if not datetimes:
+        return 0, 0
+
+    rows = [
+        (dt.strftime("%Y-%m-%d %H:%M:%S"), photographer_id, database.to_epoch(dt), database.day_key(dt))
+        for dt in datetimes
+    ]
+    first_ts, last_ts = rows[0][2], rows[-1][2]
+
+    async with database.pool.writer(immediate=True) as db:
+        # total_changes учитывает и строки триггеров (slot_changes), поэтому считаем сами слоты
+        cursor = await db.execute("SELECT COUNT(*) FROM slots")
+        before = (await cursor.fetchone())[0]
+        await db.executemany(
+            "INSERT OR IGNORE INTO slots (datetime, photographer_id, start_ts, day_key) VALUES (?, ?, ?, ?)",
+            rows)
+        cursor = await db.execute("SELECT COUNT(*) FROM slots")
+        created = (await cursor.fetchone())[0] - before
+
+        cursor = await db.execute(
+            """SELECT s.id, s.start_ts, p.username
+            FROM slots s
+            LEFT JOIN bookings b ON s.id = b.slot_id
+            LEFT JOIN photographers p ON s.photographer_id = p.id
+            WHERE b.slot_id IS NULL AND s.start_ts BETWEEN ? AND ?""",
+            (first_ts, last_ts))
+        free = await cursor.fetchall()
+
+    slot_index.apply(added=[
+        (slot_id, database.from_epoch(start_ts), username) for slot_id, start_ts, username in free
+    ])
+
+    return created, len(rows) - created
+
+
+class BookedSlot(NamedTuple):
+    slot_id: int
+    dt: datetime
+    user_id: int
+    name: str
+    contact: str
+
+
+class RangeResult(NamedTuple):
+    changed: int
+    conflicts: int
+    booked: List[BookedSlot]
+
+
+def parse_slot_range(text: str) -> Tuple[datetime, datetime]:
+    """Полуинтервал [начало, конец) из одной из форм:
+
+        01.11.2026                      — весь день
+        01.11.2026-07.11.2026           — дни включительно
+        01.11.2026 10:00-14:00          — часть дня
+        01.11.2026 10:00-03.11.2026 14:00
+    """
+    text = " ".join(text.split())
+    try:
+        match = re.fullmatch(r"(\S+) (\d{1,2}:\d{2})-(\S+) (\d{1,2}:\d{2})", text)
+        if match:
+            start = datetime.strptime(f"{match.group(1)} {match.group(2)}", "%d.%m.%Y %H:%M")
+            end = datetime.strptime(f"{match.group(3)} {match.group(4)}", "%d.%m.%Y %H:%M")
+        elif " " in text:
+            day_text, window = text.split(" ", 1)
+            first, last = window.split("-", 1)
+            start = datetime.strptime(f"{day_text} {first}", "%d.%m.%Y %H:%M")
+            end = datetime.strptime(f"{day_text} {last}", "%d.%m.%Y %H:%M")
+        else:
+            first, _, last = text.partition("-")
+            start = datetime.combine(_parse_date(first), time())
+            end = datetime.combine(_parse_date(last or first), time()) + timedelta(days=1)
+    except ValueError:
+        raise ValueError("Неверный формат периода")
+
+    if end <= start:
+        raise ValueError("Конец периода должен быть позже начала")
+    return start, end
+
+
+def parse_range_command(text: str) -> Tuple[str, Optional[timedelta], datetime, datetime]:
+    """«удалить <период>» или «сдвиг ±МИН <период>» -> (действие, сдвиг, начало, конец)"""
+    parts = text.split(maxsplit=1)
+    if len(parts) < 2:
+        raise ValueError("Укажите действие и период")
+
+    action = parts[0].lower()
+    if action in ("удалить", "delete"):
+        return "delete", None, *parse_slot_range(parts[1])
+
+    if action in ("сдвиг", "shift"):
+        offset, _, period = parts[1].partition(" ")
+        if not re.fullmatch(r"[+-]?\d+", offset) or int(offset) == 0:
+            raise ValueError("Сдвиг задаётся в минутах, например +60 или -30")
+        return "shift", timedelta(minutes=int(offset)), *parse_slot_range(period)
+
+    raise ValueError("Действие: удалить или сдвиг")
+
+
+async def _booked_in_range(db, start_ts: int, end_ts: int) -> List[BookedSlot]:
+    cursor = await db.execute(
+        """SELECT s.id, s.start_ts, b.user_id, b.name, b.contact
+        FROM slots s
+        JOIN bookings b ON b.slot_id = s.id
+        WHERE s.start_ts >= ? AND s.start_ts < ?
+        ORDER BY s.start_ts""",
+        (start_ts, end_ts))
+    return [
+        BookedSlot(slot_id, database.from_epoch(ts), user_id, name, contact)
+        for slot_id, ts, user_id, name, contact in await cursor.fetchall()
+    ]
+
+
+async def count_range(start: datetime, end: datetime) -> Tuple[int, int]:
+    """(свободных, занятых) слотов в периоде — для предпросмотра"""
+    row = await database.fetchone(
+        """SELECT COUNT(*), COUNT(b.slot_id)
+        FROM slots s
+        LEFT JOIN bookings b ON b.slot_id = s.id
+        WHERE s.start_ts >= ? AND s.start_ts < ?""",
+        (database.to_epoch(start), database.to_epoch(end)))
+    total, booked = row
+    return total - booked, booked
+
+
+async def count_past_targets(start: datetime, end: datetime, delta: timedelta) -> int:
+    """Свободные слоты периода, которые сдвиг на delta отправил бы в прошлое — для предпросмотра"""
+    row = await database.fetchone(
+        """SELECT COUNT(*) FROM slots s
+        WHERE s.start_ts >= ? AND s.start_ts < ? AND s.start_ts <= ?
+          AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.slot_id = s.id)""",
+        (database.to_epoch(start), database.to_epoch(end),
+         database.to_epoch(database.local_now() - delta)))
+    return row[0]
+
+
+async def delete_free_slots(start: datetime, end: datetime) -> RangeResult:
+    """Удаляет все свободные слоты периода одним DELETE; занятые возвращает списком"""
+    start_ts, end_ts = database.to_epoch(start), database.to_epoch(end)
+
+    async with database.pool.writer(immediate=True) as db:
+        booked = await _booked_in_range(db, start_ts, end_ts)
+        cursor = await db.execute(
+            """DELETE FROM slots
+            WHERE start_ts >= ? AND start_ts < ?
+              AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.slot_id = slots.id)
+            RETURNING id""",
+            (start_ts, end_ts))
+        deleted = [row[0] for row in await cursor.fetchall()]
+
+    slot_index.apply(removed=deleted)
+    return RangeResult(len(deleted), 0, booked)
+
+
+async def shift_free_slots(start: datetime, end: datetime, delta: timedelta) -> RangeResult:
+    """Сдвигает свободные слоты периода на delta.
+
+    Слоты, чьё новое время уже занято другим (несдвигаемым) слотом или
+    уже прошло, остаются на месте и считаются конфликтами. Оставшийся на месте слот
+    сам занимает своё время, поэтому конфликты разрешаются до неподвижной точки.
+    """
+    start_ts, end_ts = database.to_epoch(start), database.to_epoch(end)
+
+    async with database.pool.writer(immediate=True) as db:
+        booked = await _booked_in_range(db, start_ts, end_ts)
+        cursor = await db.execute(
+            """SELECT s.id, s.start_ts, s.datetime, p.username
+            FROM slots s
+            LEFT JOIN photographers p ON p.id = s.photographer_id
+            WHERE s.start_ts >= ? AND s.start_ts < ?
+              AND NOT EXISTS (SELECT 1 FROM bookings b WHERE b.slot_id = s.id)""",
+            (start_ts, end_ts))
+        candidates = await cursor.fetchall()
+        moving_ids = {row[0] for row in candidates}
+
+        targets, current = {}, {}
+        for slot_id, ts, dt_text, username in candidates:
+            new_dt = database.from_epoch(ts) + delta
+            targets[slot_id] = (new_dt, username)
+            current[slot_id] = dt_text
+
+        # Занятые чужими слотами целевые времена
+        taken = set()
+        if targets:
+            new_texts = [dt.strftime("%Y-%m-%d %H:%M:%S") for dt, _ in targets.values()]
+            for i in range(0, len(new_texts), 500):
+                chunk = new_texts[i:i + 500]
+                cursor = await db.execute(
+                    f"SELECT id, datetime FROM slots WHERE datetime IN ({','.join('?' * len(chunk))})",
+                    chunk)
+                taken.update(text for slot_id, text in await cursor.fetchall() if slot_id not in moving_ids)
+
+        # Слот с конфликтом не двигается и занимает своё время для остальных.
+        # В прошлое не сдвигаем: такой слот молча пропал бы из индекса и /book
+        new_texts = {slot_id: dt.strftime("%Y-%m-%d %H:%M:%S") for slot_id, (dt, _) in targets.items()}
+        now = database.local_now()
+        blocked = {slot_id for slot_id, (dt, _) in targets.items() if dt <= now}
+        taken.update(current[slot_id] for slot_id in blocked)
+        while True:
+            newly_blocked = {slot_id for slot_id, text in new_texts.items()
+                             if slot_id not in blocked and text in taken}
+            if not newly_blocked:
+                break
+            blocked |= newly_blocked
+            taken.update(current[slot_id] for slot_id in newly_blocked)
+
+        rows = [
+            (slot_id, new_texts[slot_id], database.to_epoch(dt), database.day_key(dt))
+            for slot_id, (dt, _) in targets.items()
+            if slot_id not in blocked
+        ]
+        if rows:
+            # Уникальность datetime проверяется построчно, поэтому сначала
+            # освобождаем старые значения, затем ставим новые одним UPDATE ... FROM
+            await db.execute("CREATE TEMP TABLE IF NOT EXISTS slot_shift (id INTEGER PRIMARY KEY, datetime TEXT, start_ts INTEGER, day_key INTEGER)")
+            await db.execute("DELETE FROM slot_shift")
+            await db.executemany("INSERT INTO slot_shift VALUES (?, ?, ?, ?)", rows)
+            await db.execute("UPDATE slots SET datetime = 'shift:' || id WHERE id IN (SELECT id FROM slot_shift)")
+            await db.execute(
+                """UPDATE slots SET datetime = n.datetime, start_ts = n.start_ts, day_key = n.day_key
+                FROM slot_shift n WHERE slots.id = n.id""")
+            await db.execute("DELETE FROM slot_shift")
+
+    moved = {row[0] for row in rows}
+    slot_index.apply(
+        removed=moved,
+        added=[(slot_id, targets[slot_id][0], targets[slot_id][1]) for slot_id in moved],
+    )
+    return RangeResult(len(moved), len(targets) - len(moved), booked)
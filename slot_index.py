@@ -0,0 +1,221 @@
+import bisect
+import logging
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import database
+
+logger = logging.getLogger("bot")
+
+FREE_SLOTS_QUERY = """SELECT s.id, s.start_ts, p.username
+    FROM slots s
+    LEFT JOIN bookings b ON s.id = b.slot_id
+    LEFT JOIN photographers p ON s.photographer_id = p.id
+    WHERE b.slot_id IS NULL AND s.start_ts >= ?"""
+
+
+class SlotEntry:
+    __slots__ = ("id", "dt", "photographer")
+
+    def __init__(self, slot_id: int, dt: datetime, photographer: Optional[str]):
+        self.id = slot_id
+        self.dt = dt
+        self.photographer = photographer
+
+    @property
+    def date_str(self) -> str:
+        return self.dt.strftime("%d.%m.%Y")
+
+    @property
+    def time_str(self) -> str:
+        return self.dt.strftime("%H:%M")
+
+    @property
+    def photographer_info(self) -> str:
+        return f" (@{self.photographer})" if self.photographer else ""
+
+
+class SlotIndex:
+    """Отсортированный по дням индекс свободных слотов в памяти процесса.
+
+    Строится один раз при старте и обновляется точечно при добавлении,
+    удалении и бронировании слотов. Прошедшие слоты отсекаются при чтении.
+    """
+
+    def __init__(self):
+        self._entries: Dict[int, SlotEntry] = {}
+        self._by_day: Dict[date, List[Tuple[datetime, int]]] = {}
+        self._days: List[date] = []
+        self.version = 0
+        self.change_seq = 0  # последняя учтённая запись журнала slot_changes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_day.clear()
+        self._days.clear()
+        self.version += 1
+
+    def _insert(self, slot_id: int, dt: datetime, photographer: Optional[str]):
+        if slot_id in self._entries:
+            self._delete(slot_id)
+
+        self._entries[slot_id] = SlotEntry(slot_id, dt, photographer)
+        day = dt.date()
+        if day not in self._by_day:
+            self._by_day[day] = []
+            bisect.insort(self._days, day)
+        bisect.insort(self._by_day[day], (dt, slot_id))
+
+    def _delete(self, slot_id: int) -> Optional[SlotEntry]:
+        entry = self._entries.pop(slot_id, None)
+        if not entry:
+            return None
+
+        day = entry.dt.date()
+        day_slots = self._by_day[day]
+        pos = bisect.bisect_left(day_slots, (entry.dt, slot_id))
+        if pos < len(day_slots) and day_slots[pos] == (entry.dt, slot_id):
+            del day_slots[pos]
+        if not day_slots:
+            del self._by_day[day]
+            del self._days[bisect.bisect_left(self._days, day)]
+        return entry
+
+    def add(self, slot_id: int, dt: datetime, photographer: Optional[str] = None):
+        self._insert(slot_id, dt, photographer)
+        self.version += 1
+
+    def remove(self, slot_id: int) -> Optional[SlotEntry]:
+        entry = self._delete(slot_id)
+        if entry:
+            self.version += 1
+        return entry
+
+    def apply(self, removed: Iterable[int] = (), added: Iterable[Tuple[int, datetime, Optional[str]]] = ()):
+        """Пакетное изменение: удаляет и добавляет слоты, версия растёт один раз"""
+        for slot_id in removed:
+            self._delete(slot_id)
+        for slot_id, dt, photographer in added:
+            self._insert(slot_id, dt, photographer)
+        self.version += 1
+
+    def get(self, slot_id: int, now: Optional[datetime] = None) -> Optional[SlotEntry]:
+        entry = self._entries.get(slot_id)
+        if entry and now and entry.dt < now:
+            return None
+        return entry
+
+    def prune(self, now: datetime) -> int:
+        """Удаляет прошедшие слоты; возвращает их количество"""
+        expired = []
+        # Дни отсортированы, поэтому смотрим только начало индекса — O(число устаревших)
+        for day in self._days:
+            if day > now.date():
+                break
+            for dt, slot_id in self._by_day[day]:
+                if dt >= now:
+                    break
+                expired.append(slot_id)
+        if expired:
+            self.apply(removed=expired)
+        return len(expired)
+
+    def available_dates(self, now: datetime, days_ahead: int) -> List[date]:
+        last_day = (now + timedelta(days=days_ahead)).date()
+        end = bisect.bisect_right(self._days, last_day)
+        start = bisect.bisect_left(self._days, now.date())
+        return [day for day in self._days[start:end] if self.slots_for_day(day, now, days_ahead)]
+
+    def slots_for_day(self, day: date, now: datetime, days_ahead: int) -> List[SlotEntry]:
+        limit = now + timedelta(days=days_ahead)
+        day_slots = self._by_day.get(day, [])
+        start = bisect.bisect_left(day_slots, (now, -1)) if day == now.date() else 0
+        return [self._entries[slot_id] for dt, slot_id in day_slots[start:] if dt <= limit]
+
+    def snapshot(self, now: datetime, days_ahead: int) -> Dict[str, List[Tuple[int, str, str]]]:
+        """Свободные слоты в формате {ДД.ММ.ГГГГ: [(id, ЧЧ:ММ, фотограф)]}"""
+        result = {}
+        for day in self.available_dates(now, days_ahead):
+            result[day.strftime("%d.%m.%Y")] = [
+                (e.id, e.time_str, e.photographer_info)
+                for e in self.slots_for_day(day, now, days_ahead)
+            ]
+        return result
+
+    def ids(self) -> set:
+        return set(self._entries)
+
+
+slot_index = SlotIndex()
+
+
+async def load_free_slots(now: Optional[datetime] = None) -> List[tuple]:
+    now = now or database.local_now()
+    return await database.fetchall(FREE_SLOTS_QUERY, (database.to_epoch(now),))
+
+
+async def rebuild_index(now: Optional[datetime] = None):
+    # Позиция журнала берётся до чтения слотов: изменения между ними подтянет sync_changes
+    row = await database.fetchone("SELECT COALESCE(MAX(seq), 0) FROM slot_changes")
+    rows = await load_free_slots(now)
+    slot_index.clear()
+    slot_index.change_seq = row[0]
+    for slot_id, start_ts, username in rows:
+        slot_index.add(slot_id, database.from_epoch(start_ts), username)
+    logger.info(f"Slot index built: {len(slot_index)} free slots")
+
+
+async def check_consistency(repair: bool = True) -> dict:
+    """Сравнивает индекс с базой; при расхождении по желанию перестраивает его"""
+    now = database.local_now()
+    slot_index.prune(now)
+    rows = await load_free_slots(now)
+    db_ids = {row[0] for row in rows}
+    index_ids = slot_index.ids()
+
+    report = {
+        "missing": sorted(db_ids - index_ids),
+        "stale": sorted(index_ids - db_ids),
+    }
+    report["ok"] = not report["missing"] and not report["stale"]
+
+    if not report["ok"]:
+        logger.warning(f"Slot index drift: {report}")
+        if repair:
+            await rebuild_index(now)
+    return report
+
+
+async def sync_changes() -> int:
+    """Применяет изменения слотов, сделанные другими процессами; возвращает их число"""
+    rows = await database.fetchall(
+        "SELECT seq, slot_id FROM slot_changes WHERE seq > ? ORDER BY seq", (slot_index.change_seq,))
+    if not rows:
+        return 0
+
+    changed = {slot_id for _, slot_id in rows}
+    placeholders = ", ".join("?" * len(changed))
+    now = database.local_now()
+    free = await database.fetchall(
+        f"{FREE_SLOTS_QUERY} AND s.id IN ({placeholders})", (database.to_epoch(now), *changed))
+    removed = [slot_id for slot_id in changed - {row[0] for row in free} if slot_index.get(slot_id)]
+    added = []
+    for slot_id, start_ts, username in free:
+        dt = database.from_epoch(start_ts)
+        entry = slot_index.get(slot_id)
+        if not entry or entry.dt != dt or entry.photographer != username:
+            added.append((slot_id, dt, username))
+
+    # Свои изменения процесс уже внёс в индекс — версию зря не поднимаем
+    if removed or added:
+        slot_index.apply(removed=removed, added=added)
+    slot_index.change_seq = rows[-1][0]
+    return len(removed) + len(added)
+
+
+async def prune_changes(max_age: int = 3600) -> int:
+    return await database.execute(
+        "DELETE FROM slot_changes WHERE changed_ts < CAST(strftime('%s', 'now') AS INTEGER) - ?", (max_age,))
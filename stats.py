@@ -0,0 +1,141 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import aiosqlite
+
+import database
+from migrations import recompute_stats
+from slot_index import slot_index
+
+# Счётчики поддерживаются триггерами (см. migrations.migration_3_stats_counters):
+# stats_totals — одна строка с итогами, stats_hourly — корзины по часам UTC epoch.
+# Часовые корзины позволяют строить разбивку по дням/неделям/месяцам
+# в часовом поясе бота без пересчёта исходных таблиц. Поддерживаются только
+# пояса со смещением в целое число часов: при смещении вроде +05:30 час UTC
+# пересекает местную полночь, и часть записей попадает в соседние сутки.
+
+PERIODS = {
+    "day": 14,
+    "week": 8,
+    "month": 6,
+}
+
+
+TOTALS_QUERY = "SELECT bookings, feedback, rating_sum, rating_count FROM stats_totals WHERE id = 1"
+
+
+async def _totals() -> Tuple[int, int, int, int]:
+    return await database.fetchone(TOTALS_QUERY)
+
+
+def whole_hour_offset() -> bool:
+    """Смещение пояса бота от UTC — целое число часов (летом и зимой)"""
+    now = datetime.utcnow()
+    return all(database.LOCAL_TZ.utcoffset(now + timedelta(days=days)).total_seconds() % 3600 == 0
+               for days in (0, 91, 182, 273))
+
+
+def free_slots_count() -> int:
+    slot_index.prune(database.local_now())
+    return len(slot_index)
+
+
+async def get_stats() -> dict:
+    now_ts = database.to_epoch(database.local_now())
+    total, _, rating_sum, rating_count = await _totals()
+    last_week = await database.fetchone(
+        "SELECT COALESCE(SUM(bookings), 0) FROM stats_hourly WHERE hour >= ?",
+        ((now_ts - 7 * 86400) // 3600,))
+
+    return {
+        "total": total,
+        "last_week": last_week[0],
+        "free_slots": free_slots_count(),
+        "avg_rating": round(rating_sum / rating_count, 1) if rating_count else 0
+    }
+
+
+def _period_start(dt: datetime, period: str) -> datetime:
+    day = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    if period == "week":
+        return day - timedelta(days=day.weekday())
+    if period == "month":
+        return day.replace(day=1)
+    return day
+
+
+def _previous_start(start: datetime, period: str, steps: int) -> datetime:
+    if period == "month":
+        month = start.year * 12 + start.month - 1 - steps
+        return start.replace(year=month // 12, month=month % 12 + 1)
+    return start - timedelta(days=steps * (7 if period == "week" else 1))
+
+
+async def breakdown(period: str) -> List[Tuple[datetime, Dict[str, float]]]:
+    """Записи и отзывы по последним дням/неделям/месяцам в часовом поясе бота"""
+    count = PERIODS[period]
+    current = _period_start(database.local_now(), period)
+    since = _previous_start(current, period, count - 1)
+
+    buckets = OrderedDict()
+    for i in range(count - 1, -1, -1):
+        buckets[_previous_start(current, period, i)] = {
+            "bookings": 0, "feedback": 0, "rating_sum": 0, "rating_count": 0
+        }
+
+    rows = await database.fetchall(
+        "SELECT hour, bookings, feedback, rating_sum, rating_count FROM stats_hourly WHERE hour >= ?",
+        (database.to_epoch(since) // 3600,))
+    for hour, bookings, feedback, rating_sum, rating_count in rows:
+        start = _period_start(database.from_epoch(hour * 3600), period)
+        bucket = buckets.get(start)
+        if bucket is None:
+            continue
+        bucket["bookings"] += bookings
+        bucket["feedback"] += feedback
+        bucket["rating_sum"] += rating_sum
+        bucket["rating_count"] += rating_count
+
+    return list(buckets.items())
+
+
+HOURLY_QUERY = "SELECT hour, bookings, feedback, rating_sum, rating_count FROM stats_hourly"
+STATS_FIELDS = ("bookings", "feedback", "rating_sum", "rating_count")
+DRIFT_HOURS_SHOWN = 5
+
+
+async def _hourly(db: aiosqlite.Connection) -> Dict[int, tuple]:
+    cursor = await db.execute(HOURLY_QUERY)
+    return {row[0]: row[1:] for row in await cursor.fetchall()}
+
+
+async def rebuild_stats() -> dict:
+    """Пересчёт с нуля; возвращает расхождения старых счётчиков с новыми.
+
+    Итоги сравниваются по полям, часовые корзины — по каждому часу:
+    в отчёт попадают число разошедшихся часов и первые из них.
+    """
+    async with database.pool.writer(immediate=True) as db:
+        before = await (await db.execute(TOTALS_QUERY)).fetchone()
+        hourly_before = await _hourly(db)
+        await recompute_stats(db)
+        after = await (await db.execute(TOTALS_QUERY)).fetchone()
+        hourly_after = await _hourly(db)
+
+    drift = {name: after[i] - before[i] for i, name in enumerate(STATS_FIELDS) if after[i] != before[i]}
+
+    # Пустая корзина и отсутствующая строка равнозначны: триггеры оставляют нули после удаления
+    zero = (0,) * len(STATS_FIELDS)
+    hours = []
+    for hour in sorted(set(hourly_before) | set(hourly_after)):
+        old, new = hourly_before.get(hour, zero), hourly_after.get(hour, zero)
+        if old != new:
+            hours.append((hour, {name: new[i] - old[i] for i, name in enumerate(STATS_FIELDS) if new[i] != old[i]}))
+    if hours:
+        drift["hourly_buckets"] = len(hours)
+        drift["hourly"] = {
+            database.from_epoch(hour * 3600).strftime("%d.%m.%Y %H:00"): diff
+            for hour, diff in hours[:DRIFT_HOURS_SHOWN]
+        }
+    return drift
@@ -0,0 +1,157 @@
+import os
+import hmac
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional, Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.methods import TelegramMethod
+
+import database
+
+logger = logging.getLogger("bot")
+
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv("WEBHOOK_MAX_CONCURRENCY", "100"))
+WEBHOOK_DRAIN_TIMEOUT = 30  # секунд на обработку принятых апдейтов при остановке
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_chat_id(update: Dict[str, Any]) -> Optional[int]:
+    """Чат (или пользователь), к которому относится сырой апдейт"""
+    for key, event in update.items():
+        if key == "update_id" or not isinstance(event, dict):
+            continue
+        chat = event.get("chat") or (event.get("message") or {}).get("chat")
+        if chat:
+            return chat.get("id")
+        user = event.get("from") or event.get("user")
+        if user:
+            return user.get("id")
+    return None
+
+
+class WebhookServer:
+    """Приём апдейтов через aiohttp с обработкой в фоне.
+
+    Telegram сразу получает 200, апдейт уходит в диспетчер отдельной задачей.
+    Одновременно обрабатывается не больше max_concurrency апдейтов: при
+    заполнении ответ задерживается, и Telegram сам придерживает следующие.
+    Апдейты одного чата обрабатываются строго по очереди, чтобы шаги
+    диалога не обгоняли друг друга.
+    """
+
+    def __init__(self, dispatcher: Dispatcher, bot: Bot, secret: str,
+                 max_concurrency: int = WEBHOOK_MAX_CONCURRENCY):
+        if not secret:
+            raise ValueError("Webhook secret token is required")
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.secret = secret
+        self.max_concurrency = max_concurrency
+        self._slots = asyncio.Semaphore(max_concurrency)
+        self._tasks: Set[asyncio.Task] = set()
+        self._chat_locks: Dict[int, List] = {}  # chat_id -> [замок, число апдейтов]
+        self.ready = False
+        self.received = 0
+        self.handled = 0
+        self.failed = 0
+        self.rejected = 0
+        self.handle_time = 0.0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        token = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(token.encode(), self.secret.encode()):
+            self.rejected += 1
+            logger.warning(f"Webhook request with invalid secret from {request.remote}")
+            return web.Response(status=401)
+
+        try:
+            update = await request.json()
+        except ValueError:
+            self.rejected += 1
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            self.rejected += 1
+            return web.Response(status=400)
+
+        self.received += 1
+        await self._slots.acquire()
+        task = asyncio.create_task(self._process(update))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return web.Response()
+
+    async def _process(self, update: Dict[str, Any]):
+        started = time.monotonic()
+        chat_id = update_chat_id(update)
+        try:
+            if chat_id is None:
+                await self._feed(update)
+            else:
+                async with self._chat_lock(chat_id):
+                    await self._feed(update)
+            self.handled += 1
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Webhook update {update.get('update_id')} failed: {e}")
+        finally:
+            self.handle_time += time.monotonic() - started
+            self._slots.release()
+
+    @asynccontextmanager
+    async def _chat_lock(self, chat_id: int):
+        # Замок живёт, пока у чата есть апдейты в обработке или в очереди
+        entry = self._chat_locks.setdefault(chat_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+    async def _feed(self, update: Dict[str, Any]):
+        result = await self.dispatcher.feed_raw_update(self.bot, update)
+        # Ответ методом из обработчика: ответа на вебхук больше нет, вызываем сами
+        if isinstance(result, TelegramMethod):
+            await self.dispatcher.silent_call_request(self.bot, result)
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({"status": "ok"})
+
+    async def readiness(self, request: web.Request) -> web.Response:
+        ready = self.ready and database.pool.is_open
+        return web.json_response(
+            {"ready": ready, "in_flight": len(self._tasks)},
+            status=200 if ready else 503)
+
+    async def drain(self, timeout: float = WEBHOOK_DRAIN_TIMEOUT):
+        """Дожидается обработки уже принятых апдейтов"""
+        self.ready = False
+        if not self._tasks:
+            return
+        logger.info(f"Webhook: waiting for {len(self._tasks)} updates in flight")
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning(f"Webhook: {len(pending)} updates cancelled on shutdown")
+
+    def build_app(self, path: str) -> web.Application:
+        app = web.Application()
+        app.router.add_post(path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        app.router.add_get("/readyz", self.readiness)
+        return app
+
+    def stats(self) -> dict:
+        handled = self.handled + self.failed
+        return {
+            "received": self.received, "handled": self.handled, "failed": self.failed,
+            "rejected": self.rejected, "in_flight": len(self._tasks),
+            "avg_handle_ms": round(self.handle_time / handled * 1000, 1) if handled else 0.0,
+        }